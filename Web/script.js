@@ -5,6 +5,7 @@ const CONSOLE_ENABLED_KEY = 'roomping-console-enabled';
 const DEFAULT_CONSOLE_HEIGHT = 88;
 const MIN_CONSOLE_HEIGHT = 66;
 const MAX_CONSOLE_HEIGHT_VH = 50;
+const CHAT_PAGE_SIZE = 50;
 
 function isConsoleEnabled() {
     try {
@@ -198,6 +199,10 @@ function attachClickHandlers() {
     byId('btn-create-room-save', createRoomFromModal);
     const chatInput = document.getElementById('chat-input');
     if (chatInput) chatInput.addEventListener('keydown', (e) => { if (e.key === 'Enter') sendChatMessage(); });
+    const chatMessages = document.getElementById('chat-messages');
+    if (chatMessages) chatMessages.addEventListener('scroll', () => {
+        if (chatMessages.scrollTop < 40) loadOlderChatHistory();
+    });
     attachConsoleResizeHandle();
 }
 
@@ -253,7 +258,6 @@ async function initApp() {
     await loadRooms();
     try {
         await refreshDiscovered();
-        setInterval(refreshDiscovered, 3000);
     } catch (e) {}
     appendDebugLog('', 'Ready. Use Console and discovery to see connection and ping details.', 'info');
 }
@@ -302,18 +306,41 @@ async function pingFriend(mac, name) {
     console.log(`Pinging: ${name}`);
     if (window.pywebview && window.pywebview.api) {
         const result = await pywebview.api.ping_user(mac, name);
-        const ok = result && (result.success === true);
-        if (result && result.diagnostic) {
-            appendDebugLog(name, result.diagnostic, ok ? 'ok' : 'fail');
-        }
-        if (ok) {
-            showToast(`Ping sent to ${name}!`, "success");
-        } else {
-            const msg = result && result.hint
-                ? result.hint + (result.your_ip ? ' Your IP: ' + result.your_ip + '.' : '')
-                : (name + ' not found. Same WiFi? Is their app open? Firewall allows UDP 5005?');
-            showToast(msg, "error");
-        }
+        if (!result || !result.pending) window.onPingResult(mac, name, result);
+    }
+}
+
+// Called from Python (ping_user) once the ping has its answer or timed out
+window.onPingResult = function(mac, name, result) {
+    const ok = result && (result.success === true);
+    if (result && result.diagnostic) {
+        appendDebugLog(name, result.diagnostic, ok ? 'ok' : 'fail');
+    }
+    if (ok) {
+        showToast(`Ping sent to ${name}!`, "success");
+    } else {
+        const msg = result && result.hint
+            ? result.hint + (result.your_ip ? ' Your IP: ' + result.your_ip + '.' : '')
+            : (name + ' not found. Same WiFi? Is their app open? Firewall allows UDP 5005?');
+        showToast(msg, "error");
+    }
+};
+
+// Ping every member of a room at once; one result line per member in the console
+async function pingRoom(roomId, roomName) {
+    if (!window.pywebview?.api?.ping_room) return;
+    const summary = await pywebview.api.ping_room(roomId);
+    if (!summary || summary.error) {
+        showToast((summary && summary.error) || 'Could not ping the room.', 'error');
+        return;
+    }
+    for (const r of Object.values(summary.results || {})) {
+        appendDebugLog(r.name, r.diagnostic, r.delivered ? 'ok' : 'fail');
+    }
+    if (!summary.total) {
+        showToast(`No one else in ${roomName} to ping.`, 'error');
+    } else {
+        showToast(`Pinged ${roomName}: ${summary.delivered}/${summary.total} delivered`, summary.delivered ? 'success' : 'error');
     }
 }
 
@@ -356,6 +383,8 @@ async function loadFriends() {
     friendsList.innerHTML = '';
 
     const users = settings.users || [];
+    friendMacSet = new Set(users.map(u => normMac(u.mac)));
+    for (const card of discoveredCards.values()) renderDiscoveredFriendButton(card);
     if (users.length === 0) {
         friendsList.innerHTML = '<p style="text-align:center; color:#666; margin-top:20px;">No friends yet. Add people from the network above or use + Add Roommate to add manually.</p>';
         return;
@@ -384,8 +413,6 @@ async function loadFriends() {
         <button class="delete-btn" type="button">🗑️</button>
     </div>
 `;
-        const statusEl = card.querySelector('.status');
-        const ipEl = card.querySelector('.card-ip');
         card.querySelector('.delete-btn').addEventListener('click', (e) => {
             e.stopPropagation();
             deleteFriend(e, user.mac);
@@ -405,77 +432,199 @@ async function loadFriends() {
             });
         }
         friendsList.appendChild(card);
+        appendDebugLog(user.name, user.ip ? 'Using saved IP for ' + user.name + '…' : 'Checking network for MAC ' + user.mac + '…', 'info');
+    }
 
-        // Resolve reachability and IP in one scan; update status light and show IP under name; log to debug panel
-        if (window.pywebview && window.pywebview.api && window.pywebview.api.get_reachability_and_ip) {
-            try {
-                appendDebugLog(user.name, user.ip ? 'Using saved IP for ' + user.name + '…' : 'Checking network for MAC ' + user.mac + '…', 'info');
-                const result = await pywebview.api.get_reachability_and_ip(user.mac, user.name, user.ip || null);
-                if (statusEl.parentNode) {
-                    statusEl.className = 'status ' + (result.reachable ? 'online' : 'offline');
-                    statusEl.title = result.reachable
-                        ? 'Online – we resolved their IP from MAC'
-                        : 'Offline – could not find this MAC on the network. Same WiFi? Same subnet? Try refresh.';
-                }
-                if (ipEl && ipEl.parentNode) {
-                    if (result.ip) {
-                        ipEl.textContent = 'IP: ' + result.ip;
-                        ipEl.style.display = '';
-                    } else {
-                        ipEl.style.display = 'none';
-                    }
-                }
-                if (result.diagnostic) {
-                    appendDebugLog(user.name, result.diagnostic, result.reachable ? 'ok' : 'fail');
-                }
-            } catch (err) {
-                if (statusEl.parentNode) {
-                    statusEl.className = 'status offline';
-                    statusEl.title = 'Check failed';
-                }
-                if (ipEl) ipEl.style.display = 'none';
+    // Resolve everyone with at most one network scan; results stream in via onFriendResolved
+    if (window.pywebview && window.pywebview.api && window.pywebview.api.resolve_all) {
+        friendResolvedMacs.clear();
+        try {
+            const results = await pywebview.api.resolve_all(users.map(u => u.mac));
+            for (const [mac, result] of Object.entries(results || {})) {
+                if (!friendResolvedMacs.has(normMac(mac))) window.onFriendResolved(mac, result);
+            }
+        } catch (err) {
+            for (const user of users) {
+                if (friendResolvedMacs.has(normMac(user.mac))) continue;
+                applyFriendStatus(user.mac, null);
                 appendDebugLog(user.name, 'Check failed: ' + (err.message || 'error'), 'fail');
             }
+        }
+    } else {
+        for (const user of users) applyFriendStatus(user.mac, null, 'Unknown');
+    }
+}
+
+function normMac(mac) {
+    return (mac || '').toLowerCase().replace(/-/g, ':');
+}
+
+function findFriendCard(mac) {
+    const target = normMac(mac);
+    for (const card of document.querySelectorAll('#friends-list .card')) {
+        if (normMac(card.dataset.mac) === target) return card;
+    }
+    return null;
+}
+
+// Update a friend card's status light and IP line; result null = check failed / unknown
+function applyFriendStatus(mac, result, failTitle) {
+    const card = findFriendCard(mac);
+    if (!card) return;
+    const statusEl = card.querySelector('.status');
+    const ipEl = card.querySelector('.card-ip');
+    if (!result) {
+        statusEl.className = 'status offline';
+        statusEl.title = failTitle || 'Check failed';
+        if (ipEl) ipEl.style.display = 'none';
+        return;
+    }
+    statusEl.className = 'status ' + (result.reachable ? 'online' : 'offline');
+    statusEl.title = result.reachable
+        ? 'Online – we resolved their IP from MAC'
+        : (result.last_tried != null
+            ? result.diagnostic
+            : 'Offline – could not find this MAC on the network. Same WiFi? Same subnet? Try refresh.');
+    if (ipEl) {
+        if (result.ip) {
+            ipEl.textContent = 'IP: ' + result.ip;
+            ipEl.style.display = '';
         } else {
-            statusEl.className = 'status offline';
-            statusEl.title = 'Unknown';
-            if (ipEl) ipEl.style.display = 'none';
+            ipEl.style.display = 'none';
         }
     }
 }
 
+// Called from Python (resolve_all) as each friend's reachability becomes known
+const friendResolvedMacs = new Set();
+window.onFriendResolved = function(mac, result) {
+    friendResolvedMacs.add(normMac(mac));
+    applyFriendStatus(mac, result);
+    if (result && result.diagnostic) {
+        const card = findFriendCard(mac);
+        const name = card ? card.querySelector('h3').textContent : mac;
+        appendDebugLog(name, result.diagnostic, result.reachable ? 'ok' : 'fail');
+    }
+};
+
+// Called from Python while a MAC -> IP sweep runs (throttled; done=true once at the end)
+window.onScanProgress = function(progress) {
+    if (!progress) return;
+    const where = progress.subnet ? ' – ' + progress.subnet : '';
+    const verb = progress.done ? 'Scan finished: ' : 'Scanning: ';
+    appendDebugLog('Scan', verb + progress.probed + '/' + progress.total + ' addresses' + where + ' (' + Number(progress.elapsed).toFixed(1) + 's)', 'info');
+};
+
+// Discovered peers: loaded once (refreshDiscovered), then kept current by onPeersChanged pushes from Python
+let peersVersion = null;       // version of the peer table the list shows; null until loaded
+let peersLoading = null;       // pushes that arrived while a snapshot was loading, else null
+const discoveredCards = new Map(); // normalised MAC -> card element
+let friendMacSet = new Set();  // normalised MACs of friends, kept by loadFriends
+
 async function refreshDiscovered() {
-    if (!window.pywebview?.api?.get_discovered_peers) return;
+    if (!window.pywebview?.api?.get_peer_table) return;
+    peersLoading = [];
     try {
-        const peers = await pywebview.api.get_discovered_peers();
-        const settings = await pywebview.api.get_settings();
-        const friendMacs = new Set((settings.users || []).map(u => (u.mac || '').toLowerCase().replace(/-/g, ':')));
+        const table = await pywebview.api.get_peer_table();
         const listEl = document.getElementById('discovered-list');
         if (!listEl) return;
         listEl.innerHTML = '';
-        for (const peer of peers) {
-            const macNorm = (peer.mac || '').toLowerCase().replace(/-/g, ':');
-            const isFriend = friendMacs.has(macNorm);
-            const card = document.createElement('div');
-            card.className = 'discovered-card';
-            card.innerHTML = `
-                <div class="status ${peer.online ? 'online' : 'offline'}" title="${peer.online ? 'Online' : 'Offline'}"></div>
-                <div class="info">
-                    <h3>${escapeHtml(peer.name)}</h3>
-                    <p>${escapeHtml(peer.mac)}${peer.ip ? ' · ' + escapeHtml(peer.ip) : ''}</p>
-                </div>
-                ${isFriend ? '<span class="add-friend-btn is-friend">Friend</span>' : '<button type="button" class="add-friend-btn">Add as friend</button>'}
-            `;
-            if (!isFriend) {
-                const btn = card.querySelector('.add-friend-btn');
-                btn.addEventListener('click', (e) => { e.stopPropagation(); addFriendFromDiscovery(peer); });
-            }
-            listEl.appendChild(card);
+        discoveredCards.clear();
+        for (const peer of table.peers || []) upsertDiscoveredPeer(peer);
+        peersVersion = table.version;
+        const missed = peersLoading;
+        peersLoading = null;
+        for (const [version, peers] of missed) window.onPeersChanged(version, peers);
+        updateDiscoveredEmptyHint();
+    } catch (e) {
+    } finally {
+        peersLoading = null;
+    }
+}
+
+// Called from Python with the peers that were added, changed, went stale or were forgotten ({mac, removed: true})
+// since push version - 1
+window.onPeersChanged = function(version, peers) {
+    if (peersLoading) {
+        peersLoading.push([version, peers]);
+        return;
+    }
+    if (peersVersion !== null && version <= peersVersion) return;
+    if (peersVersion === null || version !== peersVersion + 1) {
+        refreshDiscovered(); // missed a push (or never loaded); reload the whole table once
+        return;
+    }
+    peersVersion = version;
+    for (const peer of peers || []) {
+        if (peer.removed) {
+            const card = discoveredCards.get(normMac(peer.mac));
+            if (card) card.remove();
+            discoveredCards.delete(normMac(peer.mac));
+            continue;
         }
-        if (peers.length === 0) {
-            listEl.innerHTML = '<p class="section-hint" style="margin:0;">No other RoomPing Pro users on the network yet.</p>';
+        upsertDiscoveredPeer(peer);
+        if (peer.online && findFriendCard(peer.mac)) {
+            applyFriendStatus(peer.mac, { reachable: true, ip: peer.ip, diagnostic: 'Online – seen via discovery beacon' });
         }
-    } catch (e) {}
+    }
+    updateDiscoveredEmptyHint();
+};
+
+function discoveredSortKey(card) {
+    return (card.dataset.online === '1' ? '0' : '1') + card.dataset.sortName;
+}
+
+// Create or update one peer's card in place, keeping the list sorted online first, then by name
+function upsertDiscoveredPeer(peer) {
+    const listEl = document.getElementById('discovered-list');
+    if (!listEl) return;
+    const macNorm = normMac(peer.mac);
+    let card = discoveredCards.get(macNorm);
+    if (!card) {
+        card = document.createElement('div');
+        card.className = 'discovered-card';
+        discoveredCards.set(macNorm, card);
+    } else {
+        card.remove();
+    }
+    card.dataset.mac = macNorm;
+    card.dataset.online = peer.online ? '1' : '0';
+    card.dataset.sortName = (peer.name || '').toLowerCase();
+    card.innerHTML = `
+        <div class="status ${peer.online ? 'online' : 'offline'}" title="${peer.online ? 'Online' : 'Offline'}"></div>
+        <div class="info">
+            <h3>${escapeHtml(peer.name)}</h3>
+            <p>${escapeHtml(peer.mac)}${peer.ip ? ' · ' + escapeHtml(peer.ip) : ''}</p>
+        </div>
+        <span class="add-friend-slot"></span>
+    `;
+    card.peer = peer;
+    renderDiscoveredFriendButton(card);
+    const key = discoveredSortKey(card);
+    const next = Array.from(listEl.querySelectorAll('.discovered-card')).find(c => discoveredSortKey(c) > key);
+    listEl.insertBefore(card, next || null);
+}
+
+function renderDiscoveredFriendButton(card) {
+    const slot = card.querySelector('.add-friend-slot');
+    if (!slot) return;
+    if (friendMacSet.has(card.dataset.mac)) {
+        slot.innerHTML = '<span class="add-friend-btn is-friend">Friend</span>';
+        return;
+    }
+    slot.innerHTML = '<button type="button" class="add-friend-btn">Add as friend</button>';
+    slot.querySelector('.add-friend-btn').addEventListener('click', (e) => { e.stopPropagation(); addFriendFromDiscovery(card.peer); });
+}
+
+function updateDiscoveredEmptyHint() {
+    const listEl = document.getElementById('discovered-list');
+    if (!listEl) return;
+    const hint = listEl.querySelector('.discovered-empty');
+    if (discoveredCards.size === 0 && !hint) {
+        listEl.insertAdjacentHTML('beforeend', '<p class="section-hint discovered-empty" style="margin:0;">No other RoomPing Pro users on the network yet.</p>');
+    } else if (discoveredCards.size > 0 && hint) {
+        hint.remove();
+    }
 }
 
 async function addFriendFromDiscovery(peer) {
@@ -486,7 +635,6 @@ async function addFriendFromDiscovery(peer) {
     }
     showToast(`Added ${peer.name} as a friend.`, 'success');
     await loadFriends();
-    refreshDiscovered();
 }
 
 // --- PEER KEY (must match bridge) ---
@@ -500,6 +648,8 @@ function roomPeerKey(roomId) {
 
 // --- CHAT MODAL ---
 let currentChatPeerKey = null;
+let chatOldestSeq = 0;      // seq of the oldest message shown; 0 = nothing older to load
+let chatLoadingOlder = false;
 
 async function openChatModal(peerKey, title, options = {}) {
     const overlay = document.getElementById('chat-modal');
@@ -524,32 +674,79 @@ function closeChatModal() {
     currentChatPeerKey = null;
 }
 
+// delivered: true / false once known, null while waiting for the ack, undefined for no marker
+function createChatMessageEl(direction, senderName, text, timestamp, seq, delivered) {
+    const div = document.createElement('div');
+    div.className = 'chat-msg ' + (direction === 'out' ? 'out' : 'in');
+    if (seq !== undefined && seq !== null) div.dataset.seq = seq;
+    const timeStr = timestamp ? new Date(timestamp * 1000).toLocaleTimeString() : '';
+    const meta = direction === 'in' && senderName ? escapeHtml(senderName) + (timeStr ? ' · ' + timeStr : '') : timeStr;
+    div.innerHTML = '<span class="chat-msg-text">' + escapeHtml(text || '') + '</span>' +
+        '<div class="chat-msg-meta">' + meta + '<span class="chat-msg-status"></span></div>';
+    setChatMessageStatus(div, delivered);
+    return div;
+}
+
+function setChatMessageStatus(div, delivered) {
+    const el = div.querySelector('.chat-msg-status');
+    if (!el) return;
+    el.textContent = delivered === true ? ' · Delivered' : delivered === false ? ' · Not delivered' : delivered === null ? ' · Sending…' : '';
+    div.classList.toggle('undelivered', delivered === false);
+}
+
+// History entries still marked null were never settled (app closed first): show no marker for those
+function historyDelivered(msg) {
+    return msg.direction === 'out' && msg.delivered !== null ? msg.delivered : undefined;
+}
+
+// Newest page only; older pages are fetched by loadOlderChatHistory as the user scrolls up.
 async function loadChatHistoryIntoModal(peerKey) {
     const container = document.getElementById('chat-messages');
     if (!container || !window.pywebview?.api?.get_message_history) return;
-    const history = await pywebview.api.get_message_history(peerKey);
+    chatOldestSeq = 0;
+    const history = await pywebview.api.get_message_history(peerKey, null, CHAT_PAGE_SIZE);
+    if (currentChatPeerKey !== peerKey) return;
     container.innerHTML = '';
     for (const msg of history) {
-        const div = document.createElement('div');
-        div.className = 'chat-msg ' + (msg.direction === 'out' ? 'out' : 'in');
-        const timeStr = msg.timestamp ? new Date(msg.timestamp * 1000).toLocaleTimeString() : '';
-        const meta = msg.direction === 'in' && msg.sender_name ? escapeHtml(msg.sender_name) + (timeStr ? ' · ' + timeStr : '') : timeStr;
-        div.innerHTML = '<span class="chat-msg-text">' + escapeHtml(msg.text || '') + '</span>' + (meta ? '<div class="chat-msg-meta">' + meta + '</div>' : '');
-        container.appendChild(div);
+        container.appendChild(createChatMessageEl(msg.direction, msg.sender_name, msg.text, msg.timestamp, msg.seq, historyDelivered(msg)));
     }
+    chatOldestSeq = history.length ? (history[0].seq || 0) : 0;
     container.scrollTop = container.scrollHeight;
 }
 
-function appendChatMessageToModal(peerKey, direction, senderName, text, timestamp) {
+async function loadOlderChatHistory() {
+    const container = document.getElementById('chat-messages');
+    const peerKey = currentChatPeerKey;
+    if (!container || !peerKey || chatOldestSeq <= 0 || chatLoadingOlder) return;
+    chatLoadingOlder = true;
+    try {
+        const older = await pywebview.api.get_message_history(peerKey, chatOldestSeq, CHAT_PAGE_SIZE);
+        if (currentChatPeerKey !== peerKey) return;
+        // Prepend without moving what the user is looking at
+        const prevHeight = container.scrollHeight;
+        const frag = document.createDocumentFragment();
+        for (const msg of older) {
+            frag.appendChild(createChatMessageEl(msg.direction, msg.sender_name, msg.text, msg.timestamp, msg.seq, historyDelivered(msg)));
+        }
+        container.insertBefore(frag, container.firstChild);
+        container.scrollTop += container.scrollHeight - prevHeight;
+        chatOldestSeq = older.length ? (older[0].seq || 0) : 0;
+    } catch (e) {
+    } finally {
+        chatLoadingOlder = false;
+    }
+}
+
+function appendChatMessageToModal(peerKey, direction, senderName, text, timestamp, seq, delivered) {
     if (currentChatPeerKey !== peerKey) return;
     const container = document.getElementById('chat-messages');
     if (!container) return;
-    const div = document.createElement('div');
-    div.className = 'chat-msg ' + (direction === 'out' ? 'out' : 'in');
-    const timeStr = timestamp ? new Date(timestamp * 1000).toLocaleTimeString() : '';
-    const meta = direction === 'in' && senderName ? escapeHtml(senderName) + (timeStr ? ' · ' + timeStr : '') : timeStr;
-    div.innerHTML = '<span class="chat-msg-text">' + escapeHtml(text || '') + '</span>' + (meta ? '<div class="chat-msg-meta">' + meta + '</div>' : '');
-    container.appendChild(div);
+    const early = peerKey + '#' + seq;
+    if (delivered === null && earlyMessageStatus.has(early)) {
+        delivered = earlyMessageStatus.get(early);
+        earlyMessageStatus.delete(early);
+    }
+    container.appendChild(createChatMessageEl(direction, senderName, text, timestamp, seq, delivered));
     container.scrollTop = container.scrollHeight;
 }
 
@@ -561,23 +758,30 @@ async function sendChatMessage() {
     if (!text) return;
     const friendMac = overlay.dataset.friendMac || '';
     const roomId = overlay.dataset.roomId || '';
-    if (roomId) {
-        const result = await pywebview.api.send_room_message(roomId, text);
-        if (result && result.status === 'error') {
-            showToast(result.message || 'Send failed.', 'error');
-            return;
-        }
-    } else {
-        const result = await pywebview.api.send_message(friendMac, text);
-        if (result && result.status === 'error') {
-            showToast(result.message || 'Send failed.', 'error');
-            return;
-        }
+    const result = roomId
+        ? await pywebview.api.send_room_message(roomId, text)
+        : await pywebview.api.send_message(friendMac, text);
+    if (result && result.status === 'error') {
+        showToast(result.message || 'Send failed.', 'error');
+        return;
     }
     inputEl.value = '';
     const myName = (await pywebview.api.get_settings()).display_name || '';
-    appendChatMessageToModal(currentChatPeerKey, 'out', myName, text, Date.now() / 1000);
-}
+    const tracked = result && result.seq !== undefined && result.seq !== null && !(roomId && !result.sent_to);
+    appendChatMessageToModal(currentChatPeerKey, 'out', myName, text, Date.now() / 1000, result && result.seq, tracked ? null : undefined);
+}
+
+// Called from Python once every recipient of an outgoing message has acked it or given up; delivered is null
+// when some were older apps that never ack, so it is not known (no marker).
+// (an ack can beat sendChatMessage to adding the bubble; earlyMessageStatus holds it until then)
+const earlyMessageStatus = new Map();
+window.onMessageStatus = function(peerKey, seq, delivered) {
+    if (currentChatPeerKey !== peerKey || seq === null || seq === undefined) return;
+    if (delivered === null) delivered = undefined;
+    const el = document.querySelector('#chat-messages .chat-msg[data-seq="' + seq + '"]');
+    if (el) setChatMessageStatus(el, delivered);
+    else earlyMessageStatus.set(peerKey + '#' + seq, delivered);
+};
 
 // Called from Python when a new message is received
 window.onIncomingMessage = function(peerKey, senderName, senderMac, text, roomId, roomName) {
@@ -604,11 +808,15 @@ async function loadRooms() {
                 <h3 class="room-name">${escapeHtml(room.name || 'Room')}</h3>
                 <p class="room-members">${memberCount} member(s)</p>
             </div>
-            <button type="button" class="room-open-btn">Chat</button>
+            <div class="card-actions">
+                <button type="button" class="room-open-btn room-ping-btn" title="Ping everyone in this room">Ping all</button>
+                <button type="button" class="room-open-btn room-chat-btn">Chat</button>
+            </div>
         `;
-        card.querySelector('.room-open-btn').addEventListener('click', () => {
+        card.querySelector('.room-chat-btn').addEventListener('click', () => {
             openChatModal(roomPeerKey(room.id), room.name || 'Room', { roomId: room.id, roomName: room.name });
         });
+        card.querySelector('.room-ping-btn').addEventListener('click', () => pingRoom(room.id, room.name || 'Room'));
         listEl.appendChild(card);
     }
 }
@@ -740,8 +948,22 @@ function showToast(message, type) {
 }
 
 // --- PYTHON CALLBACKS ---
-window.showAlert = function(senderIp) {
-    showToast(`<strong>PING!</strong> From: ${senderIp}`, "success");
+// Python batches its calls (ui_events.py): uiBatch([[fn, args, count], ...]); count > 1 means that many merged repeats
+window.uiBatch = function(events) {
+    for (const [fn, args, count] of events || []) {
+        const handler = window[fn];
+        if (typeof handler !== 'function') continue;
+        try {
+            handler(...args, ...(count > 1 ? [count] : []));
+        } catch (e) {
+            console.log('UI event ' + fn + ' failed', e);
+        }
+    }
+};
+
+window.showAlert = function(senderIp, count) {
+    const times = count > 1 ? ` (×${count})` : '';
+    showToast(`<strong>PING!</strong> From: ${escapeHtml(senderIp)}${times}`, "success");
     if (audioEnabled) {
         const audio = document.getElementById('ping-sound');
         if (audio) {
@@ -1,3 +1,4 @@
+import atexit
 import json
 import os
 import re
@@ -14,9 +15,19 @@ from logic import (
     DEFAULT_PORT,
     DISCOVERY_PORT,
     MESSAGE_PORT,
-    BEACON_INTERVAL,
     PEER_STALE_SECONDS,
+    BINARY_PROTO,
+    PROTO_VERSION,
+    message_fits,
 )
+from peers import PeerTable
+from resolver import OBSERVED_SOURCES, SOURCE_LABELS, MacResolver
+from runtime import PING_TIMEOUT, NetworkRuntime
+from storage import MessageHistory, SettingsStore
+from ui_events import UIDispatcher
+
+# Peer table changes are collected for this long (seconds) and pushed to the UI together (onPeersChanged)
+PEER_PUSH_DELAY = 0.25
 
 def _project_dir():
     """Project root when running from source; exe/app folder when built (so settings persist)."""
@@ -51,9 +62,20 @@ class Bridge:
         self.engine = NetworkEngine()
         self.settings_file = os.path.join(_project_dir(), "settings.json")
         self._alerts_window = None
-        self._discovered_peers = {}  # mac -> {ip, name, mac, port, last_seen}
-        self._discovery_lock = threading.Lock()
+        self._main_window = None
+        self.ui = UIDispatcher(lambda: self._main_window)  # batched calls into the main window's JS
+        self.peers = PeerTable()  # peers heard via discovery beacons (never this device)
+        self._discovery_lock = threading.Lock()  # guards the onPeersChanged state below
+        self._peers_version = 0  # bumped with every onPeersChanged push
+        self._peer_changes = {}  # mac -> peer view (or removal) not pushed yet
+        self._peer_push_pending = False
+        self._stale_check_pending = False
         self._ensure_settings_exists()
+        self._settings = SettingsStore(self.settings_file)
+        atexit.register(self._settings.flush)
+        self._history = MessageHistory(self._message_history_dir())
+        self.resolver = MacResolver(self.engine, self._stored_friend_ip)
+        self.network = NetworkRuntime(self.engine)
 
     def _ensure_settings_exists(self):
         """Create settings.json from example or default on first run (plug-and-play)."""
@@ -70,6 +92,20 @@ class Bridge:
         """Hook for main.py to provide the floating alerts window instance."""
         self._alerts_window = window
 
+    def set_main_window(self, window):
+        """Hook for main.py to provide the main window, so results can be pushed to the UI."""
+        self._main_window = window
+
+    def _notify_ui(self, fn_name, *args, merge=None):
+        """Call window.<fn_name>(*args) in the main window's JS, batched with other UI events (see UIDispatcher;
+        merge folds repeats into one call). Arguments are JSON-encoded (no injection)."""
+        if self._main_window is None:
+            return
+        try:
+            self.ui.post(fn_name, *args, merge=merge)
+        except Exception as e:
+            print(f"UI update error ({fn_name}): {e}")
+
     def set_alerts_visible(self, visible):
         """Show or hide the floating alerts window from JS."""
         if self._alerts_window is None:
@@ -86,35 +122,33 @@ class Bridge:
     def set_display_name(self, name):
         """Set the display name shown to others on the network (beacon)."""
         name = (name or "").strip()
-        settings = self.get_settings()
-        settings["display_name"] = name
-        with open(self.settings_file, "w") as f:
-            json.dump(settings, f, indent=4)
+        with self._settings.edit() as settings:
+            settings["display_name"] = name
+        self.network.beacon_now()  # let others see the new name now, not at the next beacon
         return {"status": "success"}
 
     def set_alerts_pinned(self, pinned):
         """Remember whether user has opted in to the floating alerts window."""
-        settings = self.get_settings()
-        settings["alerts_pinned"] = bool(pinned)
-        with open(self.settings_file, "w") as f:
-            json.dump(settings, f, indent=4)
+        with self._settings.edit() as settings:
+            settings["alerts_pinned"] = bool(pinned)
         return {"status": "success", "alerts_pinned": settings["alerts_pinned"]}
 
     def is_alerts_pinned(self):
         """Return True if user has opted in to the floating alerts window."""
-        settings = self.get_settings()
+        settings = self._settings.get()
         return bool(settings.get("alerts_pinned"))
 
     def get_settings(self):
-        if os.path.exists(self.settings_file):
-            with open(self.settings_file, "r") as f:
-                s = json.load(f)
-                s.setdefault("users", [])
-                s.setdefault("display_name", "")
-                s.setdefault("alerts_pinned", False)
-                s.setdefault("rooms", [])
-                return s
-        return {"users": [], "display_name": "", "alerts_pinned": False, "rooms": []}
+        """Copy of the current settings (safe for the caller to modify)."""
+        return self._settings.copy()
+
+    def _edit_settings(self):
+        """Batch settings changes: `with self._edit_settings() as settings: ...`.
+
+        Changes are applied in memory and written to disk once, shortly after the outermost block
+        exits. Nested blocks (e.g. update_user_ip then update_user_diagnostic) share one write.
+        """
+        return self._settings.edit()
 
     def _mac_norm(self, mac):
         return (mac or "").lower().replace("-", ":")
@@ -158,26 +192,22 @@ class Bridge:
             return {"status": "error", "message": "Name and MAC address are required."}
         if optional_ip and not self._looks_like_ip(optional_ip):
             return {"status": "error", "message": "If you enter an IP, it must be valid (e.g. 192.168.1.42)."}
-        settings = self.get_settings()
-        if "users" not in settings:
-            settings["users"] = []
-        settings["users"].append({"name": name, "mac": mac, "ip": optional_ip if optional_ip else ""})
-        self._ensure_user_ip_slots(settings)
-        with open(self.settings_file, "w") as f:
-            json.dump(settings, f, indent=4)
+        with self._edit_settings() as settings:
+            if "users" not in settings:
+                settings["users"] = []
+            settings["users"].append({"name": name, "mac": mac, "ip": optional_ip if optional_ip else ""})
+            self._ensure_user_ip_slots(settings)
         return {"status": "success"}
 
     def update_user_ip(self, mac, ip):
         """Store or update the last-known IP for this MAC. MAC is only the lookup key; we hold the IP for sending pings."""
         if not mac or not ip:
             return
-        settings = self.get_settings()
-        user = self._find_user_by_mac(settings, mac)
-        if user is not None:
-            user["ip"] = ip
-            self._ensure_user_ip_slots(settings)
-            with open(self.settings_file, "w") as f:
-                json.dump(settings, f, indent=4)
+        with self._edit_settings() as settings:
+            user = self._find_user_by_mac(settings, mac)
+            if user is not None:
+                user["ip"] = ip
+                self._ensure_user_ip_slots(settings)
 
     def set_user_ip(self, mac, ip):
         """Manually set (or clear) the stored IP for a roommate from the UI."""
@@ -188,14 +218,12 @@ class Bridge:
 
         # Clearing IP: user wants us to forget it and re-detect from MAC next time
         if not ip:
-            settings = self.get_settings()
-            user = self._find_user_by_mac(settings, mac)
-            if user is not None:
-                user["ip"] = ""
-                self._ensure_user_ip_slots(settings)
-                with open(self.settings_file, "w") as f:
-                    json.dump(settings, f, indent=4)
-                self.update_user_diagnostic(mac, "Cleared IP; will try to auto-detect from MAC next time.")
+            with self._edit_settings() as settings:
+                user = self._find_user_by_mac(settings, mac)
+                if user is not None:
+                    user["ip"] = ""
+                    self._ensure_user_ip_slots(settings)
+                    self.update_user_diagnostic(mac, "Cleared IP; will try to auto-detect from MAC next time.")
             return {
                 "status": "success",
                 "ip": "",
@@ -209,22 +237,26 @@ class Bridge:
                 "message": "Enter a valid IPv4 address like 192.168.1.42.",
             }
 
-        self.update_user_ip(mac, ip)
         msg = f"IP manually set to {ip}. We'll use this for pings."
-        self.update_user_diagnostic(mac, msg)
+        self._update_user_status(mac, msg, ip)
         return {"status": "success", "ip": ip, "diagnostic": msg}
 
     def update_user_diagnostic(self, mac, message):
         """Store a short status message for this roommate so the user knows where things stand."""
         if not mac:
             return
-        settings = self.get_settings()
-        user = self._find_user_by_mac(settings, mac)
-        if user is not None:
-            user["last_check"] = message
-            self._ensure_user_ip_slots(settings)
-            with open(self.settings_file, "w") as f:
-                json.dump(settings, f, indent=4)
+        with self._edit_settings() as settings:
+            user = self._find_user_by_mac(settings, mac)
+            if user is not None:
+                user["last_check"] = message
+                self._ensure_user_ip_slots(settings)
+
+    def _update_user_status(self, mac, message, ip=None):
+        """Save diagnostic (and IP, if given) for this roommate in one settings write."""
+        with self._edit_settings():
+            if ip:
+                self.update_user_ip(mac, ip)
+            self.update_user_diagnostic(mac, message)
 
     def check_reachable(self, mac, name):
         """Return True if this MAC can be resolved on the network (online), False otherwise."""
@@ -232,29 +264,57 @@ class Bridge:
         return result["reachable"]
 
     def get_reachability_and_ip(self, mac, name, ip=None):
-        """Run one network scan; return reachable, ip, and a diagnostic. If a valid saved ip is passed, skip scan and use it."""
+        """Resolve MAC -> IP (scanning only if nothing fresher is known); return reachable, ip, source, age and a diagnostic. A valid saved ip passed in is used like the stored one.
+        If recent scans could not find this MAC, answers "offline" at once (with last_tried / retry_in seconds) instead of scanning again."""
         if not mac:
             return {"reachable": False, "ip": None, "diagnostic": "No MAC provided."}
-        my_mac = self.engine.get_my_mac().lower()
-        mac_clean = self._mac_norm(mac)
-        if mac_clean == my_mac or (name and name.lower() in socket.gethostname().lower()):
-            self.update_user_ip(mac, "127.0.0.1")
-            msg = "This device (you)."
-            self.update_user_diagnostic(mac, msg)
-            return {"reachable": True, "ip": "127.0.0.1", "diagnostic": msg}
-        # Use saved IP when provided so we don't run a scan (e.g. device doesn't respond to ping)
+        result = self._reachability_without_scan(mac, name, ip)
+        if result is not None:
+            return result
+        backoff = self.resolver.backoff(mac)
+        if backoff is not None:
+            return self._reachability_offline(backoff)
+        res = self.resolver.scan([mac], on_progress=self._report_scan_progress).get(self._mac_norm(mac))
+        if res is not None:
+            return self._reachability_found(mac, res)
+        return self._reachability_not_found(mac)
+
+    def _reachability_without_scan(self, mac, name, ip=None):
+        """Answer from what we already know (self, beacons/traffic, saved IP, neighbour table); None if a scan is needed."""
+        if name and name.lower() in socket.gethostname().lower():
+            return self._reachability_found(mac, self.resolver.lookup(self.engine.get_my_mac()))
         saved_ip = (ip or "").strip()
-        if saved_ip and self._looks_like_ip(saved_ip):
-            self.update_user_ip(mac, saved_ip)
-            msg = f"Using saved IP {saved_ip}. Ready to ping (no scan)."
-            self.update_user_diagnostic(mac, msg)
-            return {"reachable": True, "ip": saved_ip, "diagnostic": msg}
-        ip = self.engine.scan_network(mac, name or "")
-        if ip:
-            self.update_user_ip(mac, ip)  # save IP so we can ping without rescanning
-            msg = f"Found at {ip} and saved. Ready to ping."
-            self.update_user_diagnostic(mac, msg)
-            return {"reachable": True, "ip": ip, "diagnostic": msg}
+        res = self.resolver.lookup(mac, saved_ip if self._looks_like_ip(saved_ip) else None)
+        if res is None:
+            return None
+        return self._reachability_found(mac, res)
+
+    def _report_scan_progress(self, progress):
+        """Show sweep progress (see NetworkEngine.scan_for_macs) in the UI console."""
+        self._notify_ui("onScanProgress", progress, merge="onScanProgress")  # only the latest matters
+
+    def _reachability_found(self, mac, res):
+        """Save res (a resolver.Resolution) for this friend and describe it."""
+        if res.source == "self":
+            msg = "This device (you)."
+        elif res.source == "stored":
+            msg = f"Using saved IP {res.ip}. Ready to ping (no scan)."
+        elif res.source == "scan":
+            msg = f"Found at {res.ip} and saved. Ready to ping."
+        elif res.source in OBSERVED_SOURCES:
+            msg = f"Found at {res.ip} ({SOURCE_LABELS[res.source]}, {res.age:.0f}s ago). Ready to ping (no scan)."
+        else:
+            msg = f"Found at {res.ip} ({SOURCE_LABELS[res.source]}, {res.age:.0f}s ago) and saved. Ready to ping (no scan)."
+        self._update_user_status(mac, msg, self._ip_to_save(res))  # save IP so we can ping without rescanning
+        return {"reachable": True, "ip": res.ip, "source": res.source, "age": round(res.age, 1), "diagnostic": msg}
+
+    @staticmethod
+    def _ip_to_save(res):
+        """res.ip if it may be saved for the friend (a resolver.Resolution), else None: beacon / traffic IPs stay in
+        the resolver's memory only (see observe_peer)."""
+        return None if res.source in OBSERVED_SOURCES else res.ip
+
+    def _reachability_not_found(self, mac):
         msg = (
             "Could not find on network. Possible: different WiFi/subnet, their device off, "
             "or their firewall blocking discovery (ping)."
@@ -262,65 +322,132 @@ class Bridge:
         self.update_user_diagnostic(mac, msg)
         return {"reachable": False, "ip": None, "diagnostic": msg}
 
-    def _send_ping(self, target_ip, wait_for_pong_seconds=2.0):
-        """Send PING to target_ip; if receiver sends PONG back, return (True, True). Else (True, False) or (False, False) on send error."""
+    def _reachability_offline(self, backoff):
+        """Answer for a MAC the resolver is backing off from (resolver.Backoff); nothing is sent or saved."""
+        msg = f"Offline (last tried {backoff.age:.0f}s ago). Will look again when they show up or in {backoff.retry_in:.0f}s."
+        return {"reachable": False, "ip": None, "last_tried": round(backoff.age), "retry_in": round(backoff.retry_in), "diagnostic": msg}
+
+    def resolve_all(self, macs):
+        """Reachability and IP for many friends with at most one network sweep between them.
+
+        Each result is pushed to the UI (onFriendResolved(mac, result)) as soon as it is known, so
+        online friends light up before the sweep ends. Returns {mac: result} for every MAC given.
+        """
+        settings = self._settings.get()
+        results = {}
+        pending = {}  # normalised MAC -> MAC as given
+
+        def report(mac, result):
+            results[mac] = result
+            self._notify_ui("onFriendResolved", mac, result)
+
+        for mac in macs or []:
+            if not mac or mac in results:
+                continue
+            user = self._find_user_by_mac(settings, mac) or {}
+            result = self._reachability_without_scan(mac, user.get("name") or "")
+            if result is None:
+                backoff = self.resolver.backoff(mac)
+                if backoff is not None:
+                    result = self._reachability_offline(backoff)
+            if result is not None:
+                report(mac, result)
+            else:
+                pending[self._mac_norm(mac)] = mac
+        if pending:
+            self.resolver.scan(
+                list(pending),
+                on_found=lambda mac_clean, res: report(pending[mac_clean], self._reachability_found(pending[mac_clean], res)),
+                on_progress=self._report_scan_progress,
+            )
+            for mac in pending.values():
+                if mac not in results:
+                    report(mac, self._reachability_not_found(mac))
+        return results
+
+    def _send_ping(self, target_ip, wait_for_pong_seconds=PING_TIMEOUT):
+        """Ping target_ip. Returns (sent, got_pong, rtt_ms): rtt_ms is the round trip in ms when a PONG came back,
+        else None; sent is False on a send error. The ping's form follows the peer's protocol version (_peer_proto)."""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.sendto(b"PING", (target_ip, DEFAULT_PORT))
-                s.settimeout(wait_for_pong_seconds)
-                try:
-                    data, _ = s.recvfrom(1024)
-                    if data == b"PONG":
-                        return (True, True)
-                except socket.timeout:
-                    pass
-                return (True, False)
+            rtt = self.network.ping_blocking(target_ip, timeout=wait_for_pong_seconds, proto=self._peer_proto(target_ip))
         except Exception:
-            return (False, False)
+            return (False, False, None)
+        if rtt is None:
+            return (True, False, None)
+        return (True, True, round(rtt * 1000, 1))
+
+    def _peer_proto(self, ip):
+        """Protocol version ip speaks: the higher of what its beacons announce and what its traffic has shown
+        (PROTO_VERSION for this machine; 1 if never heard). Older apps get only what they understand: bare pings,
+        no retransmissions, JSON, whole datagrams (see logic.PROTO_VERSION)."""
+        if ip.startswith("127."):
+            return PROTO_VERSION
+        return max(self.peers.proto_for_ip(ip), self.network.peer_proto(ip))
 
     def ping_user(self, mac, name):
-        """Ping is always sent to an IP. MAC is only the signal to look up (or recall) that IP. Uses stored IP if we have it, else resolves MAC → IP and saves it."""
+        """Start pinging a friend and return {"pending": True} at once. Waiting for the PONG (or a sweep) happens on
+        a thread of its own, and the result (see _ping_user) is pushed to the UI as onPingResult(mac, name, result)."""
+
+        def run():
+            try:
+                result = self._ping_user(mac, name)
+            except Exception as e:
+                print(f"Ping error: {e}")
+                result = {"success": False, "diagnostic": f"Ping failed: {e}"}
+            self._notify_ui("onPingResult", mac, name, result)
+
+        threading.Thread(target=run, name="ping", daemon=True).start()
+        return {"pending": True}
+
+    def _ping_user(self, mac, name):
+        """Ping is always sent to an IP. MAC is only the signal to look up (or recall) that IP. Uses the best known IP (beacon/message, stored, neighbour table) if we have one, else scans for MAC → IP and saves it."""
         net = self.engine.get_my_network_info()
         my_mac = self.engine.get_my_mac().lower()
         my_hostname = socket.gethostname().lower()
         mac_clean = self._mac_norm(mac)
 
         if mac_clean == my_mac or (name and name.lower() in my_hostname):
-            self.update_user_ip(mac, "127.0.0.1")
-            sent, got_pong = self._send_ping("127.0.0.1")
+            sent, got_pong, rtt_ms = self._send_ping("127.0.0.1")
             if not sent:
-                self.update_user_diagnostic(mac, "Send failed. Check your firewall.")
+                self._update_user_status(mac, "Send failed. Check your firewall.", "127.0.0.1")
                 return {"success": False, "your_ip": "", "subnets": [], "hint": "Send failed", "diagnostic": "Send failed. Check your firewall."}
-            msg = "Ping sent (self). Delivered!" if got_pong else "Ping sent (self). No confirmation."
-            self.update_user_diagnostic(mac, msg)
-            return {"success": True, "diagnostic": msg, "delivered": got_pong}
-
-        settings = self.get_settings()
-        user = self._find_user_by_mac(settings, mac)
-        stored_ip = (user or {}).get("ip") if user else None
-
-        # 1) Send to stored IP if we have it (ping always goes to IP, never to MAC)
-        if stored_ip:
-            sent, got_pong = self._send_ping(stored_ip)
+            msg = f"Ping sent (self). Delivered in {rtt_ms:g} ms!" if got_pong else "Ping sent (self). No confirmation."
+            self._update_user_status(mac, msg, "127.0.0.1")
+            return {"success": True, "diagnostic": msg, "delivered": got_pong, "rtt_ms": rtt_ms}
+
+        # 1) Send to the best IP we already know (ping always goes to IP, never to MAC)
+        known = self.resolver.lookup(mac)
+        if known is not None:
+            sent, got_pong, rtt_ms = self._send_ping(known.ip)
             if not sent:
-                self.update_user_diagnostic(mac, f"Found at {stored_ip} but send failed. Check your firewall (outbound UDP 5005).")
+                self.update_user_diagnostic(mac, f"Found at {known.ip} but send failed. Check your firewall (outbound UDP 5005).")
             else:
                 if got_pong:
-                    msg = f"Delivered to {stored_ip}! They got the ping."
+                    msg = f"Delivered to {known.ip} in {rtt_ms:g} ms! They got the ping."
                 else:
-                    msg = f"Sent to {stored_ip} (saved IP). No confirmation — their app may be closed or firewall blocking UDP 5005."
-                self.update_user_diagnostic(mac, msg)
-                return {"success": True, "diagnostic": msg, "delivered": got_pong}
+                    msg = f"Sent to {known.ip} ({SOURCE_LABELS[known.source]}). No confirmation — their app may be closed or firewall blocking UDP 5005."
+                self._update_user_status(mac, msg, self._ip_to_save(known))
+                return {"success": True, "diagnostic": msg, "delivered": got_pong, "rtt_ms": rtt_ms}
             # send failed; fall through to try resolving by MAC
 
         # 2) Resolve MAC → IP (MAC is only lookup key), then save IP and send ping to that IP
-        target_ip = self.engine.scan_network(mac, name or "")
+        backoff = self.resolver.backoff(mac)
+        if backoff is not None:
+            msg = self._reachability_offline(backoff)["diagnostic"]
+            return {
+                "success": False,
+                "your_ip": net.get("ips", [""])[0] if net.get("ips") else "",
+                "subnets": net.get("subnets", []),
+                "hint": msg,
+                "diagnostic": msg,
+            }
+        found = self.resolver.scan([mac], on_progress=self._report_scan_progress).get(mac_clean)
+        target_ip = found.ip if found is not None else None
         if target_ip:
-            self.update_user_ip(mac, target_ip)  # save IP for next time
-            sent, got_pong = self._send_ping(target_ip)
+            sent, got_pong, rtt_ms = self._send_ping(target_ip)
             if not sent:
                 msg = f"Found at {target_ip} but send failed. Check your firewall (outbound UDP 5005)."
-                self.update_user_diagnostic(mac, msg)
+                self._update_user_status(mac, msg, target_ip)  # save IP for next time
                 return {
                     "success": False,
                     "your_ip": net.get("ips", [""])[0] if net.get("ips") else "",
@@ -329,11 +456,11 @@ class Bridge:
                     "diagnostic": msg,
                 }
             if got_pong:
-                msg = f"Delivered to {target_ip}! They got the ping. (IP saved.)"
+                msg = f"Delivered to {target_ip} in {rtt_ms:g} ms! They got the ping. (IP saved.)"
             else:
                 msg = f"Sent to {target_ip} (IP saved). No confirmation — their app may be closed or firewall blocking UDP 5005."
-            self.update_user_diagnostic(mac, msg)
-            return {"success": True, "diagnostic": msg, "delivered": got_pong}
+            self._update_user_status(mac, msg, target_ip)
+            return {"success": True, "diagnostic": msg, "delivered": got_pong, "rtt_ms": rtt_ms}
 
         msg = "Could not find on network. Same WiFi? Their device on? Their firewall may block discovery (ping)."
         self.update_user_diagnostic(mac, msg)
@@ -345,10 +472,76 @@ class Bridge:
             "diagnostic": msg,
         }
     
+    def ping_many(self, macs):
+        """Ping several people at once: resolve every MAC (one shared scan for those not already known), send all the
+        pings together and wait one shared PING_TIMEOUT for the PONGs. Returns {delivered, total, results} where
+        results[mac] has name, ip, delivered, rtt_ms and a diagnostic. This device's own MAC is skipped."""
+        my_mac = self.engine.get_my_mac().lower()
+        results = {}
+        targets = {}  # MAC as given -> resolver.Resolution
+        to_scan = {}  # normalised MAC -> MAC as given
+
+        def result(mac, ip, delivered, rtt_ms, msg):
+            results[mac] = {
+                "name": self.get_friend_name(mac) or mac,
+                "ip": ip,
+                "delivered": delivered,
+                "rtt_ms": rtt_ms,
+                "diagnostic": msg,
+            }
+
+        for mac in macs or []:
+            mac_clean = self._mac_norm(mac)
+            if not mac_clean or mac_clean == my_mac or mac in results or mac in targets:
+                continue
+            res = self.resolver.lookup(mac)
+            backoff = self.resolver.backoff(mac) if res is None else None
+            if res is not None:
+                targets[mac] = res
+            elif backoff is not None:
+                result(mac, None, False, None, self._reachability_offline(backoff)["diagnostic"])
+            else:
+                to_scan[mac_clean] = mac
+        if to_scan:
+            found = self.resolver.scan(list(to_scan), on_progress=self._report_scan_progress)
+            for mac_clean, mac in to_scan.items():
+                if mac_clean in found:
+                    targets[mac] = found[mac_clean]
+                else:
+                    result(mac, None, False, None, "Could not find on network. Same WiFi? Their device on?")
+
+        order = list(targets.items())
+        try:
+            outcomes = self.network.ping_many_blocking([(res.ip, self._peer_proto(res.ip)) for _, res in order])
+        except Exception as e:
+            outcomes = [e] * len(order)
+        with self._edit_settings():  # one settings write for everyone
+            for (mac, res), outcome in zip(order, outcomes):
+                if isinstance(outcome, Exception):
+                    msg = f"Found at {res.ip} but send failed. Check your firewall (outbound UDP 5005)."
+                    result(mac, res.ip, False, None, msg)
+                elif outcome is None:
+                    msg = f"Sent to {res.ip} ({SOURCE_LABELS[res.source]}). No confirmation — their app may be closed or firewall blocking UDP 5005."
+                    result(mac, res.ip, False, None, msg)
+                else:
+                    rtt_ms = round(outcome * 1000, 1)
+                    msg = f"Delivered to {res.ip} in {rtt_ms:g} ms! They got the ping."
+                    result(mac, res.ip, True, rtt_ms, msg)
+                self._update_user_status(mac, msg, self._ip_to_save(res))
+        delivered = sum(1 for r in results.values() if r["delivered"])
+        return {"delivered": delivered, "total": len(results), "results": results}
+
+    def ping_room(self, room_id):
+        """Ping every member of the room (except this device) at once; see ping_many."""
+        room = self.get_room(room_id)
+        if not room:
+            return {"delivered": 0, "total": 0, "results": {}, "error": "Room not found."}
+        return self.ping_many(room.get("members", []))
+
     def get_my_info(self):
         """Profile for UI: prefers saved display_name, falls back to hostname."""
         try:
-            settings = self.get_settings()
+            settings = self._settings.get()
             display_name = (settings.get("display_name") or "").strip()
             if not display_name:
                 display_name = str(socket.gethostname())
@@ -369,56 +562,101 @@ class Bridge:
         """Return this machine's IP(s) and subnet(s) for diagnostics (goal post for sender/receiver)."""
         return self.engine.get_my_network_info()
 
-    def start_discovery(self):
-        """Start beacon sender and listener threads so we discover other RoomPing Pro users and advertise ourselves."""
-
-        def on_beacon(peer):
+    def start_network(self, on_ping=None, on_message=None):
+        """Start listening for pings (on_ping(sender_ip)), messages (on_message(message_dict)) and discovery beacons,
+        and advertise ourselves with a beacon every few seconds. Everything runs on one NetworkRuntime loop;
+        the callbacks are called on its worker thread."""
+        self.network.start(on_ping=on_ping, on_message=on_message, on_beacon=self._on_beacon, beacon_info=self._beacon_info)
+        with self._discovery_lock:
+            # Timers from an earlier run died with it; start over (the stale check also settles peers it missed)
+            self._peer_push_pending = bool(self._peer_changes)
+            self._stale_check_pending = True
+        if self._peer_push_pending:
+            self.network.call_later(PEER_PUSH_DELAY, self._push_peer_changes)
+        self.network.call_later(0, self._check_stale_peers)
+
+    def stop_network(self):
+        """Stop listening and beaconing (closes the sockets). Safe to call more than once."""
+        self.network.stop()
+        self.engine.close_sockets()
+
+    def get_network_stats(self):
+        """Listener counters for diagnostics (see NetworkRuntime.stats) plus how many peers are known."""
+        return {**self.network.stats(), "peers": len(self.peers), "peers_evicted": self.peers.evicted}
+
+    def _on_beacon(self, peer):
+        mac = peer["mac"]
+        if mac != self.engine.get_my_mac().lower().replace("-", ":"):
+            view, changed, removed = self.peers.update(peer, time.time())
             with self._discovery_lock:
-                self._discovered_peers[peer["mac"]] = {**peer, "last_seen": time.time()}
-
-        def beacon_listener():
-            self.engine.listen_beacon_forever(on_beacon)
-
-        def beacon_sender_loop():
-            while True:
-                try:
-                    settings = self.get_settings()
-                    display_name = (settings.get("display_name") or "").strip() or socket.gethostname()
-                    mac = self.engine.get_my_mac()
-                    net = self.engine.get_my_network_info()
-                    ips = net.get("ips") or []
-                    my_ip = ips[0] if ips else ""
-                    self.engine.send_beacon_once(display_name, mac, my_ip, net.get("port", DEFAULT_PORT))
-                except Exception as e:
-                    print(f"Beacon sender error: {e}")
-                time.sleep(BEACON_INTERVAL)
-
-        threading.Thread(target=beacon_listener, daemon=True).start()
-        threading.Thread(target=beacon_sender_loop, daemon=True).start()
+                if changed:
+                    self._queue_peer_change(view)
+                for gone in removed:
+                    self._queue_peer_change({"mac": gone, "removed": True})
+            self.observe_peer(mac, peer["ip"], "beacon")
+
+    def _queue_peer_change(self, view):
+        """Queue a peer view (or {mac, removed: True}) for the next onPeersChanged push (caller holds
+        _discovery_lock). Pushes are batched over PEER_PUSH_DELAY, and a timer pushes peers going stale, so the UI
+        never has to poll."""
+        self._peer_changes[view["mac"]] = view
+        if not self._peer_push_pending:
+            self._peer_push_pending = True
+            self.network.call_later(PEER_PUSH_DELAY, self._push_peer_changes)
+        if view.get("online") and not self._stale_check_pending:
+            self._stale_check_pending = True
+            self.network.call_later(PEER_STALE_SECONDS, self._check_stale_peers)
+
+    def _push_peer_changes(self):
+        with self._discovery_lock:
+            self._peer_push_pending = False
+            changes = list(self._peer_changes.values())
+            self._peer_changes = {}
+            if not changes:
+                return
+            self._peers_version += 1
+            version = self._peers_version
+        self._notify_ui("onPeersChanged", version, changes)
+
+    def _check_stale_peers(self):
+        """Push peers whose last beacon is now older than PEER_STALE_SECONDS as offline (and long-gone ones as
+        removed); check again when the next online peer would go stale."""
+        now = time.time()
+        went_offline, removed = self.peers.expire(now)
+        next_check = self.peers.next_expiry(now)
+        with self._discovery_lock:
+            self._stale_check_pending = False
+            for view in went_offline:
+                self._queue_peer_change(view)
+            for gone in removed:
+                self._queue_peer_change({"mac": gone, "removed": True})
+            if next_check is not None and not self._stale_check_pending:
+                self._stale_check_pending = True
+                self.network.call_later(next_check + 0.1, self._check_stale_peers)
+
+    def _beacon_info(self):
+        """(display_name, mac, ip, ping_port, binary) to advertise in our discovery beacon. The beacon is binary only
+        while every online peer speaks BINARY_PROTO; one older app on the LAN switches it back to JSON."""
+        settings = self._settings.get()
+        display_name = (settings.get("display_name") or "").strip() or socket.gethostname()
+        mac = self.engine.get_my_mac()
+        net = self.engine.get_my_network_info()
+        ips = net.get("ips") or []
+        my_ip = ips[0] if ips else ""
+        oldest = self.peers.min_online_proto()
+        return (display_name, mac, my_ip, net.get("port", DEFAULT_PORT), oldest is None or oldest >= BINARY_PROTO)
 
     def get_discovered_peers(self):
         """Return list of peers seen via beacon. Each has ip, name, mac, port, last_seen, online (bool). Excludes self."""
-        my_mac = self.engine.get_my_mac().lower().replace("-", ":")
-        now = time.time()
+        return self.get_peer_table()["peers"]
+
+    def get_peer_table(self, offset=0, limit=None, online=None, text=None):
+        """{version, total, peers}: one page of discovered peers, online first then by name (see PeerTable.query for
+        the filters; total counts all matches), and the version of the last onPeersChanged(version, peers) push
+        already reflected in it. The UI loads this once, then applies pushes with higher versions."""
         with self._discovery_lock:
-            out = []
-            for mac, p in list(self._discovered_peers.items()):
-                if mac == my_mac:
-                    continue
-                last = p.get("last_seen", 0)
-                online = (now - last) <= PEER_STALE_SECONDS
-                out.append(
-                    {
-                        "ip": p.get("ip", ""),
-                        "name": p.get("name", "Unknown"),
-                        "mac": p.get("mac", mac),
-                        "port": p.get("port", DEFAULT_PORT),
-                        "last_seen": last,
-                        "online": online,
-                    }
-                )
-        # online first, then name
-        return sorted(out, key=lambda x: (not x["online"], (x["name"] or "").lower()))
+            total, peers = self.peers.query(offset, limit, online, text)
+            return {"version": self._peers_version, "total": total, "peers": peers}
 
     # --- Message history (saved to disk per conversation) ---
     def _message_history_dir(self):
@@ -436,65 +674,100 @@ class Bridge:
     def _room_key(self, room_id):
         return "room_" + (room_id or "").replace("/", "_").replace("\\", "_")[:32]
 
-    def get_message_history(self, peer_key):
-        """peer_key is either dm_aa_bb_cc_dd_ee_ff or room_<id>. Returns list of {direction, sender_name, sender_mac?, text, timestamp}."""
-        path = os.path.join(self._message_history_dir(), peer_key + ".json")
-        if not os.path.isfile(path):
-            return []
-        try:
-            with open(path, "r") as f:
-                return json.load(f)
-        except Exception:
-            return []
+    def get_message_history(self, peer_key, before=None, limit=50):
+        """peer_key is either dm_aa_bb_cc_dd_ee_ff or room_<id>. Returns list of {seq, direction, sender_name, sender_mac?, text, timestamp}.
+
+        Newest `limit` messages before seq `before` (the latest page if None), oldest first. Pass the oldest seq back as `before` to load the page before it.
+        """
+        return self._history.read(peer_key, before, limit)
 
-    def append_message_to_history(self, peer_key, direction, sender_name, text, sender_mac=None):
-        """Append one message to the conversation file. direction is 'in' or 'out'."""
-        path = os.path.join(self._message_history_dir(), peer_key + ".json")
-        history = self.get_message_history(peer_key)
-        history.append({
+    def append_message_to_history(self, peer_key, direction, sender_name, text, sender_mac=None, track_delivery=False):
+        """Append one message to the conversation log and return its seq. direction is 'in' or 'out'.
+        With track_delivery the entry gets "delivered": None, to be settled by _history.mark_delivered()."""
+        entry = {
             "direction": direction,
             "sender_name": sender_name or "Unknown",
             "sender_mac": sender_mac,
             "text": text or "",
             "timestamp": time.time(),
-        })
-        try:
-            with open(path, "w") as f:
-                json.dump(history, f, indent=2)
-        except OSError:
-            pass
+        }
+        if track_delivery:
+            entry["delivered"] = None
+        return self._history.append(peer_key, entry)
+
+    def _deliver(self, peer_key, seq, ips, payload):
+        """Send payload (which has an "id") to each IP and wait for their acks in the background. When every IP has
+        answered or given up, the history entry at seq is marked delivered (all acked) or not (one that should have
+        acked never did), and the UI is told with onMessageStatus(peer_key, seq, delivered). If some IPs are older
+        apps that never ack and the rest acked, delivered is None and the entry stays unmarked."""
+        if not self.network.running:
+            # No listener for acks; delivery stays unknown
+            self.engine.send_message_many(ips, payload, min(self._peer_proto(ip) for ip in ips))
+            return
+        state = {"waiting": len(ips), "delivered": True}
+
+        def on_result(delivered):
+            # Always called on the network worker thread, one at a time. False wins over None (unknown) over True
+            state["waiting"] -= 1
+            if delivered is None:
+                if state["delivered"]:
+                    state["delivered"] = None
+            elif not delivered:
+                state["delivered"] = False
+            if state["waiting"] == 0:
+                if seq is not None and state["delivered"] is not None:
+                    self._history.mark_delivered(peer_key, seq, state["delivered"])
+                self._notify_ui("onMessageStatus", peer_key, seq, state["delivered"])
+
+        for ip in ips:
+            self.network.deliver(ip, payload, on_result, proto=self._peer_proto(ip))
 
     def is_friend(self, mac):
-        settings = self.get_settings()
+        settings = self._settings.get()
         return self._find_user_by_mac(settings, mac) is not None
 
     def get_friend_name(self, mac):
-        settings = self.get_settings()
+        settings = self._settings.get()
         u = self._find_user_by_mac(settings, mac)
         return (u.get("name") or "Unknown") if u else None
 
-    def get_friend_ip(self, mac):
-        """Return stored IP for friend, or None. Does not scan."""
-        settings = self.get_settings()
+    def _stored_friend_ip(self, mac):
+        """Return the IP saved in settings for this friend, or None."""
+        settings = self._settings.get()
         u = self._find_user_by_mac(settings, mac)
         if not u:
             return None
         ip = (u.get("ip") or "").strip()
         return ip if ip and self._looks_like_ip(ip) else None
 
+    def get_friend_ip(self, mac):
+        """Return best known IP for friend (fresh beacon/message, saved, neighbour table), or None. Does not scan."""
+        if not self.is_friend(mac):
+            return None
+        res = self.resolver.lookup(mac)
+        return res.ip if res is not None else None
+
+    def observe_peer(self, mac, ip, source="traffic"):
+        """Note that `mac` was just heard from at `ip` (beacon or incoming message), so pings follow them without a
+        scan. Kept only in the resolver's memory (see resolver.OBSERVATION_TTL), never saved: packets are not
+        authenticated, so anyone on the LAN could claim a friend's MAC."""
+        if not mac or not ip or not self._looks_like_ip(ip):
+            return
+        self.resolver.observe(mac, ip, source)
+
     def send_message(self, friend_mac, text):
         """Send a direct message to a friend. Friend must be in users. Returns {status, error?}."""
         text = (text or "").strip()
         if not text:
             return {"status": "error", "message": "Message is empty."}
-        settings = self.get_settings()
+        settings = self._settings.get()
         user = self._find_user_by_mac(settings, friend_mac)
         if not user:
             return {"status": "error", "message": "They are not in your Friends list."}
         ip = self.get_friend_ip(friend_mac)
         if not ip:
             return {"status": "error", "message": "No IP for this friend. They may be offline; try refreshing."}
-        my_name = (self.get_settings().get("display_name") or "").strip() or socket.gethostname()
+        my_name = (self._settings.get().get("display_name") or "").strip() or socket.gethostname()
         my_mac = self.engine.get_my_mac()
         net = self.engine.get_my_network_info()
         my_ip = (net.get("ips") or [""])[0]
@@ -504,11 +777,14 @@ class Bridge:
             "sender_mac": my_mac,
             "sender_ip": my_ip,
             "text": text,
+            "id": uuid.uuid4().hex,
         }
-        self.engine.send_message_udp(ip, payload)
+        if not message_fits(payload, self._peer_proto(ip)):
+            return {"status": "error", "message": "Message is too long for their (older) app. Send it in shorter parts."}
         peer_key = self._peer_key(friend_mac)
-        self.append_message_to_history(peer_key, "out", my_name, text, my_mac)
-        return {"status": "success"}
+        seq = self.append_message_to_history(peer_key, "out", my_name, text, my_mac, track_delivery=True)
+        self._deliver(peer_key, seq, [ip], payload)
+        return {"status": "success", "seq": seq}
 
     def record_incoming_message(self, sender_mac, sender_name, text, room_id=None, room_name=None):
         """Save an incoming message to history and return peer_key for UI (so we can open that chat)."""
@@ -521,7 +797,7 @@ class Bridge:
 
     # --- Rooms (group chat) ---
     def get_rooms(self):
-        settings = self.get_settings()
+        settings = self._settings.get()
         return list(settings.get("rooms", []))
 
     def create_room(self, name, member_macs):
@@ -529,7 +805,7 @@ class Bridge:
         name = (name or "").strip()
         if not name:
             return {"status": "error", "message": "Room name is required."}
-        settings = self.get_settings()
+        settings = self._settings.get()
         friends = {self._mac_norm(u.get("mac")) for u in settings.get("users", [])}
         members = []
         for mac in (member_macs or []):
@@ -539,15 +815,14 @@ class Bridge:
         if not members:
             return {"status": "error", "message": "Add at least one friend to the room."}
         room_id = str(uuid.uuid4())[:8]
-        if "rooms" not in settings:
-            settings["rooms"] = []
-        settings["rooms"].append({"id": room_id, "name": name, "members": members})
-        with open(self.settings_file, "w") as f:
-            json.dump(settings, f, indent=4)
+        with self._edit_settings() as settings:
+            if "rooms" not in settings:
+                settings["rooms"] = []
+            settings["rooms"].append({"id": room_id, "name": name, "members": members})
         return {"status": "success", "room_id": room_id}
 
     def get_room(self, room_id):
-        settings = self.get_settings()
+        settings = self._settings.get()
         for r in settings.get("rooms", []):
             if r.get("id") == room_id:
                 return r
@@ -565,30 +840,27 @@ class Bridge:
         return self.is_room_member(room_id, my_mac)
 
     def add_room_member(self, room_id, mac):
-        settings = self.get_settings()
-        rooms = settings.get("rooms", [])
-        room = next((r for r in rooms if r.get("id") == room_id), None)
+        room = self.get_room(room_id)
         if not room:
             return {"status": "error", "message": "Room not found."}
         if not self.is_friend(mac):
             return {"status": "error", "message": "They must be a friend first."}
         mac_clean = self._mac_norm(mac)
         if mac_clean not in room.get("members", []):
-            room.setdefault("members", []).append(mac_clean)
-            with open(self.settings_file, "w") as f:
-                json.dump(settings, f, indent=4)
+            with self._edit_settings() as settings:
+                room = next((r for r in settings.get("rooms", []) if r.get("id") == room_id), None)
+                if room is not None and mac_clean not in room.get("members", []):
+                    room.setdefault("members", []).append(mac_clean)
         return {"status": "success"}
 
     def remove_room_member(self, room_id, mac):
-        settings = self.get_settings()
-        rooms = settings.get("rooms", [])
-        room = next((r for r in rooms if r.get("id") == room_id), None)
-        if not room:
+        if not self.get_room(room_id):
             return {"status": "error", "message": "Room not found."}
         mac_clean = self._mac_norm(mac)
-        room["members"] = [m for m in room.get("members", []) if self._mac_norm(m) != mac_clean]
-        with open(self.settings_file, "w") as f:
-            json.dump(settings, f, indent=4)
+        with self._edit_settings() as settings:
+            for room in settings.get("rooms", []):
+                if room.get("id") == room_id:
+                    room["members"] = [m for m in room.get("members", []) if self._mac_norm(m) != mac_clean]
         return {"status": "success"}
 
     def send_room_message(self, room_id, text):
@@ -600,7 +872,7 @@ class Bridge:
         if not room:
             return {"status": "error", "message": "Room not found."}
         my_mac = self.engine.get_my_mac().lower().replace("-", ":")
-        my_name = (self.get_settings().get("display_name") or "").strip() or socket.gethostname()
+        my_name = (self._settings.get().get("display_name") or "").strip() or socket.gethostname()
         net = self.engine.get_my_network_info()
         my_ip = (net.get("ips") or [""])[0]
         payload = {
@@ -611,27 +883,29 @@ class Bridge:
             "text": text,
             "room_id": room_id,
             "room_name": room.get("name") or "Room",
+            "id": uuid.uuid4().hex,
         }
-        sent = 0
+        ips = []
         for mac in room.get("members", []):
             if self._mac_norm(mac) == my_mac:
                 continue
             ip = self.get_friend_ip(mac)
             if ip:
-                self.engine.send_message_udp(ip, payload)
-                sent += 1
+                ips.append(ip)
+        if not all(message_fits(payload, self._peer_proto(ip)) for ip in ips):
+            return {"status": "error", "message": "Message is too long for a member's (older) app. Send it in shorter parts."}
         peer_key = self._room_key(room_id)
-        self.append_message_to_history(peer_key, "out", my_name, text, my_mac)
-        return {"status": "success", "sent_to": sent}
+        seq = self.append_message_to_history(peer_key, "out", my_name, text, my_mac, track_delivery=bool(ips))
+        if ips:
+            self._deliver(peer_key, seq, ips, payload)
+        return {"status": "success", "sent_to": len(ips), "seq": seq}
     
     def delete_user(self, mac):
         """Removes a user from settings.json by their MAC address"""
-        settings = self.get_settings()
-        if 'users' in settings:
-            settings['users'] = [u for u in settings['users'] if u['mac'] != mac]
-            self._ensure_user_ip_slots(settings)
-            with open(self.settings_file, 'w') as f:
-                json.dump(settings, f, indent=4)
+        with self._edit_settings() as settings:
+            if 'users' in settings:
+                settings['users'] = [u for u in settings['users'] if u['mac'] != mac]
+                self._ensure_user_ip_slots(settings)
         return {"status": "success"}
 
     def get_app_version(self):
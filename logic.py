@@ -1,16 +1,24 @@
 """
 Network discovery and UDP ping listen/send. Cross-platform: Windows, macOS, Linux.
 """
+import collections
+import ipaddress
 import json
 import os
 import platform
 import re
+import select
 import shutil
 import socket
+import struct
 import subprocess
+import threading
 import time
 import uuid
 
+from probe import ProbeEngine
+import wire
+
 # Shared port for UDP pings (must match in bridge.py when sending)
 DEFAULT_PORT = 5005
 # Port for discovery beacons (who's on the network with RoomPing Pro)
@@ -18,8 +26,65 @@ DISCOVERY_PORT = 5006
 # Port for local messaging (friends and rooms)
 MESSAGE_PORT = 5007
 BEACON_INTERVAL = 4.0
+# Protocol version announced in beacons (peers that announce nothing are version 1):
+#   2 (PING_PROTO): "PING:<nonce>" is answered with "PONG:<nonce>"; bare PING / PONG still work both ways
+#   3 (ACK_PROTO): a message carrying an "id" is acknowledged with {"type": "ack", "id": ...} to MESSAGE_PORT
+#   4 (FRAME_PROTO): large messages may arrive as wire.py fragments
+#   5 (BINARY_PROTO): beacons, pings, messages and acks may arrive as wire.py binary packets instead of JSON / text
+PING_PROTO = 2
+ACK_PROTO = 3
+FRAME_PROTO = 4
+BINARY_PROTO = 5
+PROTO_VERSION = BINARY_PROTO
+# Longest message id that is acknowledged / deduplicated
+MAX_MESSAGE_ID = 64
+# A send socket whose buffer is full (e.g. part-way through a large fragmented message on Wi-Fi) is waited on for up
+# to this long (seconds) for room before the send is given up on
+SEND_STALL_TIMEOUT = 1.0
 PEER_STALE_SECONDS = 15.0
 MAC_PATTERN = re.compile(r"([0-9a-fA-F]{2}[:-]){5}([0-9a-fA-F]{2})")
+# macOS `arp -an` drops leading zeros (0:1a:2b:3:4:5)
+_LOOSE_MAC_PATTERN = re.compile(r"\b([0-9a-fA-F]{1,2}[:-]){5}[0-9a-fA-F]{1,2}\b")
+_IPV4_PATTERN = re.compile(r"\b(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\b")
+# Cached MAC / network info is re-detected at least this often (seconds)...
+IDENTITY_TTL = 60.0
+# ...and sooner if the interface list changes (checked this often, without spawning anything)
+IFACE_CHECK_INTERVAL = 5.0
+# Never plan a sweep of a network bigger than this; larger LANs are swept around our own address
+MAX_SCAN_PREFIX = 22
+# Give up on a MAC lookup sweep after this many seconds
+SCAN_TIMEOUT = 3.0
+# A neighbour (ARP) table snapshot is reused for this long (seconds)
+NEIGHBOR_TTL = 1.0
+# A sweep starts with this many addresses either side of each last-known IP of the MACs it is looking for
+SCAN_NEAR = 16
+# During a sweep the neighbour table is checked every SCAN_CHECK_EVERY probes (at most every SCAN_CHECK_INTERVAL
+# seconds where reading it means running `arp`), and progress is reported at most every SCAN_PROGRESS_INTERVAL
+SCAN_CHECK_EVERY = 16
+SCAN_CHECK_INTERVAL = 0.25
+SCAN_PROGRESS_INTERVAL = 0.5
+# /proc/net/arp flag for a resolved entry (ATF_COM); incomplete ones have no usable MAC yet
+_ATF_COM = 0x2
+
+# One IPv4 address on a local interface
+Interface = collections.namedtuple("Interface", "name ip prefixlen broadcast")
+
+# rtnetlink constants (linux/netlink.h, linux/rtnetlink.h, linux/if_addr.h)
+_NETLINK_ROUTE = 0
+_NLMSG_ERROR = 2
+_NLMSG_DONE = 3
+_RTM_NEWADDR = 20
+_RTM_GETADDR = 22
+_NLM_F_REQUEST = 0x1
+_NLM_F_DUMP = 0x300
+_IFA_ADDRESS = 1
+_IFA_LOCAL = 2
+_IFA_LABEL = 3
+_IFA_BROADCAST = 4
+_RT_SCOPE_HOST = 254
+_NLMSG_HDR = struct.Struct("=LHHLL")   # len, type, flags, seq, pid
+_IFADDRMSG = struct.Struct("=BBBBI")   # family, prefixlen, flags, scope, index
+_RTATTR = struct.Struct("=HH")         # len, type
 
 
 def _mac_from_uuid():
@@ -30,12 +95,361 @@ def _mac_from_uuid():
     )
 
 
+def _interface_signature():
+    """Cheap fingerprint of the interface list (one syscall, no subprocess); changes when an adapter appears or goes away."""
+    try:
+        return tuple(sorted(socket.if_nameindex()))
+    except (OSError, AttributeError):
+        return None
+
+
+def _netlink_ipv4_interfaces():
+    """Linux: every non-loopback IPv4 address with its prefix length, from one rtnetlink RTM_GETADDR dump.
+
+    No subprocess and no DNS. Raises OSError if netlink is unavailable.
+    """
+    out = []
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_ROUTE) as s:
+        s.bind((0, 0))
+        body = _IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        s.send(_NLMSG_HDR.pack(_NLMSG_HDR.size + len(body), _RTM_GETADDR, _NLM_F_REQUEST | _NLM_F_DUMP, 1, 0) + body)
+        while True:
+            data = s.recv(65536)
+            pos = 0
+            while pos + _NLMSG_HDR.size <= len(data):
+                msg_len, msg_type, _, _, _ = _NLMSG_HDR.unpack_from(data, pos)
+                if msg_len < _NLMSG_HDR.size:
+                    return out
+                if msg_type == _NLMSG_DONE:
+                    return out
+                if msg_type == _NLMSG_ERROR:
+                    raise OSError("netlink RTM_GETADDR failed")
+                if msg_type == _RTM_NEWADDR:
+                    family, prefixlen, _, scope, index = _IFADDRMSG.unpack_from(data, pos + _NLMSG_HDR.size)
+                    attrs = {}
+                    apos = pos + _NLMSG_HDR.size + _IFADDRMSG.size
+                    while apos + _RTATTR.size <= pos + msg_len:
+                        rta_len, rta_type = _RTATTR.unpack_from(data, apos)
+                        if rta_len < _RTATTR.size:
+                            break
+                        attrs[rta_type] = data[apos + _RTATTR.size:apos + rta_len]
+                        apos += (rta_len + 3) & ~3
+                    addr = attrs.get(_IFA_LOCAL) or attrs.get(_IFA_ADDRESS)
+                    if family == socket.AF_INET and scope != _RT_SCOPE_HOST and addr and len(addr) == 4:
+                        ip = socket.inet_ntoa(addr)
+                        name = attrs.get(_IFA_LABEL, b"").split(b"\0", 1)[0].decode(errors="ignore")
+                        if not name:
+                            try:
+                                name = socket.if_indextoname(index)
+                            except OSError:
+                                name = str(index)
+                        brd = attrs.get(_IFA_BROADCAST)
+                        if brd and len(brd) == 4:
+                            broadcast = socket.inet_ntoa(brd)
+                        else:
+                            broadcast = str(ipaddress.IPv4Interface(f"{ip}/{prefixlen}").network.broadcast_address)
+                        if not ip.startswith("127."):
+                            out.append(Interface(name, ip, prefixlen, broadcast))
+                pos += (msg_len + 3) & ~3
+
+
+class LocalIdentity:
+    """Cached facts about this machine on the network (MAC, IPs/subnets, broadcast addresses).
+
+    Detecting them can spawn `ip`, `networksetup` or `getmac` and do a DNS lookup, so each value is
+    detected on first use and then served from a dict until IDENTITY_TTL passes, invalidate() is
+    called, or the interface list changes.
+    """
+
+    def __init__(self, detectors, signature=_interface_signature):
+        self._detectors = detectors  # key -> function returning the value
+        self._signature = signature
+        self._lock = threading.RLock()  # detectors may get() other keys
+        self._values = {}
+        self._expires = 0.0
+        self._next_iface_check = 0.0
+        self._iface_sig = None
+
+    def invalidate(self):
+        """Forget all cached values; the next get() re-detects."""
+        self._expires = 0.0
+
+    def _check_interfaces(self, now):
+        self._next_iface_check = now + IFACE_CHECK_INTERVAL
+        sig = self._signature()
+        if sig != self._iface_sig:
+            if self._iface_sig is not None:
+                self.invalidate()
+            self._iface_sig = sig
+
+    def get(self, key):
+        now = time.monotonic()
+        if now >= self._next_iface_check:
+            self._check_interfaces(now)
+        values = self._values
+        if key in values and now < self._expires:
+            return values[key]
+        with self._lock:
+            if time.monotonic() >= self._expires:
+                self._values = {}
+                self._expires = time.monotonic() + IDENTITY_TTL
+            if key not in self._values:
+                value = self._detectors[key]()
+                # Swap in a new dict so lock-free readers never see one being modified
+                self._values = {**self._values, key: value}
+            return self._values[key]
+
+
+class NeighborTable:
+    """MAC -> IP snapshot of the kernel's neighbour (ARP) table.
+
+    Linux reads /proc/net/arp directly; elsewhere `arp -a` is run once per refresh and every entry is
+    parsed, instead of once per lookup. Snapshots are reused for NEIGHBOR_TTL seconds, so each lookup
+    is a dict hit.
+    """
+
+    def __init__(self, os_name, ttl=NEIGHBOR_TTL):
+        self._os = os_name
+        self.ttl = ttl
+        # Reading /proc/net/arp is cheap enough to do many times a second; running `arp` is not
+        self.cheap = os_name == "Linux" and os.path.exists("/proc/net/arp")
+        self._lock = threading.Lock()
+        self._table = {}
+        self._taken = None  # monotonic time of the current snapshot
+
+    def _read_proc(self):
+        table = {}
+        with open("/proc/net/arp") as f:
+            next(f, None)  # header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                try:
+                    flags = int(fields[2], 16)
+                except ValueError:
+                    continue
+                mac = fields[3].lower()
+                if flags & _ATF_COM and mac != "00:00:00:00:00:00":
+                    table.setdefault(mac, fields[0])
+        return table
+
+    def _read_arp_command(self):
+        arp_bin = shutil.which("arp") or ("arp" if self._os == "Windows" else "/usr/sbin/arp")
+        output = subprocess.check_output(
+            [arp_bin, "-a"] if self._os == "Windows" else [arp_bin, "-an"],
+            stderr=subprocess.DEVNULL,
+            timeout=5,
+            creationflags=subprocess.CREATE_NO_WINDOW if self._os == "Windows" and hasattr(subprocess, "CREATE_NO_WINDOW") else 0,
+        ).decode(errors="ignore")
+        table = {}
+        for line in output.splitlines():
+            m_mac = _LOOSE_MAC_PATTERN.search(line)
+            m_ip = _IPV4_PATTERN.search(line)
+            if m_mac and m_ip:
+                mac = ":".join(part.zfill(2) for part in re.split(r"[:-]", m_mac.group(0).lower()))
+                if mac not in ("00:00:00:00:00:00", "ff:ff:ff:ff:ff:ff"):
+                    table.setdefault(mac, m_ip.group(1))
+        return table
+
+    def snapshot(self, max_age=None):
+        """The MAC -> IP dict, re-read if older than max_age (default: the table's TTL). Treat as read-only."""
+        max_age = self.ttl if max_age is None else max_age
+        taken = self._taken
+        if taken is not None and time.monotonic() - taken < max_age:
+            return self._table
+        with self._lock:
+            if self._taken is not None and time.monotonic() - self._taken < max_age:
+                return self._table
+            try:
+                if self.cheap:
+                    table = self._read_proc()
+                else:
+                    table = self._read_arp_command()
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"Neighbour table read error: {e}")
+                table = self._table
+            self._table = table
+            self._taken = time.monotonic()
+            return table
+
+    def lookup(self, mac, max_age=None):
+        """IP the kernel currently has for this MAC, or None."""
+        return self.snapshot(max_age).get((mac or "").lower().replace("-", ":"))
+
+
+def parse_beacon(data, addr):
+    """Peer dict (ip, name, mac, port, proto) from a discovery beacon datagram received from addr, or None if it is
+    not one. proto is the protocol version the peer speaks (see PROTO_VERSION); 1 for apps that do not say.
+    Accepts both JSON and wire.py binary beacons."""
+    try:
+        kind = wire.packet_kind(data)
+        if kind is not None:
+            if kind != wire.KIND_BEACON:
+                return None
+            obj = wire.decode_beacon(data)
+        else:
+            obj = json.loads(data.decode("utf-8"))
+            if obj.get("type") != "beacon":
+                return None
+        peer = {
+            "ip": obj.get("ip") or addr[0],
+            "name": obj.get("name") or "Unknown",
+            "mac": (obj.get("mac") or "").lower().replace("-", ":"),
+            "port": int(obj.get("port") or DEFAULT_PORT),
+            "proto": int(obj.get("proto") or 1),
+        }
+    except (UnicodeDecodeError, ValueError, TypeError, AttributeError, struct.error):
+        # ignore malformed beacons
+        return None
+    return peer if peer["mac"] else None
+
+
+def parse_message(data, addr):
+    """Message dict from a datagram received from addr on MESSAGE_PORT, or None if it is not one. Has sender_name,
+    sender_mac, sender_ip, source_ip (where the packet came from), text, room_id (optional), room_name (optional)
+    and id (None from apps that do not ask for an ack). Accepts both JSON and wire.py binary messages."""
+    try:
+        kind = wire.packet_kind(data)
+        if kind is not None:
+            if kind != wire.KIND_MESSAGE:
+                return None
+            obj = wire.decode_message(data)
+        else:
+            obj = json.loads(data.decode("utf-8"))
+            if obj.get("type") != "msg":
+                return None
+        return {
+            "sender_name": obj.get("sender_name") or "Unknown",
+            "sender_mac": (obj.get("sender_mac") or "").lower().replace("-", ":"),
+            "sender_ip": obj.get("sender_ip") or addr[0],
+            "source_ip": addr[0],
+            "text": obj.get("text") or "",
+            "room_id": obj.get("room_id"),
+            "room_name": obj.get("room_name"),
+            "id": _message_id(obj.get("id")),
+        }
+    except (UnicodeDecodeError, ValueError, TypeError, AttributeError, struct.error):
+        return None
+
+
+def parse_ack(data):
+    """Message id from an ack datagram ({"type": "ack", "id": ...} or a wire.py binary ack), or None if it is not one."""
+    kind = wire.packet_kind(data)
+    try:
+        if kind is not None:
+            return _message_id(wire.decode_ack(data)) if kind == wire.KIND_ACK else None
+        if b'"ack"' not in data:  # cheap pre-check: most datagrams on MESSAGE_PORT are messages
+            return None
+        obj = json.loads(data.decode("utf-8"))
+        return _message_id(obj.get("id")) if obj.get("type") == "ack" else None
+    except (UnicodeDecodeError, ValueError, TypeError, AttributeError, struct.error):
+        return None
+
+
+def _message_id(value):
+    return value if isinstance(value, str) and 0 < len(value) <= MAX_MESSAGE_ID else None
+
+
+def message_fits(payload_dict, proto):
+    """False if payload_dict cannot reach a peer speaking protocol version proto: apps older than FRAME_PROTO only
+    read whole JSON datagrams of up to wire.LEGACY_MAX_DATAGRAM bytes, so NetworkEngine.send_message_many refuses
+    to send them anything bigger."""
+    return proto >= FRAME_PROTO or len(json.dumps(payload_dict).encode("utf-8")) <= wire.LEGACY_MAX_DATAGRAM
+
+
 class NetworkEngine:
     def __init__(self, port=None):
         self.port = port if port is not None else DEFAULT_PORT
         self._os = platform.system()
+        self._prober = ProbeEngine()
+        self.neighbors = NeighborTable(self._os)
+        self.identity = LocalIdentity({
+            "mac": self._detect_mac,
+            "interfaces": self._detect_interfaces,
+            "network_info": self._detect_network_info,
+            "broadcasts": self._detect_broadcast_addresses,
+        }, self._interface_signature)
+        # Long-lived send sockets, one per (source IP, broadcast?); see _send_socket
+        self._send_lock = threading.Lock()
+        self._send_sockets = {}
+        self._source_cache = ({}, None)  # (target IP -> source IP, the interface list it was worked out from)
 
     def get_my_mac(self):
+        """This machine's MAC address (cached; see LocalIdentity)."""
+        return self.identity.get("mac")
+
+    def get_my_network_info(self):
+        """Return this machine's IP(s) and subnet(s) we scan (cached; see LocalIdentity)."""
+        return dict(self.identity.get("network_info"))
+
+    def get_broadcast_addresses(self):
+        """Broadcast IPs we send beacons to (cached; see LocalIdentity)."""
+        return list(self.identity.get("broadcasts"))
+
+    def get_interfaces(self):
+        """This machine's IPv4 addresses as Interface(name, ip, prefixlen, broadcast) (cached; see LocalIdentity)."""
+        return list(self.identity.get("interfaces"))
+
+    def _interface_signature(self):
+        """On Linux the addresses themselves (a netlink dump is cheap), so a new DHCP lease is noticed too."""
+        if self._os == "Linux":
+            try:
+                return tuple(_netlink_ipv4_interfaces())
+            except OSError:
+                pass
+        return _interface_signature()
+
+    def _detect_interfaces(self):
+        """Local IPv4 addresses with real prefix lengths on Linux (netlink).
+
+        Elsewhere (or if netlink fails) falls back to resolving our hostname and assuming a /24.
+        """
+        if self._os == "Linux":
+            try:
+                return _netlink_ipv4_interfaces()
+            except OSError as e:
+                print(f"Interface enumeration error: {e}")
+        try:
+            local_ips = socket.gethostbyname_ex(socket.gethostname())[2]
+        except (socket.gaierror, socket.herror):
+            return []
+        out = []
+        for ip in local_ips:
+            if ip.startswith("127.") or len(ip.split(".")) != 4:
+                continue
+            out.append(Interface("", ip, 24, ".".join(ip.split(".")[:-1]) + ".255"))
+        return out
+
+    def get_scan_networks(self):
+        """Networks a MAC lookup sweeps, in order: each local network (from its real prefix), then for /24s the
+        neighbouring /24s (same router, different AP). Networks bigger than /MAX_SCAN_PREFIX are cut down to the
+        /MAX_SCAN_PREFIX around our address."""
+        ifaces = self.get_interfaces()
+        seen = set()
+        own, neighbours = [], []
+        for iface in ifaces:
+            net = ipaddress.IPv4Interface(f"{iface.ip}/{max(iface.prefixlen, MAX_SCAN_PREFIX)}").network
+            if net not in seen:
+                seen.add(net)
+                own.append(net)
+        for iface in ifaces:
+            if iface.prefixlen < 24:
+                continue
+            base = ipaddress.IPv4Interface(f"{iface.ip}/24").network
+            for delta in (1, -1):
+                try:
+                    neighbour = ipaddress.IPv4Network((int(base.network_address) + delta * 256, 24))
+                except ValueError:
+                    continue
+                if not neighbour.subnet_of(base.supernet(new_prefix=16)):
+                    continue
+                if neighbour not in seen and not any(neighbour.overlaps(n) for n in own):
+                    seen.add(neighbour)
+                    neighbours.append(neighbour)
+        return own + neighbours
+
+    def _detect_mac(self):
         """Detect this machine's MAC address. Works on Windows, macOS, and Linux."""
         try:
             # --- macOS ---
@@ -111,265 +525,297 @@ class NetworkEngine:
             print(f"MAC discovery error: {e}")
             return _mac_from_uuid()
 
-    def get_my_network_info(self):
-        """Return this machine's IP(s) and subnet(s) we scan (including neighbor subnets for cross-subnet discovery)."""
-        try:
-            local_ips = socket.gethostbyname_ex(socket.gethostname())[2]
-        except socket.gaierror:
-            return {"ips": [], "subnets": [], "port": self.port}
-        ips = [ip for ip in local_ips if not ip.startswith("127.") and len(ip.split(".")) == 4]
-        seen = set()
-        subnets = []
-        for ip in ips:
-            parts = ip.split(".")
-            prefix = ".".join(parts[:-1]) + ".x"
-            if prefix not in seen:
-                seen.add(prefix)
-                subnets.append(prefix)
-            try:
-                third = int(parts[2])
-                for delta in (1, -1):
-                    neighbor = third + delta
-                    if 0 <= neighbor <= 255:
-                        neighbor_x = f"{parts[0]}.{parts[1]}.{neighbor}.x"
-                        if neighbor_x not in seen:
-                            seen.add(neighbor_x)
-                            subnets.append(neighbor_x)
-            except (ValueError, IndexError):
-                pass
+    def _detect_network_info(self):
+        """Return this machine's IP(s) and the networks we scan (CIDR), for diagnostics in the UI."""
+        ips = [iface.ip for iface in self.get_interfaces()]
+        subnets = [str(net) for net in self.get_scan_networks()]
         return {"ips": ips, "subnets": subnets[:6], "port": self.port}
 
-    def get_broadcast_addresses(self):
-        """Return broadcast IPs for local and neighbouring /24s (e.g. 192.168.1.255, 192.168.0.255, 192.168.2.255)."""
-        try:
-            local_ips = socket.gethostbyname_ex(socket.gethostname())[2]
-        except socket.gaierror:
-            return []
-        ips = [ip for ip in local_ips if not ip.startswith("127.") and len(ip.split(".")) == 4]
+    def _detect_broadcast_addresses(self):
+        """Return broadcast IPs for each local network and, for /24s, the neighbouring /24s (e.g. 192.168.0.255, 192.168.2.255)."""
         seen = set()
         out = []
-        for ip in ips:
-            parts = ip.split(".")
-            # Own subnet broadcast (e.g. 192.168.1.255)
-            broadcast = ".".join(parts[:-1]) + ".255"
+        for iface in self.get_interfaces():
+            if iface.broadcast not in seen:
+                seen.add(iface.broadcast)
+                out.append(iface.broadcast)
+        for net in self.get_scan_networks():
+            broadcast = str(net.broadcast_address)
             if broadcast not in seen:
                 seen.add(broadcast)
                 out.append(broadcast)
-            # Neighbouring /24 subnets (e.g. 192.168.0.255, 192.168.2.255)
-            try:
-                third = int(parts[2])
-                for delta in (1, -1):
-                    neighbor = third + delta
-                    if 0 <= neighbor <= 255:
-                        neighbor_bcast = f"{parts[0]}.{parts[1]}.{neighbor}.255"
-                        if neighbor_bcast not in seen:
-                            seen.add(neighbor_bcast)
-                            out.append(neighbor_bcast)
-            except (ValueError, IndexError):
-                pass
         # Cap to avoid spamming too many subnets if host has lots of interfaces
         return out[:7]
 
-    def send_beacon_once(self, display_name, my_mac, my_ip, ping_port):
-        """Send one discovery beacon (JSON) to each broadcast address. Others on the LAN will see us."""
-        payload = json.dumps(
+    def send_beacon_once(self, display_name, my_mac, my_ip, ping_port, binary=False):
+        """Send one discovery beacon to each broadcast address. Others on the LAN will see us."""
+        self.broadcast_beacon(self.encode_beacon(display_name, my_mac, my_ip, ping_port, binary))
+
+    @staticmethod
+    def encode_beacon(display_name, my_mac, my_ip, ping_port, binary=False):
+        """Beacon datagram for broadcast_beacon(): JSON unless binary is set (only apps speaking BINARY_PROTO can
+        read binary beacons)."""
+        port = int(ping_port) if ping_port else DEFAULT_PORT
+        if binary:
+            return wire.encode_beacon(display_name or "Unknown", my_mac, my_ip, port, PROTO_VERSION)
+        return json.dumps(
             {
                 "type": "beacon",
                 "name": display_name or "Unknown",
                 "mac": my_mac or "",
                 "ip": my_ip or "",
-                "port": int(ping_port) if ping_port else DEFAULT_PORT,
+                "port": port,
+                "proto": PROTO_VERSION,
             }
         ).encode("utf-8")
+
+    def broadcast_beacon(self, payload):
+        """Send an encoded beacon (encode_beacon()) to each broadcast address on DISCOVERY_PORT."""
         for broadcast in self.get_broadcast_addresses():
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-                    s.sendto(payload, (broadcast, DISCOVERY_PORT))
+                self._send_socket(self._source_ip_for(broadcast), broadcast=True).sendto(payload, (broadcast, DISCOVERY_PORT))
+            except BlockingIOError:
+                continue  # send buffer full for now; the next beacon goes out as usual
             except OSError as e:
                 # Some neighbour subnets will have no route / host; that's expected. Don't spam logs for that.
                 if e.errno in (64, 65):  # Host is down / No route to host (Darwin)
                     continue
                 print(f"Beacon send to {broadcast}: {e}")
-            except Exception as e:
-                print(f"Beacon send to {broadcast}: {e}")
-
-    def listen_beacon_forever(self, callback):
-        """Listen for UDP discovery beacons on DISCOVERY_PORT; call callback(peer_dict) for each. peer_dict has ip, name, mac, port."""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            try:
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind(("", DISCOVERY_PORT))
-                print(f"Listening for discovery beacons on port {DISCOVERY_PORT}...")
-                while True:
-                    data, addr = s.recvfrom(1024)
-                    try:
-                        obj = json.loads(data.decode("utf-8"))
-                        if obj.get("type") != "beacon":
-                            continue
-                        peer = {
-                            "ip": obj.get("ip") or addr[0],
-                            "name": obj.get("name") or "Unknown",
-                            "mac": (obj.get("mac") or "").lower().replace("-", ":"),
-                            "port": int(obj.get("port") or DEFAULT_PORT),
-                        }
-                        if peer["mac"]:
-                            callback(peer)
-                    except (json.JSONDecodeError, ValueError, TypeError):
-                        # ignore malformed beacons
-                        pass
-            except Exception as e:
-                print(f"Beacon listener error: {e}")
-
-    def _read_arp_for_mac(self, target_clean, arp_bin):
-        """Run arp -a (or -an) and return IP if target MAC is in the table."""
-        if self._os == "Windows":
-            cmd = [arp_bin, "-a"]
-        else:
-            cmd = [arp_bin, "-an"]
-        output = subprocess.check_output(
-            cmd,
-            stderr=subprocess.DEVNULL,
-            timeout=5,
-            creationflags=subprocess.CREATE_NO_WINDOW if self._os == "Windows" and hasattr(subprocess, "CREATE_NO_WINDOW") else 0,
-        ).decode(errors="ignore")
-        for line in output.split("\n"):
-            if target_clean in line.lower().replace("-", ":"):
-                m = re.search(r"\b(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\b", line)
-                if m:
-                    return m.group(1)
-        return None
+                self._drop_send_socket(self._source_ip_for(broadcast), broadcast=True)
 
     def scan_network(self, target_mac, target_name):
         """Resolve target_mac to an IP on the local LAN. MAC is only used to look up IP (ARP); returns IP address or None. No packet is ever sent to a MAC."""
         if not target_mac:
             return None
-        my_mac = self.get_my_mac().lower()
         target_clean = target_mac.lower().replace("-", ":")
-        if target_clean == my_mac:
-            return "127.0.0.1"
+        return self.scan_for_macs([target_clean]).get(target_clean)
 
-        try:
-            ping_bin = shutil.which("ping") or ("ping" if self._os == "Windows" else "/sbin/ping")
-            arp_bin = shutil.which("arp") or ("arp" if self._os == "Windows" else "/usr/sbin/arp")
+    def scan_plan(self, hints=()):
+        """Addresses a sweep probes, as (label, [ip, ...]) segments in probe order, each address once:
 
+        1. each last-known IP in `hints` and the SCAN_NEAR addresses either side of it, nearest first
+        2. the rest of each local network
+        3. the neighbouring /24s (see get_scan_networks)
+        Our own addresses are left out; hints outside the scanned networks are ignored.
+        """
+        networks = self.get_scan_networks()[:5]  # up to 5 networks (own + neighbors)
+        planned = {iface.ip for iface in self.get_interfaces()}
+        plan = []
+        for hint in hints or ():
             try:
-                local_ips = socket.gethostbyname_ex(socket.gethostname())[2]
-            except socket.gaierror:
-                return None
+                hint = ipaddress.IPv4Address(hint)
+            except ValueError:
+                continue
+            network = next((n for n in networks if hint in n), None)
+            if network is None:
+                continue
+            first, last = int(network.network_address) + 1, int(network.broadcast_address) - 1
+            near = []
+            for delta in range(SCAN_NEAR + 1):
+                for addr in (int(hint) + delta, int(hint) - delta) if delta else (int(hint),):
+                    addr = str(ipaddress.IPv4Address(addr)) if first <= addr <= last else None
+                    if addr is not None and addr not in planned:
+                        planned.add(addr)
+                        near.append(addr)
+            if near:
+                plan.append((f"around {hint}", near))
+        for network in networks:
+            hosts = [str(h) for h in network.hosts() if str(h) not in planned]
+            planned.update(hosts)
+            if hosts:
+                plan.append((str(network), hosts))
+        return plan
 
-            ping_count = "-n" if self._os == "Windows" else "-c"
-            creationflags = subprocess.CREATE_NO_WINDOW if self._os == "Windows" and hasattr(subprocess, "CREATE_NO_WINDOW") else 0
+    def scan_for_macs(self, target_macs, on_found=None, hints=(), on_progress=None):
+        """Resolve several MACs with one sweep. Returns {mac: ip} for those found (MACs normalised to aa:bb:..).
 
-            # Pass 1: broadcast ping, then read ARP (fast but Windows often doesn't reply to broadcast)
-            for ip in local_ips:
-                if ip.startswith("127."):
-                    continue
-                parts = ip.split(".")
-                if len(parts) != 4:
-                    continue
-                broadcast = ".".join(parts[:-1]) + ".255"
-                subprocess.Popen(
-                    [ping_bin, ping_count, "1", broadcast],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    creationflags=creationflags,
-                )
-            time.sleep(1.0)
-            found = self._read_arp_for_mac(target_clean, arp_bin)
-            if found:
+        Probes go out in scan_plan(hints) order (pass the MACs' last-known IPs as hints) and the neighbour table
+        is checked as they go, so the sweep stops soon after the last MAC answers. on_found(mac, ip) is called as
+        each one turns up; on_progress({"probed", "total", "subnet", "elapsed", "done"}) every
+        SCAN_PROGRESS_INTERVAL seconds and once at the end.
+        """
+        my_mac = self.get_my_mac().lower()
+        pending = {(m or "").lower().replace("-", ":") for m in target_macs if m}
+        found = {}
+        started = time.monotonic()
+        progress = {"probed": 0, "total": 0, "subnet": "", "next_report": started + SCAN_PROGRESS_INTERVAL}
+        check_age = 0 if self.neighbors.cheap else SCAN_CHECK_INTERVAL
+
+        def report_progress(done=False):
+            now = time.monotonic()
+            if on_progress is None or (not done and now < progress["next_report"]):
+                return
+            progress["next_report"] = now + SCAN_PROGRESS_INTERVAL
+            try:
+                on_progress({
+                    "probed": progress["probed"],
+                    "total": progress["total"],
+                    "subnet": progress["subnet"],
+                    "elapsed": round(now - started, 2),
+                    "done": done,
+                })
+            except Exception as e:
+                print(f"Scan progress callback error: {e}")
+
+        def check(max_age=check_age):
+            table = self.neighbors.snapshot(max_age)
+            for mac in list(pending):
+                ip = "127.0.0.1" if mac == my_mac else table.get(mac)
+                if ip:
+                    pending.discard(mac)
+                    found[mac] = ip
+                    if on_found is not None:
+                        try:
+                            on_found(mac, ip)
+                        except Exception as e:
+                            print(f"Scan callback error: {e}")
+            return not pending
+
+        def addresses(plan):
+            for label, segment in plan:
+                progress["subnet"] = label
+                for addr in segment:
+                    progress["probed"] += 1
+                    report_progress()
+                    yield addr
+
+        try:
+            # Pass 1: maybe the kernel already knows them (recent traffic)
+            if check(max_age=None):
                 return found
 
-            # Pass 2: ping each IP in each local subnet + neighbor subnets (e.g. 192.168.0.x and 192.168.1.x)
-            # so devices on different subnets (same router, different AP) can find each other by MAC
-            prefixes = []
-            for ip in local_ips:
-                if ip.startswith("127.") or len(ip.split(".")) != 4:
-                    continue
-                parts = ip.split(".")
-                p = ".".join(parts[:-1]) + "."
-                if p not in prefixes:
-                    prefixes.append(p)
-                # Add neighboring /24 subnet (e.g. 192.168.0 -> 192.168.1 and vice versa)
-                try:
-                    third = int(parts[2])
-                    for delta in (1, -1):
-                        neighbor = third + delta
-                        if 0 <= neighbor <= 255:
-                            neighbor_p = f"{parts[0]}.{parts[1]}.{neighbor}."
-                            if neighbor_p not in prefixes:
-                                prefixes.append(neighbor_p)
-                except (ValueError, IndexError):
-                    pass
-            for subnet_prefix in prefixes[:5]:  # up to 5 subnets (own + neighbors)
-                for i in range(1, 255):
-                    candidate = subnet_prefix + str(i)
-                    subprocess.Popen(
-                        [ping_bin, ping_count, "1", candidate],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                        creationflags=creationflags,
-                    )
-                time.sleep(2.2)
-                found = self._read_arp_for_mac(target_clean, arp_bin)
-                if found:
-                    return found
+            # Pass 2: probe around the last-known IPs, then each local network (real prefix, e.g. a whole /22),
+            # then neighbour /24s so devices on different subnets (same router, different AP) can be found too.
+            plan = self.scan_plan(hints)
+            progress["total"] = sum(len(segment) for _, segment in plan)
+            if plan:
+                self._prober.run(addresses(plan), timeout=SCAN_TIMEOUT, until=check, check_every=SCAN_CHECK_EVERY)
+                report_progress(done=True)
         except Exception as e:
             print(f"Scan error: {e}")
-        return None
+        return found
+
+    def send_message_udp(self, target_ip, payload_dict, proto=1):
+        """Send one message to target_ip on MESSAGE_PORT, encoded for a peer speaking protocol version proto
+        (see send_message_many). Payload must be JSON-serializable. True if it was sent."""
+        return self.send_message_many([target_ip], payload_dict, proto) > 0
 
-    def listen_forever(self, callback):
-        """Listen for UDP PING packets; call callback(sender_ip); send PONG back so sender knows it was delivered."""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+    def send_message_many(self, target_ips, payload_dict, proto=1):
+        """Send the same message to each IP on MESSAGE_PORT (encoded once). Returns how many sends succeeded.
+        proto is the lowest protocol version the peers speak: from BINARY_PROTO the message is a wire.py binary
+        packet, else JSON; from FRAME_PROTO anything over one MTU goes out as compressed wire.py fragments, else
+        the message goes out whole, and not at all if it is too big for older apps to read (see message_fits)."""
+        try:
+            if proto >= BINARY_PROTO:
+                payload = wire.encode_message(payload_dict)
+            else:
+                payload = json.dumps(payload_dict).encode("utf-8")
+            if proto >= FRAME_PROTO:
+                datagrams = wire.frame(payload)
+            elif len(payload) <= wire.LEGACY_MAX_DATAGRAM:
+                datagrams = [payload]
+            else:
+                raise ValueError(f"{len(payload)} bytes is too big for apps older than protocol {FRAME_PROTO}")
+        except (TypeError, ValueError) as e:
+            print(f"Message encode error: {e}")
+            return 0
+        sent = 0
+        for target_ip in target_ips:
+            source_ip = self._source_ip_for(target_ip)
             try:
-                s.bind(("", self.port))
-                print(f"Listening for pings on port {self.port}...")
-                while True:
-                    data, addr = s.recvfrom(1024)
-                    if data == b"PING":
-                        try:
-                            callback(addr[0])
-                        except Exception as e:
-                            print(f"Ping callback error: {e}")
-                        # Send PONG back to sender so they get delivery confirmation
-                        try:
-                            s.sendto(b"PONG", addr)
-                        except Exception as e:
-                            print(f"PONG send error: {e}")
-            except Exception as e:
-                print(f"Listener error: {e}")
+                if self._send_all(self._send_socket(source_ip), datagrams, (target_ip, MESSAGE_PORT)):
+                    sent += 1
+                else:
+                    print(f"Message send to {target_ip}: send buffer stayed full; giving up")
+            except socket.gaierror as e:
+                print(f"Message send to {target_ip}: {e}")  # bad address; the socket is fine
+            except OSError as e:
+                print(f"Message send to {target_ip}: {e}")
+                self._drop_send_socket(source_ip)
+        return sent
+
+    @staticmethod
+    def _send_all(sock, datagrams, addr):
+        """sendto() each datagram on a non-blocking socket, waiting for room whenever its send buffer is full instead
+        of failing. False if it stayed full for SEND_STALL_TIMEOUT; the socket itself is fine."""
+        for datagram in datagrams:
+            while True:
+                try:
+                    sock.sendto(datagram, addr)
+                    break
+                except BlockingIOError:
+                    if not select.select([], [sock], [], SEND_STALL_TIMEOUT)[1]:
+                        return False
+        return True
 
-    def send_message_udp(self, target_ip, payload_dict):
-        """Send one JSON message to target_ip on MESSAGE_PORT. Payload must be JSON-serializable."""
+    def send_ack(self, target_ip, message_id, binary=False):
+        """Acknowledge message_id to target_ip on MESSAGE_PORT (as a wire.py binary ack if binary, else JSON)."""
+        if binary:
+            payload = wire.encode_ack(message_id)
+        else:
+            payload = json.dumps({"type": "ack", "id": message_id}).encode("utf-8")
+        source_ip = self._source_ip_for(target_ip)
         try:
-            payload = json.dumps(payload_dict).encode("utf-8")
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.sendto(payload, (target_ip, MESSAGE_PORT))
-        except Exception as e:
-            print(f"Message send to {target_ip}: {e}")
+            self._send_socket(source_ip).sendto(payload, (target_ip, MESSAGE_PORT))
+        except OSError as e:
+            print(f"Ack send to {target_ip}: {e}")
 
-    def listen_messages_forever(self, callback):
-        """Listen for UDP messages on MESSAGE_PORT; call callback(parsed_dict) for each. parsed_dict has sender_name, sender_mac, sender_ip, text, room_id (optional), room_name (optional)."""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+    def _source_ip_for(self, target_ip):
+        """Our address on the network target_ip is on (or next to, for neighbour /24s); "" to let routing decide."""
+        ifaces = self.identity.get("interfaces")
+        cache, cached_for = self._source_cache
+        if cached_for is not ifaces:
+            cache = {}
+            self._source_cache = (cache, ifaces)  # interfaces re-detected: work everything out again
+        source = cache.get(target_ip)
+        if source is None:
+            source = ""
             try:
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind(("", MESSAGE_PORT))
-                print(f"Listening for messages on port {MESSAGE_PORT}...")
-                while True:
-                    data, addr = s.recvfrom(4096)
-                    try:
-                        obj = json.loads(data.decode("utf-8"))
-                        if obj.get("type") != "msg":
-                            continue
-                        callback({
-                            "sender_name": obj.get("sender_name") or "Unknown",
-                            "sender_mac": (obj.get("sender_mac") or "").lower().replace("-", ":"),
-                            "sender_ip": obj.get("sender_ip") or addr[0],
-                            "text": obj.get("text") or "",
-                            "room_id": obj.get("room_id"),
-                            "room_name": obj.get("room_name"),
-                        })
-                    except (json.JSONDecodeError, ValueError, TypeError):
-                        pass
-            except Exception as e:
-                print(f"Message listener error: {e}")
+                target = ipaddress.IPv4Address(target_ip)
+            except ValueError:
+                return source
+            for prefix in (None, 16):
+                for iface in ifaces:
+                    net = ipaddress.IPv4Interface(f"{iface.ip}/{prefix or iface.prefixlen}").network
+                    if target in net:
+                        source = iface.ip
+                        break
+                if source:
+                    break
+            cache[target_ip] = source
+        return source
+
+    def _send_socket(self, source_ip="", broadcast=False):
+        """Non-blocking UDP socket bound to source_ip (any if ""), created on first use and then reused."""
+        key = (source_ip, broadcast)
+        sock = self._send_sockets.get(key)
+        if sock is not None:
+            return sock
+        with self._send_lock:
+            sock = self._send_sockets.get(key)
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    if broadcast:
+                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                    sock.bind((source_ip, 0))
+                    sock.setblocking(False)
+                except OSError:
+                    sock.close()
+                    raise
+                self._send_sockets[key] = sock
+            return sock
+
+    def _drop_send_socket(self, source_ip="", broadcast=False):
+        """Close a send socket after an error (e.g. its address went away); the next send makes a new one."""
+        with self._send_lock:
+            sock = self._send_sockets.pop((source_ip, broadcast), None)
+        if sock is not None:
+            sock.close()
+
+    def close_sockets(self):
+        """Close all send sockets (they are re-created if anything is sent afterwards)."""
+        with self._send_lock:
+            socks, self._send_sockets = list(self._send_sockets.values()), {}
+        for sock in socks:
+            sock.close()
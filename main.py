@@ -1,11 +1,9 @@
-import json
 import os
 import sys
-import threading
 import time
 import webview
 from bridge import Bridge
-from logic import NetworkEngine
+from ui_events import UIDispatcher
 
 # Path to web UI (works when run from source or as PyInstaller .exe/.app)
 if getattr(sys, "frozen", False):
@@ -17,13 +15,6 @@ _ALERT_INDEX = os.path.join(_BASE_DIR, "Web", "popout.html")
 
 def start_logic():
     api = Bridge()
-    engine = NetworkEngine()
-
-    # Start discovery beacons and listener so we can find other RoomPing Pro users on the LAN
-    try:
-        api.start_discovery()
-    except Exception:
-        pass
 
     # Helper to create the floating always-on-top alerts window (initially hidden)
     def create_alerts_window():
@@ -66,22 +57,21 @@ def start_logic():
         height=650,
         on_top=True,
     )
+    api.set_main_window(window)
+    # Pings for the floating alerts window, batched like the main window's (api.ui); it is shown before each batch
+    alerts_ui = UIDispatcher(lambda: alerts_window, before_flush=lambda: alerts_window.show())
 
     def on_ping_received(sender_ip):
-        # Pass IP safely to JS (no injection)
-        safe_ip = json.dumps(str(sender_ip))
-        window.evaluate_js(f"showAlert({safe_ip})")
+        # Repeated pings from one sender within a frame arrive as one showAlert(ip, count)
+        sender_ip = str(sender_ip)
+        api.ui.post("showAlert", sender_ip, merge=("ping", sender_ip))
         # Also surface the ping in the floating alerts window, but only if user opted in (pinned)
         try:
             if api.is_alerts_pinned():
-                alerts_window.show()
-                alerts_window.evaluate_js(f"showPing({safe_ip})")
+                alerts_ui.post("showPing", sender_ip, merge=("ping", sender_ip))
         except Exception:
             pass
 
-    # Start the UDP listener in a background thread so the window stays active
-    threading.Thread(target=engine.listen_forever, args=(on_ping_received,), daemon=True).start()
-
     def on_message_received(data):
         sender_mac = data.get("sender_mac") or ""
         sender_name = data.get("sender_name") or "Unknown"
@@ -94,19 +84,19 @@ def start_logic():
         else:
             if not api.is_friend(sender_mac):
                 return
+        # Where their packet came from is where they are now: lets pings skip the scan
+        api.observe_peer(sender_mac, data.get("source_ip") or data.get("sender_ip"), "traffic")
         result = api.record_incoming_message(sender_mac, sender_name, text, room_id, room_name)
         peer_key = result.get("peer_key") or ""
         def safe(s):
-            return json.dumps(str(s) if s is not None else "")
-        try:
-            window.evaluate_js(
-                "onIncomingMessage(" + safe(peer_key) + "," + safe(sender_name) + "," + safe(sender_mac) + ","
-                + safe(text) + "," + safe(room_id) + "," + safe(room_name) + ")"
-            )
-        except Exception:
-            pass
+            return str(s) if s is not None else ""
+        api.ui.post(
+            "onIncomingMessage", safe(peer_key), safe(sender_name), safe(sender_mac), safe(text), safe(room_id), safe(room_name)
+        )
 
-    threading.Thread(target=engine.listen_messages_forever, args=(on_message_received,), daemon=True).start()
+    # Listen for pings, messages and discovery beacons (and send ours) on one background event loop,
+    # so the window stays active
+    api.start_network(on_ping=on_ping_received, on_message=on_message_received)
 
     # Launch both windows, then drop the main window out of always-on-top after a short moment
     def _after_start(main_win, alerts_win):
@@ -117,7 +107,10 @@ def start_logic():
         except Exception:
             pass
 
-    webview.start(_after_start, args=(window, alerts_window), debug=False)
+    try:
+        webview.start(_after_start, args=(window, alerts_window), debug=False)
+    finally:
+        api.stop_network()
 
 if __name__ == "__main__":
     start_logic()
\ No newline at end of file
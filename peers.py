@@ -0,0 +1,210 @@
+"""
+Table of peers heard via discovery beacons: bounded, with records expired by age and kept sorted as they change, so
+reads and beacon updates stay cheap however many apps are on the network.
+"""
+import bisect
+import collections
+import heapq
+import itertools
+import threading
+
+from logic import DEFAULT_PORT, PEER_STALE_SECONDS
+
+# Most peers remembered; a new one beyond this pushes out the one heard from longest ago
+PEER_TABLE_SIZE = 4096
+# Peers not heard from for this long (seconds) are forgotten
+PEER_EXPIRE_SECONDS = 3600.0
+
+
+class PeerRecord:
+    """One peer. online is what the table last decided (see PeerTable.expire), not recomputed from the clock."""
+
+    __slots__ = ("mac", "ip", "name", "port", "proto", "last_seen", "online", "key")
+
+    def __init__(self, mac):
+        self.mac = mac
+        self.ip = ""
+        self.name = "Unknown"
+        self.port = DEFAULT_PORT
+        self.proto = 1
+        self.last_seen = 0.0
+        self.online = False
+        self.key = None  # this record's entry in PeerTable._index; None once it has been removed
+
+    def view(self):
+        return {
+            "ip": self.ip,
+            "name": self.name,
+            "mac": self.mac,
+            "port": self.port,
+            "last_seen": self.last_seen,
+            "online": self.online,
+        }
+
+
+class PeerTable:
+    """Peers by MAC, at most max_size of them. Thread-safe.
+
+    Two min-heaps on last_seen decide who goes offline (stale seconds) and who is forgotten (expire seconds). Each
+    record has at most one entry per heap; a popped entry older than the record's last_seen is pushed again at that
+    time instead of acting, so beacons never touch the heaps, and entries of removed records are skipped.
+    The (offline, name, mac) index is a sorted list updated with bisect only when a peer is added, renamed, goes
+    offline or comes back.
+    """
+
+    def __init__(self, max_size=PEER_TABLE_SIZE, stale=PEER_STALE_SECONDS, expire=PEER_EXPIRE_SECONDS):
+        self.max_size = max_size
+        self.stale = stale
+        self.expire_after = expire
+        self._lock = threading.Lock()
+        self._peers = {}  # mac -> PeerRecord
+        self._by_ip = collections.defaultdict(set)  # ip -> MACs announcing it
+        self._index = []  # sorted (not online, name.lower(), mac)
+        self._stale_heap = []  # (last_seen, tiebreak, PeerRecord) for online peers
+        self._expire_heap = []  # (last_seen, tiebreak, PeerRecord) for every peer
+        self._tiebreak = itertools.count()
+        self._online_protos = collections.Counter()  # protocol version -> online peers speaking it
+        self.evicted = 0  # peers pushed out by max_size (not counting ones forgotten by age)
+
+    def __len__(self):
+        return len(self._peers)
+
+    def update(self, peer, now):
+        """Record a beacon (dict with mac, ip, name, port, proto) heard at `now`. Returns (view, changed, removed):
+        changed is True if the peer is new, came back online or changed its ip / name / port; removed lists MACs
+        dropped to make room or because they expired."""
+        mac = peer["mac"]
+        with self._lock:
+            removed = []
+            rec = self._peers.get(mac)
+            if rec is None:
+                removed = self._expire_old(now)
+                while len(self._peers) >= self.max_size:
+                    oldest = self._pop_due(self._expire_heap, None)
+                    self._remove(oldest)
+                    removed.append(oldest.mac)
+                    self.evicted += 1
+                rec = self._peers[mac] = PeerRecord(mac)
+                self._push(self._expire_heap, now, rec)
+                changed = True
+            else:
+                changed = not rec.online or (rec.ip, rec.name, rec.port) != (peer["ip"], peer["name"], peer["port"])
+            if rec.ip != peer["ip"]:
+                self._unlink_ip(rec)
+                self._by_ip[peer["ip"]].add(mac)
+            if rec.online:
+                self._online_protos[rec.proto] -= 1
+            rec.ip, rec.port, rec.proto, rec.last_seen = peer["ip"], peer["port"], peer["proto"], now
+            if not rec.online:
+                self._push(self._stale_heap, now, rec)
+            self._online_protos[rec.proto] += 1
+            if changed:
+                rec.name = peer["name"]
+                rec.online = True
+                self._reindex(rec)
+            return rec.view(), changed, removed
+
+    def expire(self, now):
+        """Mark peers silent for `stale` seconds offline and forget those silent for `expire` seconds.
+        Returns (views of peers that just went offline, MACs forgotten)."""
+        with self._lock:
+            went_offline = []
+            while True:
+                rec = self._pop_due(self._stale_heap, now - self.stale)
+                if rec is None:
+                    break
+                rec.online = False
+                self._online_protos[rec.proto] -= 1
+                self._reindex(rec)
+                went_offline.append(rec.view())
+            return went_offline, self._expire_old(now)
+
+    def next_expiry(self, now):
+        """Seconds until expire() may have an online peer to mark offline (possibly early), or None if none is online."""
+        with self._lock:
+            if not self._stale_heap:
+                return None
+            return max(0.0, self._stale_heap[0][0] + self.stale - now)
+
+    def get(self, mac):
+        with self._lock:
+            rec = self._peers.get(mac)
+            return rec.view() if rec is not None else None
+
+    def proto_for_ip(self, ip):
+        """Highest protocol version announced by peers at ip (1 if none)."""
+        with self._lock:
+            return max((self._peers[mac].proto for mac in self._by_ip.get(ip, ())), default=1)
+
+    def min_online_proto(self):
+        """Lowest protocol version among online peers, or None if nobody is online."""
+        with self._lock:
+            return min((proto for proto, count in self._online_protos.items() if count > 0), default=None)
+
+    def query(self, offset=0, limit=None, online=None, text=None, exclude=None):
+        """(number of matching peers, [view, ...] for the page offset:offset+limit) in (online first, name) order.
+        online filters by state; text keeps peers whose name, MAC or IP contains it (case-insensitive); exclude
+        is a MAC to leave out. Without text / exclude only the requested page is looked at."""
+        text = (text or "").lower()
+        with self._lock:
+            split = bisect.bisect_left(self._index, (True,))  # first offline peer
+            lo, hi = {True: (0, split), False: (split, len(self._index))}.get(online, (0, len(self._index)))
+            if text or exclude:
+                keys = [
+                    k for k in itertools.islice(self._index, lo, hi)
+                    if k[2] != exclude
+                    and (not text or text in k[1] or text in k[2] or text in self._peers[k[2]].ip)
+                ]
+                lo, hi = 0, len(keys)
+            else:
+                keys = self._index
+            start = lo + offset
+            end = hi if limit is None else min(hi, start + limit)
+            return hi - lo, [self._peers[k[2]].view() for k in keys[start:end]]
+
+    def _reindex(self, rec):
+        if rec.key is not None:
+            self._index.pop(bisect.bisect_left(self._index, rec.key))
+        rec.key = (not rec.online, rec.name.lower(), rec.mac)
+        bisect.insort(self._index, rec.key)
+
+    def _push(self, heap, when, rec):
+        heapq.heappush(heap, (when, next(self._tiebreak), rec))
+
+    def _pop_due(self, heap, before):
+        """Pop and return the live record with the oldest last_seen if that is before `before` (None: any), else
+        None. Entries found out of date are pushed again at the record's real last_seen."""
+        while heap and (before is None or heap[0][0] < before):
+            when, _, rec = heapq.heappop(heap)
+            if rec.key is None or (heap is self._stale_heap and not rec.online):
+                continue  # removed, or already offline
+            if rec.last_seen > when:
+                self._push(heap, rec.last_seen, rec)  # heard from since; look again at that age
+                continue
+            return rec
+        return None
+
+    def _expire_old(self, now):
+        removed = []
+        while True:
+            rec = self._pop_due(self._expire_heap, now - self.expire_after)
+            if rec is None:
+                return removed
+            self._remove(rec)
+            removed.append(rec.mac)
+
+    def _remove(self, rec):
+        """Drop rec from everything but the heaps (its entries there are skipped when popped)."""
+        del self._peers[rec.mac]
+        if rec.online:
+            self._online_protos[rec.proto] -= 1
+        self._index.pop(bisect.bisect_left(self._index, rec.key))
+        rec.key = None
+        self._unlink_ip(rec)
+
+    def _unlink_ip(self, rec):
+        macs = self._by_ip.get(rec.ip)
+        if macs is not None:
+            macs.discard(rec.mac)
+            if not macs:
+                del self._by_ip[rec.ip]
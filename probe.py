@@ -0,0 +1,68 @@
+"""
+In-process address sweep used to fill the ARP / neighbour table before looking a MAC up in it.
+
+Sending any IP datagram to an address on the local network makes the kernel resolve that address with ARP, so a
+paced burst of tiny UDP packets from one non-blocking socket does what spawning `ping` for every address used to:
+no subprocesses, no raw-socket privileges, and nobody has to answer.
+"""
+import asyncio
+import time
+
+# Discard service: the datagram itself is irrelevant, the ARP request it causes is the point
+PROBE_PORT = 9
+# Probes per second, and how many go out back-to-back before pacing
+PROBE_RATE = 1500
+PROBE_BURST = 64
+# After the last probe, give ARP replies this long (seconds) to arrive before the final check
+PROBE_SETTLE = 0.3
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    def error_received(self, exc):
+        # ICMP unreachable etc. for addresses with nobody behind them; expected during a sweep.
+        pass
+
+
+class ProbeEngine:
+    """Sends one empty UDP datagram to each address at a bounded rate, with a deadline and early exit."""
+
+    def __init__(self, rate=PROBE_RATE, burst=PROBE_BURST, port=PROBE_PORT, settle=PROBE_SETTLE):
+        self.rate = rate
+        self.burst = burst
+        self.port = port
+        self.settle = settle
+
+    async def probe(self, addresses, timeout=3.0, until=None, check_every=256):
+        """Probe each address in order. until() is called every `check_every` probes and once more after the
+        settle delay; the sweep stops as soon as it returns something truthy, which is then returned.
+        Stops (returning None) when `timeout` seconds have passed."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        transport, _ = await loop.create_datagram_endpoint(_ProbeProtocol, local_addr=("0.0.0.0", 0))
+        try:
+            sent = 0
+            started = time.monotonic()
+            for addr in addresses:
+                if time.monotonic() >= deadline:
+                    return None
+                try:
+                    transport.sendto(b"", (addr, self.port))
+                except OSError:
+                    pass
+                sent += 1
+                if until is not None and sent % check_every == 0:
+                    found = until()
+                    if found:
+                        return found
+                if sent % self.burst == 0:
+                    # Pace to `rate`: sleep until this many probes are due
+                    delay = started + sent / self.rate - time.monotonic()
+                    await asyncio.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+            await asyncio.sleep(max(0.0, min(self.settle, deadline - time.monotonic())))
+            return until() if until is not None else None
+        finally:
+            transport.close()
+
+    def run(self, addresses, timeout=3.0, until=None, check_every=256):
+        """Blocking probe() for callers on ordinary threads."""
+        return asyncio.run(self.probe(addresses, timeout, until, check_every))
@@ -0,0 +1,36 @@
+"""
+Token buckets keyed by packet source (IP or MAC), so one misbehaving or looping client cannot flood the listeners.
+"""
+import collections
+
+# Most keys tracked per limiter; the least recently seen is forgotten first (it starts again with a full bucket)
+MAX_BUCKETS = 4096
+
+
+class TokenBuckets:
+    """A token bucket per key: `rate` tokens a second, holding at most `burst`. Not thread-safe: use from the
+    network loop only."""
+
+    def __init__(self, rate, burst, max_keys=MAX_BUCKETS):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()  # key -> [tokens, monotonic time last topped up]
+        self.throttled = 0  # packets refused
+
+    def allow(self, key, now):
+        """Take a token for key at monotonic time `now`: True if there was one, else False (and counted)."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True
+        self.throttled += 1
+        return False
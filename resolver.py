@@ -0,0 +1,162 @@
+"""
+MAC -> IP resolution for friends. Answers come from the cheapest source that has a fresh one, and every answer says
+where it came from and how old it is.
+"""
+import collections
+import threading
+import time
+
+from logic import PEER_STALE_SECONDS
+
+# Beacons / incoming messages are trusted as "where that MAC is now" for this long (seconds)
+OBSERVATION_TTL = PEER_STALE_SECONDS
+
+# After a sweep fails to find a MAC, further sweeps for it are skipped for BACKOFF_MIN seconds, doubling with each
+# consecutive failure up to BACKOFF_MAX. A beacon/message from it, or its MAC turning up in the neighbour table, ends
+# the wait; other changes on the LAN do not.
+BACKOFF_MIN = 15
+BACKOFF_MAX = 600
+
+# ip, where it came from (one of SOURCE_LABELS), and how long ago it was seen (seconds; 0 if unknown)
+Resolution = collections.namedtuple("Resolution", "ip source age")
+# A MAC we are backing off from: consecutive failed sweeps, seconds since the last one, seconds until the next is allowed
+Backoff = collections.namedtuple("Backoff", "attempts age retry_in")
+
+SOURCE_LABELS = {
+    "self": "this device",
+    "beacon": "seen via discovery beacon",
+    "traffic": "seen in a message from them",
+    "stored": "saved IP",
+    "neighbor": "neighbour table",
+    "scan": "network scan",
+}
+# Sources that are only a packet's unauthenticated claim: used while fresh, never saved to settings
+OBSERVED_SOURCES = ("beacon", "traffic")
+
+
+class MacResolver:
+    """Resolve MACs to IPs, trying in order:
+
+    1. a beacon or message from that MAC within OBSERVATION_TTL ("beacon" / "traffic")
+    2. the IP stored for the friend in settings ("stored")
+    3. the kernel neighbour table ("neighbor")
+    4. an active sweep of the local networks ("scan"), only if the caller allows it
+
+    MACs that a sweep could not find are remembered, so offline friends are not swept for again on every
+    refresh (see BACKOFF_MIN / BACKOFF_MAX and backoff()).
+    """
+
+    def __init__(self, engine, stored_ip=None):
+        self._engine = engine
+        self._stored_ip = stored_ip  # function(mac) -> saved IP or None
+        self._lock = threading.Lock()
+        self._observed = {}  # mac -> (ip, source, monotonic time seen)
+        self._failures = {}  # mac -> (consecutive failed sweeps, monotonic time of the last)
+
+    @staticmethod
+    def _norm(mac):
+        return (mac or "").lower().replace("-", ":")
+
+    def observe(self, mac, ip, source):
+        """Record that `mac` was just heard from at `ip` (source: "beacon" or "traffic").
+        Returns the previously observed IP (None if none or unchanged)."""
+        mac = self._norm(mac)
+        if not mac or not ip:
+            return None
+        with self._lock:
+            previous = self._observed.get(mac)
+            self._observed[mac] = (ip, source, time.monotonic())
+            self._failures.pop(mac, None)
+        if previous is not None and previous[0] != ip:
+            return previous[0]
+        return None
+
+    def observed(self, mac):
+        """Fresh beacon/traffic Resolution for mac, or None."""
+        entry = self._observed.get(self._norm(mac))
+        if entry is None:
+            return None
+        ip, source, seen = entry
+        age = time.monotonic() - seen
+        if age > OBSERVATION_TTL:
+            return None
+        return Resolution(ip, source, age)
+
+    def lookup(self, mac, stored_ip=None):
+        """Best Resolution without sending anything on the network, or None (then a scan is needed).
+        stored_ip, if given, is used instead of the saved one."""
+        mac = self._norm(mac)
+        if not mac:
+            return None
+        if mac == self._engine.get_my_mac().lower():
+            return Resolution("127.0.0.1", "self", 0.0)
+        res = self.observed(mac)
+        if res is not None:
+            return res
+        if stored_ip is None and self._stored_ip is not None:
+            stored_ip = self._stored_ip(mac)
+        if stored_ip:
+            return Resolution(stored_ip, "stored", 0.0)
+        ip = self._engine.neighbors.lookup(mac)
+        if ip:
+            return Resolution(ip, "neighbor", 0.0)
+        return None
+
+    def backoff(self, mac):
+        """Backoff if recent sweeps failed to find mac and the next one is not due yet, else None."""
+        mac = self._norm(mac)
+        entry = self._failures.get(mac)
+        if entry is None:
+            return None
+        if self._engine.neighbors.lookup(mac):
+            return None  # the sweep did not find it, so it has shown up since
+        attempts, tried = entry
+        delay = min(BACKOFF_MAX, BACKOFF_MIN * 2 ** (attempts - 1))
+        age = time.monotonic() - tried
+        if age >= delay:
+            return None
+        return Backoff(attempts, age, delay - age)
+
+    def last_known_ips(self, macs):
+        """Where these MACs were last seen (observed at any age, or saved), to start a sweep from."""
+        ips = []
+        for mac in macs:
+            entry = self._observed.get(mac)
+            for ip in (entry[0] if entry else None, self._stored_ip(mac) if self._stored_ip else None):
+                if ip and ip not in ips:
+                    ips.append(ip)
+        return ips
+
+    def scan(self, macs, on_found=None, force=False, on_progress=None):
+        """One sweep for several MACs; on_found(mac, Resolution) as each turns up. Returns {mac: Resolution}.
+        MACs still in backoff() are left out unless force is set; if none are left, nothing is sent.
+        The sweep starts around their last-known IPs; on_progress is passed to NetworkEngine.scan_for_macs."""
+        macs = [self._norm(m) for m in macs if m]
+        if not force:
+            macs = [m for m in macs if self.backoff(m) is None]
+        found = {}
+        if not macs:
+            return found
+
+        def report(mac, ip):
+            found[mac] = Resolution(ip, "scan", 0.0)
+            if on_found is not None:
+                on_found(mac, found[mac])
+
+        self._engine.scan_for_macs(macs, on_found=report, hints=self.last_known_ips(macs), on_progress=on_progress)
+        now = time.monotonic()
+        with self._lock:
+            for mac in macs:
+                if mac in found:
+                    self._failures.pop(mac, None)
+                else:
+                    attempts = self._failures.get(mac, (0,))[0]
+                    self._failures[mac] = (attempts + 1, now)
+        return found
+
+    def resolve(self, mac, stored_ip=None):
+        """lookup(), falling back to a sweep. Resolution or None."""
+        res = self.lookup(mac, stored_ip)
+        if res is not None:
+            return res
+        return self.scan([mac]).get(self._norm(mac))
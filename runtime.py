@@ -0,0 +1,599 @@
+"""
+Network runtime: one asyncio event loop, on one thread, that listens for pings, messages and discovery beacons and
+sends our own beacon every BEACON_INTERVAL seconds (longer on busy networks; see _beacon_delay).
+
+The loop never runs app code. Callbacks (UI updates, settings writes, anything that may block) are handed to a
+single worker thread in arrival order, so a slow callback delays the next callback but never a PONG. beacon_info()
+runs on a thread of its own, so neither a callback backlog nor a stalled send can hold up a beacon.
+Each kind of packet may only have CALLBACK_BACKLOG callbacks waiting; beyond that they are dropped and counted
+(see NetworkRuntime.stats), so a burst cannot queue unbounded work or memory.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+
+import wire
+from logic import (
+    ACK_PROTO,
+    BEACON_INTERVAL,
+    BINARY_PROTO,
+    DEFAULT_PORT,
+    DISCOVERY_PORT,
+    FRAME_PROTO,
+    MESSAGE_PORT,
+    PEER_STALE_SECONDS,
+    PING_PROTO,
+    PROTO_VERSION,
+    parse_ack,
+    parse_beacon,
+    parse_message,
+)
+from ratelimit import TokenBuckets
+
+# stop() waits this long (seconds) for the loop thread to close its sockets and exit
+STOP_TIMEOUT = 2.0
+# How long (seconds) a ping waits for its PONG
+PING_TIMEOUT = 2.0
+# Longest nonce a "PING:<nonce>" may carry to be answered
+MAX_NONCE = 32
+# A message to a peer that acks is sent again whenever no ack arrives within the next of these waits (seconds);
+# to a peer not known to ack it is sent once and the ack awaited for the last (longest) wait only
+ACK_TIMEOUTS = (0.5, 1.0, 2.0, 4.0)
+# At most this many messages wait for acks at once; the rest queue behind them
+MAX_IN_FLIGHT = 32
+# Ids of this many recently received messages are remembered, so retransmitted copies are acked but not shown twice
+SEEN_IDS = 512
+# Most callbacks per packet kind waiting for the worker thread; a message that finds its queue full is not acked,
+# so the sender retransmits it later
+CALLBACK_BACKLOG = {"pings": 256, "messages": 1024, "beacons": 512}
+# Per-source budgets, as (packets per second, burst). Per-IP limits are checked before a datagram is even parsed;
+# per-MAC ones once the sender's MAC is known. Refused packets are dropped unanswered and counted (see stats).
+RATE_LIMITS = {
+    "ping_ip": (5.0, 20),  # pings
+    "message_ip": (500.0, 1000),  # datagrams on MESSAGE_PORT: a large message is many fragments, acks count too
+    "message_mac": (10.0, 30),  # whole messages (not acked when refused, so an ack-speaking sender retries)
+    "beacon_ip": (2.0, 6),
+    "beacon_mac": (2.0, 6),
+}
+# Kernel receive buffer asked for on each listening socket (bytes; the OS may grant less), so bursts that arrive
+# while the loop is busy wait in the kernel instead of being dropped there
+RECV_BUFFER = 1024 * 1024
+# The beacon interval grows from BEACON_INTERVAL by this much (seconds) per other app beaconing on the LAN, up to
+# BEACON_MAX_INTERVAL, and each wait is randomised by +/- BEACON_JITTER of itself so apps drift out of step.
+# The cap keeps two beacon waits within PEER_STALE_SECONDS even at full jitter (2 * 6.0 * 1.2 = 14.4 s), so one
+# lost beacon never makes us look offline.
+BEACON_PER_PEER = 0.04
+BEACON_JITTER = 0.2
+BEACON_MAX_INTERVAL = 6.0
+
+
+class _Listener(asyncio.DatagramProtocol):
+    """Hands every datagram to handler(transport, data, addr), on the loop."""
+
+    def __init__(self, handler):
+        self._handler = handler
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            self._handler(self.transport, data, addr)
+        except Exception as e:
+            print(f"Listener error: {e}")
+
+    def error_received(self, exc):
+        # ICMP port unreachable after a PONG to someone who already closed the app, etc.
+        pass
+
+
+class _PingClient(asyncio.DatagramProtocol):
+    """One socket for all outgoing pings. Each PONG is matched to the ping it answers, so many pings can be in
+    flight at once and a late PONG is never taken for a newer ping.
+
+    Binary and "PING:<nonce>" pings are matched by nonce. Bare "PING"s (for peers that only speak the original
+    protocol) can only be matched by who answered: a bare "PONG" from an IP settles the oldest bare ping still
+    waiting there.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self._waiting = {}  # nonce -> (future, monotonic time sent)
+        self._legacy = collections.defaultdict(collections.deque)  # ip -> (future, time sent), oldest first
+        self._seq = itertools.count(random.getrandbits(32))
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        now = time.monotonic()
+        waiter = None
+        if wire.packet_kind(data) == wire.KIND_PONG:
+            try:
+                waiter = self._waiting.pop(b"%08x" % wire.decode_ping(data), None)
+            except struct.error:
+                return
+        elif data.startswith(b"PONG:"):
+            waiter = self._waiting.pop(data[5:], None)
+        elif data == b"PONG":
+            queue = self._legacy.get(addr[0])
+            if queue:
+                waiter = queue.popleft()
+        if waiter is not None and not waiter[0].done():
+            waiter[0].set_result(now - waiter[1])
+
+    def error_received(self, exc):
+        # ICMP port unreachable: nobody listening there; the ping just times out.
+        pass
+
+    async def ping(self, ip, port=DEFAULT_PORT, timeout=PING_TIMEOUT, proto=PROTO_VERSION):
+        """Round-trip time in seconds, or None if no PONG came within timeout. The ping is binary, "PING:<nonce>"
+        or bare depending on the protocol version proto the peer speaks. Raises OSError if it cannot be sent."""
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, time.monotonic())
+        if proto < PING_PROTO:
+            nonce = None
+            queue = self._legacy[ip]
+            queue.append(waiter)
+            packet = b"PING"
+        else:
+            value = next(self._seq) & 0xFFFFFFFF
+            nonce = b"%08x" % value
+            self._waiting[nonce] = waiter
+            packet = wire.encode_ping(value) if proto >= BINARY_PROTO else b"PING:" + nonce
+        try:
+            self.transport.sendto(packet, (ip, port))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if nonce is not None:
+                self._waiting.pop(nonce, None)
+            else:
+                if waiter in queue:
+                    queue.remove(waiter)
+                if not queue:
+                    self._legacy.pop(ip, None)
+
+
+class NetworkRuntime:
+    """Runs the UDP listeners and the beacon timer for a NetworkEngine on one event loop.
+
+    start() binds the ping (engine.port), message and discovery ports and returns once they are listening;
+    stop() closes them and joins the loop thread. The async send_* methods run on the loop; from other threads,
+    submit() them.
+    """
+
+    def __init__(self, engine, rate_limits=None):
+        """rate_limits overrides entries of RATE_LIMITS."""
+        self._engine = engine
+        self._limits = {
+            name: TokenBuckets(rate, burst) for name, (rate, burst) in {**RATE_LIMITS, **(rate_limits or {})}.items()
+        }
+        self._loop = None
+        self._thread = None
+        self._worker = None  # single thread for callbacks and other blocking work
+        self._sender = None  # single thread for message sends, which may wait for send-buffer room
+        self._beaconer = None  # single thread for beacon_info(), kept off the callback queue
+        self._stopping = False
+        self._transports = []
+        self._beacon_task = None
+        self._beacon_wake = None  # asyncio.Event: beacon_now() cuts the current wait short
+        self._beacon_cache = (None, None)  # (beacon_info() it was built from, encoded datagram)
+        self._beaconing = {}  # mac -> monotonic time its last beacon arrived, to size the interval by
+        self._ping_client = None
+        self._window = None  # asyncio.Semaphore(MAX_IN_FLIGHT), made on the loop
+        self._acks = {}  # (message id, ip) -> future set when that ip acks it
+        self._protos = {}  # ip -> highest protocol version its traffic has shown it speaks
+        self._seen = collections.OrderedDict()  # (sender, message id) of recent messages, oldest first
+        self._reassembler = wire.Reassembler()  # for MESSAGE_PORT
+        self._backlog = collections.Counter()  # packet kind -> callbacks submitted and not finished yet
+        self._backlog_lock = threading.Lock()  # _backlog is raised on the loop and lowered on the worker
+        self.dropped = collections.Counter()  # packet kind -> callbacks dropped because CALLBACK_BACKLOG was full
+        self._on_ping = self._on_message = self._on_beacon = self._beacon_info = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, on_ping=None, on_message=None, on_beacon=None, beacon_info=None):
+        """Start listening. on_ping(sender_ip), on_message(message_dict) and on_beacon(peer_dict) are called on the
+        worker thread (see logic.parse_message / parse_beacon for the dicts). beacon_info() -> (display_name, mac,
+        ip, ping_port, binary), or None to skip one, is called before each beacon; without it no beacons are sent."""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._on_ping, self._on_message, self._on_beacon = on_ping, on_message, on_beacon
+        self._beacon_info = beacon_info
+        self._loop = asyncio.new_event_loop()
+        self._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="network-callbacks")
+        self._sender = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="network-send")
+        self._beaconer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="network-beacon")
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="network", daemon=True)
+        self._thread.start()
+        ready.wait(STOP_TIMEOUT)
+
+    def stop(self):
+        """Close the sockets, cancel the beacon timer and wait for the loop thread to exit. Safe to call twice."""
+        thread, loop = self._thread, self._loop
+        if thread is None:
+            return
+        self._stopping = True  # callbacks still queued are dropped
+        try:
+            loop.call_soon_threadsafe(loop.stop)
+        except RuntimeError:
+            pass  # loop already closed
+        thread.join(STOP_TIMEOUT)
+        self._worker.shutdown(wait=False)
+        self._sender.shutdown(wait=False)
+        self._beaconer.shutdown(wait=False)
+        self._thread = self._loop = self._worker = self._sender = self._beaconer = None
+
+    def submit(self, coro):
+        """Run a coroutine (e.g. send_message(...)) on the loop from any thread; returns a concurrent.futures.Future."""
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError("Network runtime is not running")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def ping(self, ip, port=DEFAULT_PORT, timeout=PING_TIMEOUT, proto=PROTO_VERSION):
+        """Ping ip from the shared ping socket: round-trip time in seconds, or None if no PONG within timeout.
+        proto is the protocol version ip speaks; below PING_PROTO the original bare PING is sent. Raises OSError
+        if the ping cannot be sent."""
+        if self._ping_client is None:
+            raise OSError("Ping socket is not open")
+        return await self._ping_client.ping(ip, port, timeout, proto)
+
+    async def ping_many(self, targets, port=DEFAULT_PORT, timeout=PING_TIMEOUT):
+        """Ping every (ip, proto) in targets at once, with one shared deadline `timeout` seconds from now. Returns a
+        list in the same order: round-trip seconds, None (no PONG), or the OSError the ping could not be sent with."""
+        if self._ping_client is None:
+            raise OSError("Ping socket is not open")
+        return await self._ping_all(self._ping_client, targets, port, timeout)
+
+    @staticmethod
+    async def _ping_all(client, targets, port, timeout):
+        return await asyncio.gather(
+            *(client.ping(ip, port, timeout, proto) for ip, proto in targets), return_exceptions=True
+        )
+
+    def ping_blocking(self, ip, port=DEFAULT_PORT, timeout=PING_TIMEOUT, proto=PROTO_VERSION):
+        """ping() for callers on ordinary threads. When the runtime is not running, a throwaway ping socket is used."""
+        return self._run_blocking(lambda client: client.ping(ip, port, timeout, proto), timeout)
+
+    def ping_many_blocking(self, targets, port=DEFAULT_PORT, timeout=PING_TIMEOUT):
+        """ping_many() for callers on ordinary threads (see ping_blocking)."""
+        return self._run_blocking(lambda client: self._ping_all(client, targets, port, timeout), timeout)
+
+    def _run_blocking(self, ping, timeout):
+        """Run ping(client) (a coroutine function taking a _PingClient) and wait for its result."""
+        if self._loop is not None:
+
+            async def on_loop():
+                if self._ping_client is None:
+                    raise OSError("Ping socket is not open")
+                return await ping(self._ping_client)
+
+            return self.submit(on_loop()).result(timeout + STOP_TIMEOUT)
+
+        async def standalone():
+            transport, client = await asyncio.get_running_loop().create_datagram_endpoint(
+                _PingClient, local_addr=("0.0.0.0", 0)
+            )
+            try:
+                return await ping(client)
+            finally:
+                transport.close()
+
+        return asyncio.run(standalone())
+
+    def deliver(self, target_ip, payload_dict, on_result=None, proto=None):
+        """Send a message whose payload has an "id" and wait for target_ip to ack it, from any thread. proto is the
+        protocol version target_ip speaks (default: peer_proto()): from ACK_PROTO the message is retransmitted on
+        ACK_TIMEOUTS, and it is encoded as for NetworkEngine.send_message_udp. on_result(delivered) is called on
+        the worker thread with True (acked), False (never acked, or could not be sent) or None (sent once to a peer
+        that does not ack, so it is not known). Raises RuntimeError if the runtime is not running."""
+        if proto is None:
+            proto = self.peer_proto(target_ip)
+        future = self.submit(self._deliver(target_ip, payload_dict, proto))
+        if on_result is not None:
+            future.add_done_callback(
+                lambda f: self._dispatch(on_result, not f.cancelled() and f.exception() is None and f.result())
+            )
+        return future
+
+    def peer_proto(self, ip):
+        """Protocol version ip has shown it speaks by what it sent us (acks, fragments, binary packets); 1 if nothing."""
+        return self._protos.get(ip, 1)
+
+    def _learn(self, ip, proto):
+        if self._protos.get(ip, 1) < proto:
+            self._protos[ip] = proto
+
+    async def _deliver(self, target_ip, payload_dict, proto):
+        key = (payload_dict["id"], target_ip)
+        future = asyncio.get_running_loop().create_future()
+        self._acks[key] = future
+        try:
+            async with self._window:
+                sent = False
+                for wait in ACK_TIMEOUTS if proto >= ACK_PROTO else ACK_TIMEOUTS[-1:]:
+                    sent = await self.send_message(target_ip, payload_dict, proto) or sent
+                    try:
+                        return await asyncio.wait_for(asyncio.shield(future), wait)
+                    except asyncio.TimeoutError:
+                        continue
+                # Older apps never ack: an ack still counts if one comes back, but silence says nothing
+                return None if sent and proto < ACK_PROTO else False
+        finally:
+            self._acks.pop(key, None)
+
+    async def send_message(self, target_ip, payload_dict, proto=1):
+        """Send one message (see NetworkEngine.send_message_udp); True if it was sent. Sent from the send thread, so a
+        large fragmented message waiting for send-buffer room does not hold up the loop."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._sender, self._engine.send_message_udp, target_ip, payload_dict, proto
+        )
+
+    async def send_beacon(self, display_name, mac, ip, ping_port, binary=False):
+        """Broadcast one discovery beacon (see NetworkEngine.send_beacon_once)."""
+        self._engine.send_beacon_once(display_name, mac, ip, ping_port, binary)
+
+    def stats(self):
+        """Counters for diagnostics: callbacks waiting and dropped per packet kind, and fragmented messages given
+        up on, and packets refused by RATE_LIMITS."""
+        with self._backlog_lock:
+            backlog = dict(self._backlog)
+        return {
+            "backlog": backlog,
+            "dropped": dict(self.dropped),
+            "throttled": {name: limit.throttled for name, limit in self._limits.items()},
+            "reassembly_dropped": self._reassembler.dropped,
+        }
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) on the worker thread in `delay` seconds, from any thread. Dropped if the runtime
+        stops first (or is not running)."""
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(loop.call_later, delay, self._dispatch, callback, *args)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def beacon_now(self):
+        """Send the next beacon right away (e.g. our name changed) instead of at the end of the current wait.
+        Any thread; does nothing when the runtime or its beacon timer is not running."""
+        loop, wake = self._loop, self._beacon_wake
+        if loop is None or wake is None:
+            return
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:
+            pass  # loop already closed
+
+    def _run(self, ready):
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._open())
+        finally:
+            ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(self._close())
+            loop.close()
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        self._window = asyncio.Semaphore(MAX_IN_FLIGHT)
+        listeners = (
+            ("pings", self._engine.port, False, self._handle_ping),
+            ("messages", MESSAGE_PORT, True, self._handle_message),
+            ("discovery beacons", DISCOVERY_PORT, True, self._handle_beacon),
+        )
+        for what, port, reuse, handler in listeners:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                if reuse:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+                except OSError:
+                    pass  # keep the default size
+                sock.bind(("", port))
+                transport, _ = await loop.create_datagram_endpoint(lambda: _Listener(handler), sock=sock)
+            except OSError as e:
+                sock.close()
+                print(f"Listener error ({what}, port {port}): {e}")
+                continue
+            self._transports.append(transport)
+            print(f"Listening for {what} on port {port}...")
+        try:
+            transport, self._ping_client = await loop.create_datagram_endpoint(_PingClient, local_addr=("0.0.0.0", 0))
+            self._transports.append(transport)
+        except OSError as e:
+            print(f"Ping socket error: {e}")
+        if self._beacon_info is not None:
+            self._beacon_wake = asyncio.Event()
+            self._beacon_task = loop.create_task(self._beacon_loop())
+
+    async def _close(self):
+        if self._beacon_task is not None:
+            self._beacon_task.cancel()
+            try:
+                await self._beacon_task
+            except asyncio.CancelledError:
+                pass
+            self._beacon_task = None
+        self._beacon_wake = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        self._ping_client = None
+        await asyncio.sleep(0)  # let the transports finish closing
+
+    def _dispatch(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            self._worker.submit(self._call, callback, args)
+        except RuntimeError:
+            pass  # shutting down
+
+    def _call(self, callback, args):
+        if self._stopping:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Network callback error: {e}")
+
+    def _has_room(self, kind):
+        """True if another `kind` callback fits in CALLBACK_BACKLOG; else counts it as dropped."""
+        if self._backlog[kind] < CALLBACK_BACKLOG[kind]:
+            return True
+        self.dropped[kind] += 1
+        return False
+
+    def _dispatch_packet(self, kind, callback, *args):
+        """_dispatch() for a received packet, counted against CALLBACK_BACKLOG[kind] (dropped if it is full)."""
+        if callback is None or not self._has_room(kind):
+            return
+        with self._backlog_lock:
+            self._backlog[kind] += 1
+        try:
+            self._worker.submit(self._call_packet, kind, callback, args)
+        except RuntimeError:
+            self._packet_done(kind)  # shutting down
+
+    def _call_packet(self, kind, callback, args):
+        try:
+            self._call(callback, args)
+        finally:
+            self._packet_done(kind)
+
+    def _packet_done(self, kind):
+        with self._backlog_lock:
+            self._backlog[kind] -= 1
+
+    def _handle_ping(self, transport, data, addr):
+        if not self._limits["ping_ip"].allow(addr[0], time.monotonic()):
+            return
+        # Answer in the form the ping came in, echoing any nonce so the sender knows which ping this answers
+        if data == b"PING":
+            reply = b"PONG"
+        elif data.startswith(b"PING:") and 0 < len(data) - 5 <= MAX_NONCE:
+            reply = b"PONG:" + data[5:]
+            self._learn(addr[0], PING_PROTO)
+        elif wire.packet_kind(data) == wire.KIND_PING and len(data) >= wire.PACKET_HEADER.size + 4:
+            reply = wire.encode_ping(wire.decode_ping(data), wire.KIND_PONG)
+            self._learn(addr[0], BINARY_PROTO)
+        else:
+            return
+        # Send PONG back to sender so they get delivery confirmation
+        try:
+            transport.sendto(reply, addr)
+        except OSError as e:
+            print(f"PONG send error: {e}")
+        self._dispatch_packet("pings", self._on_ping, addr[0])
+
+    def _handle_message(self, transport, data, addr):
+        now = time.monotonic()
+        if not self._limits["message_ip"].allow(addr[0], now):
+            return
+        message_id = parse_ack(data)
+        if message_id is not None:
+            self._learn(addr[0], BINARY_PROTO if wire.packet_kind(data) is not None else ACK_PROTO)
+            future = self._acks.get((message_id, addr[0]))
+            if future is not None and not future.done():
+                future.set_result(True)
+            return
+        if wire.is_fragment(data):
+            self._learn(addr[0], FRAME_PROTO)
+        data = self._reassembler.feed(data, addr)
+        if data is None:
+            return  # waiting for more fragments
+        message = parse_message(data, addr)
+        if message is None:
+            return
+        binary = wire.packet_kind(data) is not None
+        if binary:
+            self._learn(addr[0], BINARY_PROTO)
+        message_id = message["id"]
+        seen = (message["sender_mac"] or addr[0], message_id)
+        if message_id is not None and seen in self._seen:
+            # Ack every copy (the sender may have missed our earlier ack), but show only the first
+            self._engine.send_ack(addr[0], message_id, binary)
+            self._seen.move_to_end(seen)
+            return
+        # Over the sender's budget or no room to show it: no ack either, so the sender tries again in a moment
+        if not self._limits["message_mac"].allow(seen[0], now):
+            return
+        if message_id is not None:
+            if self._on_message is not None and not self._has_room("messages"):
+                return
+            self._engine.send_ack(addr[0], message_id, binary)
+            self._seen[seen] = True
+            if len(self._seen) > SEEN_IDS:
+                self._seen.popitem(last=False)
+        self._dispatch_packet("messages", self._on_message, message)
+
+    def _handle_beacon(self, transport, data, addr):
+        now = time.monotonic()
+        if not self._limits["beacon_ip"].allow(addr[0], now):
+            return
+        peer = parse_beacon(data, addr)
+        if peer is None or not self._limits["beacon_mac"].allow(peer["mac"], now):
+            return
+        own = self._beacon_cache[0]
+        if own is None or peer["mac"] != (own[1] or "").lower().replace("-", ":"):  # not our own beacon back
+            self._beaconing[peer["mac"]] = now
+        self._dispatch_packet("beacons", self._on_beacon, peer)
+
+    def _beacon_payload(self):
+        """beacon_info(), on the beacon thread: reading settings or detecting the MAC may block."""
+        info = self._beacon_info()
+        if info is not None:
+            self._engine.get_broadcast_addresses()  # detect now if needed, not on the loop
+        return info
+
+    def _beacon_delay(self):
+        """Seconds until the next beacon: longer the more other apps are beaconing (see BEACON_PER_PEER), jittered."""
+        now = time.monotonic()
+        for mac, seen in list(self._beaconing.items()):
+            if now - seen > PEER_STALE_SECONDS:
+                del self._beaconing[mac]
+        interval = min(BEACON_MAX_INTERVAL, BEACON_INTERVAL + BEACON_PER_PEER * len(self._beaconing))
+        return interval * random.uniform(1 - BEACON_JITTER, 1 + BEACON_JITTER)
+
+    async def _beacon_loop(self):
+        """First beacon at once, then one per _beacon_delay() or beacon_now(). The datagram is encoded again only
+        when beacon_info() changes (name, IP, format)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._beacon_wake.clear()
+            try:
+                info = await loop.run_in_executor(self._beaconer, self._beacon_payload)
+                if info is not None:
+                    if info != self._beacon_cache[0]:
+                        self._beacon_cache = (info, self._engine.encode_beacon(*info))
+                    self._engine.broadcast_beacon(self._beacon_cache[1])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Beacon sender error: {e}")
+            try:
+                await asyncio.wait_for(self._beacon_wake.wait(), self._beacon_delay())
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,71 @@
+"""
+Read-latency benchmark for settings.json: parse-per-call (old Bridge.get_settings) vs the in-memory SettingsStore.
+
+Run from the project folder:  python scripts/bench_settings.py
+Uses a throwaway settings file in a temp folder; your own settings.json is never touched.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage import SettingsStore  # noqa: E402
+
+FRIENDS = 25
+ROOMS = 5
+READS = 20000
+
+
+def _legacy_get_settings(path):
+    """What Bridge.get_settings did before the store: open and parse on every call."""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            s = json.load(f)
+            s.setdefault("users", [])
+            s.setdefault("display_name", "")
+            s.setdefault("alerts_pinned", False)
+            s.setdefault("rooms", [])
+            return s
+    return {"users": [], "display_name": "", "alerts_pinned": False, "rooms": []}
+
+
+def _sample_settings():
+    users = [
+        {"name": f"Friend {i}", "mac": "50:eb:f6:7f:%02x:%02x" % (i // 256, i % 256), "ip": f"192.168.1.{i + 10}",
+         "last_check": "Found at 192.168.1.%d and saved. Ready to ping." % (i + 10)}
+        for i in range(FRIENDS)
+    ]
+    rooms = [
+        {"id": f"room{i:04d}", "name": f"Room {i}", "members": [u["mac"] for u in users[i::ROOMS]]}
+        for i in range(ROOMS)
+    ]
+    return {"users": users, "display_name": "Bench", "alerts_pinned": True, "rooms": rooms}
+
+
+def _time_per_call(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "settings.json")
+        with open(path, "w") as f:
+            json.dump(_sample_settings(), f, indent=4)
+        store = SettingsStore(path)
+        store.get()
+
+        before = _time_per_call(lambda: _legacy_get_settings(path), READS)
+        after = _time_per_call(store.get, READS)
+        print(f"settings.json: {FRIENDS} friends, {ROOMS} rooms, {os.path.getsize(path)} bytes, {READS} reads each")
+        print(f"  parse per call (before): {before:8.2f} us/read")
+        print(f"  SettingsStore  (after):  {after:8.2f} us/read")
+        print(f"  speed-up: {before / after:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
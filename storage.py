@@ -0,0 +1,352 @@
+"""
+Settings and message-history persistence.
+
+settings.json is loaded once and kept in memory; it is only re-read when the file changes on disk. Changes are made
+in memory and written back once, shortly afterwards, with an atomic replace. Message history is an append-only
+JSON-lines log per conversation, so saving a message costs the same however long the conversation is.
+"""
+import contextlib
+import copy
+import json
+import os
+import struct
+import threading
+import time
+
+SETTINGS_DEFAULTS = {"users": [], "display_name": "", "alerts_pinned": False, "rooms": []}
+# Readers stat settings.json at most this often (seconds) to pick up edits made outside the app
+STAT_INTERVAL = 2.0
+# Changes are written to disk this long (seconds) after the first unsaved edit, so bursts of edits cost one write
+FLUSH_DELAY = 0.5
+# One little-endian uint64 byte offset per message line in message_history/<peer_key>.idx
+INDEX_ENTRY = struct.Struct("<Q")
+# An entry appended with a "delivered" key keeps it last, in a fixed-width slot, so mark_delivered() can overwrite the
+# value in place (JSON allows the padding space) without moving any later line
+_DELIVERED_SLOTS = {None: b"null ", True: b"true ", False: b"false"}
+_DELIVERED_KEY = b', "delivered": '
+
+
+def _with_defaults(settings):
+    for key, value in SETTINGS_DEFAULTS.items():
+        settings.setdefault(key, copy.deepcopy(value))
+    return settings
+
+
+class SettingsStore:
+    """Thread-safe in-memory copy of settings.json.
+
+    get() returns a shared snapshot that is never mutated in place, so hot paths can read it without
+    locking or copying. Changes go through edit(), which swaps in a modified copy and schedules one
+    debounced write (temp file + os.replace, so readers never see a half-written file).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._data = None
+        self._file_sig = None
+        self._next_stat = 0.0
+        self._working = None  # copy being changed by the current edit() block
+        self._dirty = False
+        self._flush_timer = None
+
+    def _stat(self):
+        """(mtime_ns, size) of the settings file, or None if it does not exist."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self, sig):
+        if sig is None:
+            data = {}
+        else:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                # Half-written by another program? Keep what we have and retry on the next stat.
+                if self._data is None:
+                    raise
+                print(f"Settings reload error: {e}")
+                return
+        self._data = _with_defaults(data)
+        self._file_sig = sig
+
+    def get(self):
+        """Current settings. Shared between threads: treat the result as read-only."""
+        data = self._data
+        if data is not None and time.monotonic() < self._next_stat:
+            return data
+        with self._lock:
+            sig = self._stat()
+            # Unsaved edits win over the file; it is rewritten on the next flush anyway.
+            if self._data is None or (sig != self._file_sig and not self._dirty):
+                self._load(sig)
+            self._next_stat = time.monotonic() + STAT_INTERVAL
+            return self._data
+
+    def copy(self):
+        """Private deep copy of the current settings, safe to modify."""
+        return copy.deepcopy(self.get())
+
+    @contextlib.contextmanager
+    def edit(self):
+        """Change settings: `with store.edit() as s: s["display_name"] = "Alex"`.
+
+        Yields a private copy; when the block exits cleanly it becomes the current settings and a
+        write is scheduled. Nested edit() blocks in the same thread share the outer copy, so several
+        changes are applied together and written once. An exception discards the changes.
+        """
+        with self._lock:
+            outer = self._working is None
+            if outer:
+                self._working = copy.deepcopy(self.get())
+            try:
+                yield self._working
+            except BaseException:
+                if outer:
+                    self._working = None
+                raise
+            if outer:
+                self._data = _with_defaults(self._working)
+                self._working = None
+                self._dirty = True
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(FLUSH_DELAY, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+
+    def flush(self):
+        """Write pending changes to settings.json now (no-op if there are none)."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(self._data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Settings save error: {e}")
+                return
+            self._dirty = False
+            self._file_sig = self._stat()
+
+
+class MessageHistory:
+    """Per-conversation message logs: message_history/<peer_key>.jsonl, one JSON object per line.
+
+    Appends only ever add a line. A line torn by a crash mid-write is skipped when reading, and the
+    next append starts on a fresh line. A sidecar <peer_key>.idx holds the byte offset of every line
+    so a page of history is read straight from the end of the log, however long the conversation.
+    Old whole-file <peer_key>.json histories are converted the first time their conversation is used.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._migrated = set()
+        self._indexed = set()
+
+    def _path(self, peer_key):
+        return os.path.join(self.directory, peer_key + ".jsonl")
+
+    def _index_path(self, peer_key):
+        return os.path.join(self.directory, peer_key + ".idx")
+
+    def _migrate(self, peer_key):
+        """One-time conversion of <peer_key>.json (a JSON list, rewritten per message) to the .jsonl log."""
+        if peer_key in self._migrated:
+            return
+        self._migrated.add(peer_key)
+        old = os.path.join(self.directory, peer_key + ".json")
+        if not os.path.isfile(old):
+            return
+        path = self._path(peer_key)
+        try:
+            # A .jsonl next to the old file means an earlier migration got as far as the replace.
+            if not os.path.exists(path):
+                with open(old, "r") as f:
+                    entries = json.load(f)
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    for entry in entries if isinstance(entries, list) else []:
+                        f.write(json.dumps(entry) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, path)
+            os.remove(old)
+        except (OSError, ValueError) as e:
+            print(f"History migration error ({peer_key}): {e}")
+
+    def _ensure_index(self, peer_key):
+        """Make sure <peer_key>.idx lists every complete line of the log; rebuild it if not.
+
+        Checked once per conversation, from the end of the files only: the last indexed offset must
+        start a complete line and no complete line may follow it.
+        """
+        if peer_key in self._indexed:
+            return
+        path, idx_path = self._path(peer_key), self._index_path(peer_key)
+        try:
+            idx_size = os.path.getsize(idx_path)
+        except OSError:
+            idx_size = 0
+        try:
+            with open(path, "rb") as f:
+                current = idx_size % INDEX_ENTRY.size == 0
+                tail = 0
+                if current and idx_size:
+                    with open(idx_path, "rb") as idx:
+                        idx.seek(idx_size - INDEX_ENTRY.size)
+                        (last,) = INDEX_ENTRY.unpack(idx.read(INDEX_ENTRY.size))
+                    f.seek(last)
+                    line = f.readline()
+                    current = line.endswith(b"\n")
+                    tail = last + len(line)
+                if current:
+                    f.seek(tail)
+                    current = not f.readline().endswith(b"\n")
+                if not current:
+                    self._rebuild_index(peer_key, f)
+        except FileNotFoundError:
+            if idx_size:
+                os.remove(idx_path)
+        except OSError as e:
+            print(f"History index error ({peer_key}): {e}")
+            return
+        self._indexed.add(peer_key)
+
+    def _rebuild_index(self, peer_key, f):
+        """Rewrite the index from a full scan of the log (open file f)."""
+        f.seek(0)
+        offsets = []
+        offset = 0
+        for raw in f:
+            if raw.endswith(b"\n"):
+                try:
+                    json.loads(raw)
+                    offsets.append(offset)
+                except ValueError:
+                    pass
+            offset += len(raw)
+        idx_path = self._index_path(peer_key)
+        with open(idx_path + ".tmp", "wb") as out:
+            out.write(b"".join(INDEX_ENTRY.pack(o) for o in offsets))
+        os.replace(idx_path + ".tmp", idx_path)
+
+    def append(self, peer_key, entry):
+        """Add one entry to the end of the conversation log and return its seq (None if it could not be saved).
+        If the entry has a "delivered" key (None, True or False), it can be changed later with mark_delivered()."""
+        if "delivered" in entry:
+            rest = {k: v for k, v in entry.items() if k != "delivered"}
+            line = json.dumps(rest).encode("utf-8")[:-1] + _DELIVERED_KEY + _DELIVERED_SLOTS[entry["delivered"]] + b"}\n"
+        else:
+            line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self._lock:
+            self._migrate(peer_key)
+            self._ensure_index(peer_key)
+            try:
+                seq = os.path.getsize(self._index_path(peer_key)) // INDEX_ENTRY.size
+            except OSError:
+                seq = 0
+            try:
+                with open(self._path(peer_key), "a+b") as f:
+                    offset = f.tell()
+                    if offset > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            line = b"\n" + line
+                            offset += 1
+                    f.write(line)
+            except OSError as e:
+                print(f"History append error ({peer_key}): {e}")
+                return None
+            try:
+                with open(self._index_path(peer_key), "ab") as idx:
+                    idx.write(INDEX_ENTRY.pack(offset))
+            except OSError as e:
+                # Rebuilt from the log next time the conversation is opened.
+                print(f"History index error ({peer_key}): {e}")
+                self._indexed.discard(peer_key)
+                try:
+                    os.remove(self._index_path(peer_key))
+                except OSError:
+                    pass
+            return seq
+
+    def mark_delivered(self, peer_key, seq, delivered):
+        """Record whether the entry at seq (appended with a "delivered" key) was delivered. Rewrites only the
+        fixed-width value, in place. Returns False if there is no such entry."""
+        with self._lock:
+            self._ensure_index(peer_key)
+            try:
+                with open(self._index_path(peer_key), "rb") as idx:
+                    idx.seek(int(seq) * INDEX_ENTRY.size)
+                    raw = idx.read(INDEX_ENTRY.size)
+                if len(raw) != INDEX_ENTRY.size:
+                    return False
+                (offset,) = INDEX_ENTRY.unpack(raw)
+                with open(self._path(peer_key), "r+b") as f:
+                    f.seek(offset)
+                    line = f.readline()
+                    slot = len(line) - len(b"}\n") - len(_DELIVERED_SLOTS[None])
+                    if line[slot - len(_DELIVERED_KEY):slot] != _DELIVERED_KEY or not line.endswith(b"}\n"):
+                        return False
+                    f.seek(offset + slot)
+                    f.write(_DELIVERED_SLOTS[bool(delivered)])
+            except (OSError, ValueError) as e:
+                print(f"History update error ({peer_key}): {e}")
+                return False
+        return True
+
+    def read(self, peer_key, before=None, limit=None):
+        """Entries oldest first: the newest `limit` (all if None) before position `before` (the end if None).
+
+        Each entry gets "seq", its position in the conversation; pass the oldest seq as `before` to
+        fetch the page before it.
+        """
+        with self._lock:
+            self._migrate(peer_key)
+            self._ensure_index(peer_key)
+            try:
+                idx_size = os.path.getsize(self._index_path(peer_key))
+            except OSError:
+                return []
+            count = idx_size // INDEX_ENTRY.size
+            end = count if before is None else max(0, min(int(before), count))
+            start = 0 if limit is None else max(0, end - int(limit))
+            if start >= end:
+                return []
+            try:
+                with open(self._index_path(peer_key), "rb") as idx:
+                    idx.seek(start * INDEX_ENTRY.size)
+                    raw_offsets = idx.read((min(end + 1, count) - start) * INDEX_ENTRY.size)
+                offsets = [o for (o,) in INDEX_ENTRY.iter_unpack(raw_offsets)]
+                with open(self._path(peer_key), "rb") as f:
+                    f.seek(offsets[0])
+                    if end < count:
+                        region = f.read(offsets.pop() - offsets[0])
+                    else:
+                        region = f.read()
+            except OSError:
+                return []
+        entries = []
+        base = offsets[0]
+        for seq, offset in enumerate(offsets, start):
+            rel = offset - base
+            nl = region.find(b"\n", rel)
+            try:
+                entry = json.loads(region[rel:nl if nl >= 0 else len(region)])
+            except ValueError:
+                continue
+            entry["seq"] = seq
+            entries.append(entry)
+        return entries
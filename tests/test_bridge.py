@@ -0,0 +1,99 @@
+"""Bridge behaviour that spans the resolver, settings and network (bridge.py). Nothing here sends to the network."""
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import bridge
+import wire
+
+FRIEND = "02:00:00:00:00:01"
+
+
+class BridgeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        patch = mock.patch.object(bridge, "_project_dir", return_value=self.dir)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.api = bridge.Bridge()
+        self.addCleanup(self.api._settings.flush)
+
+    def saved_user(self, mac):
+        self.api._settings.flush()
+        with open(self.api.settings_file) as f:
+            return next(u for u in json.load(f)["users"] if u["mac"] == mac)
+
+
+class ObservedIpTests(BridgeTestCase):
+    """Beacons and messages are unauthenticated: what they claim is used while fresh but never saved."""
+
+    def setUp(self):
+        super().setUp()
+        self.api.add_user({"name": "Sam", "mac": FRIEND, "ip": "192.0.2.10"})
+        self.api._on_beacon({"mac": FRIEND, "ip": "198.51.100.66", "name": "Sam?", "port": 5005, "proto": 5})
+
+    def test_observed_ip_is_used(self):
+        self.assertEqual(self.api.get_friend_ip(FRIEND), "198.51.100.66")
+        result = self.api.get_reachability_and_ip(FRIEND, "Sam")
+        self.assertEqual((result["ip"], result["source"]), ("198.51.100.66", "beacon"))
+        self.assertNotIn("saved", result["diagnostic"])
+
+    def test_observed_ip_is_never_saved(self):
+        self.api.get_reachability_and_ip(FRIEND, "Sam")
+        self.api.resolve_all([FRIEND])
+        with mock.patch.object(self.api, "_send_ping", return_value=(True, False, None)):
+            self.api._ping_user(FRIEND, "Sam")
+        with mock.patch.object(self.api.network, "ping_many_blocking", side_effect=lambda targets: [0.01] * len(targets)):
+            self.api.ping_many([FRIEND])
+        self.api.observe_peer(FRIEND, "198.51.100.67", "traffic")
+        self.assertEqual(self.saved_user(FRIEND)["ip"], "192.0.2.10")
+
+    def test_own_beacon_is_not_an_observation(self):
+        me = self.api.engine.get_my_mac().lower().replace("-", ":")
+        self.api._on_beacon({"mac": me, "ip": "198.51.100.1", "name": "me", "port": 5005, "proto": 5})
+        self.assertIsNone(self.api.resolver.observed(me))
+        self.assertIsNone(self.api.peers.get(me))
+
+
+class PingTests(BridgeTestCase):
+    def test_ping_returns_at_once_and_pushes_the_result(self):
+        self.api.add_user({"name": "Sam", "mac": FRIEND, "ip": "192.0.2.10"})
+        answered, pushed = threading.Event(), threading.Event()
+        self.api._send_ping = lambda ip: (answered.wait(5), True, 12.0)  # the PONG is slow to come back
+        self.api._notify_ui = mock.Mock(side_effect=lambda *a, **k: pushed.set())
+        self.assertEqual(self.api.ping_user(FRIEND, "Sam"), {"pending": True})
+        answered.set()
+        self.assertTrue(pushed.wait(5))
+        fn, mac, name, result = self.api._notify_ui.call_args[0]
+        self.assertEqual((fn, mac, name, result["delivered"], result["rtt_ms"]), ("onPingResult", FRIEND, "Sam", True, 12.0))
+
+
+class OldAppTests(BridgeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.api.add_user({"name": "Sam", "mac": FRIEND, "ip": "192.0.2.10"})  # never heard from: protocol 1
+        self.sent = []
+        patch = mock.patch.object(self.api.engine, "send_message_many", side_effect=lambda *a: self.sent.append(a))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_message_too_long_to_read_is_refused(self):
+        result = self.api.send_message(FRIEND, "x" * wire.LEGACY_MAX_DATAGRAM)
+        self.assertEqual(result["status"], "error")
+        room = self.api.create_room("Room", [FRIEND])
+        self.assertEqual(self.api.send_room_message(room["room_id"], "x" * wire.LEGACY_MAX_DATAGRAM)["status"], "error")
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.api.get_message_history(self.api._peer_key(FRIEND)), [])
+
+    def test_short_message_goes_out_whole(self):
+        self.assertEqual(self.api.send_message(FRIEND, "hi")["status"], "success")
+        (ips, payload, proto), = self.sent
+        self.assertEqual((ips, payload["text"], proto), (["192.0.2.10"], "hi", 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
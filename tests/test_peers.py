@@ -0,0 +1,140 @@
+"""PeerTable: offline / expiry timing, size bound, queries, and consistency of its heaps and indexes (peers.py)."""
+import collections
+import random
+import unittest
+
+import peers
+
+
+def beacon(n, name=None, ip=None, proto=5):
+    return {
+        "mac": "02:00:00:00:%02x:%02x" % (n // 256, n % 256),
+        "ip": ip or "192.0.2.%d" % (n % 250 + 1),
+        "name": name or "Peer %d" % n,
+        "port": 5005,
+        "proto": proto,
+    }
+
+
+class PeerTableTests(unittest.TestCase):
+    def check(self, table):
+        """Every index and counter agrees with the records."""
+        records = table._peers
+        self.assertLessEqual(len(records), table.max_size)
+        self.assertEqual(table._index, sorted(table._index))
+        self.assertEqual(table._index, sorted((not r.online, r.name.lower(), r.mac) for r in records.values()))
+        self.assertTrue(all(r.key == (not r.online, r.name.lower(), r.mac) for r in records.values()))
+        by_ip = collections.defaultdict(set)
+        for r in records.values():
+            by_ip[r.ip].add(r.mac)
+        self.assertEqual(dict(table._by_ip), dict(by_ip))
+        online = collections.Counter(r.proto for r in records.values() if r.online)
+        self.assertEqual(+table._online_protos, online)
+        live_stale = {id(rec) for _, _, rec in table._stale_heap if rec.key is not None}
+        live_expire = {id(rec) for _, _, rec in table._expire_heap if rec.key is not None}
+        for r in records.values():
+            self.assertIn(id(r), live_expire)
+            if r.online:
+                self.assertIn(id(r), live_stale)
+
+    def test_update_reports_changes(self):
+        table = peers.PeerTable()
+        view, changed, removed = table.update(beacon(1), 0.0)
+        self.assertTrue(changed)
+        self.assertEqual(removed, [])
+        self.assertTrue(view["online"])
+        self.assertFalse(table.update(beacon(1), 1.0)[1])
+        self.assertTrue(table.update(beacon(1, name="Renamed"), 2.0)[1])
+        self.assertTrue(table.update(beacon(1, name="Renamed", ip="192.0.2.200"), 3.0)[1])
+        self.assertEqual(table.get(beacon(1)["mac"])["last_seen"], 3.0)
+        self.check(table)
+
+    def test_goes_offline_then_is_forgotten(self):
+        table = peers.PeerTable(stale=15.0, expire=100.0)
+        table.update(beacon(1), 0.0)
+        table.update(beacon(2), 0.0)
+        table.update(beacon(2), 10.0)  # heard again: not stale at 16
+        self.assertEqual(table.next_expiry(10.0), 5.0)
+        offline, gone = table.expire(16.0)
+        self.assertEqual([v["mac"] for v in offline], [beacon(1)["mac"]])
+        self.assertEqual(gone, [])
+        self.assertFalse(table.get(beacon(1)["mac"])["online"])
+        self.assertEqual(table.next_expiry(16.0), 9.0)
+        self.check(table)
+        _, changed, _ = table.update(beacon(1), 20.0)  # back online
+        self.assertTrue(changed)
+        self.assertEqual(table.expire(20.0), ([], []))
+        offline, gone = table.expire(111.0)
+        self.assertEqual(sorted(v["mac"] for v in offline), sorted([beacon(1)["mac"], beacon(2)["mac"]]))
+        self.assertEqual(gone, [beacon(2)["mac"]])
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.expire(121.0), ([], [beacon(1)["mac"]]))
+        self.assertIsNone(table.next_expiry(121.0))
+        self.check(table)
+
+    def test_full_table_evicts_the_longest_silent(self):
+        table = peers.PeerTable(max_size=3)
+        for n in range(3):
+            table.update(beacon(n), float(n))
+        table.update(beacon(0), 5.0)
+        _, _, removed = table.update(beacon(3), 6.0)
+        self.assertEqual(removed, [beacon(1)["mac"]])
+        self.assertEqual(table.evicted, 1)
+        self.assertIsNone(table.get(beacon(1)["mac"]))
+        _, _, removed = table.update(beacon(1), 7.0)  # comes back, pushes out the next one
+        self.assertEqual(removed, [beacon(2)["mac"]])
+        self.check(table)
+
+    def test_query_orders_filters_and_pages(self):
+        table = peers.PeerTable(stale=15.0)
+        table.update(beacon(1, name="carol"), 0.0)
+        table.update(beacon(2, name="Alice"), 10.0)
+        table.update(beacon(3, name="bob"), 10.0)
+        table.expire(20.0)  # carol goes offline
+        total, page = table.query()
+        self.assertEqual(total, 3)
+        self.assertEqual([v["name"] for v in page], ["Alice", "bob", "carol"])
+        self.assertEqual([v["name"] for v in table.query(offset=1, limit=1)[1]], ["bob"])
+        self.assertEqual(table.query(online=True)[0], 2)
+        self.assertEqual([v["name"] for v in table.query(online=False)[1]], ["carol"])
+        self.assertEqual([v["name"] for v in table.query(text="ALI")[1]], ["Alice"])
+        self.assertEqual(table.query(text=beacon(3)["ip"])[0], 1)
+        self.assertEqual(table.query(exclude=beacon(2)["mac"], limit=10)[0], 2)
+        self.assertEqual(table.query(offset=5, limit=5), (3, []))
+
+    def test_protocol_lookups(self):
+        table = peers.PeerTable(stale=15.0)
+        self.assertIsNone(table.min_online_proto())
+        self.assertEqual(table.proto_for_ip("192.0.2.50"), 1)
+        table.update(beacon(1, ip="192.0.2.50", proto=3), 0.0)
+        table.update(beacon(2, ip="192.0.2.50", proto=5), 10.0)
+        self.assertEqual(table.proto_for_ip("192.0.2.50"), 5)
+        self.assertEqual(table.min_online_proto(), 3)
+        table.expire(16.0)
+        self.assertEqual(table.min_online_proto(), 5)
+        table.update(beacon(2, ip="192.0.2.50", proto=1), 17.0)  # downgraded
+        self.assertEqual(table.min_online_proto(), 1)
+        self.check(table)
+
+    def test_random_operations_keep_the_table_consistent(self):
+        rng = random.Random(1234)
+        table = peers.PeerTable(max_size=40, stale=15.0, expire=60.0)
+        now = 0.0
+        for step in range(5000):
+            now += rng.random()
+            if rng.random() < 0.1:
+                table.expire(now)
+            else:
+                n = rng.randrange(80)
+                table.update(beacon(n, name=rng.choice(["a", "B", "c", None]), proto=rng.choice([1, 3, 5])), now)
+            if step % 50 == 0:
+                self.check(table)
+                total, page = table.query(offset=3, limit=7)
+                self.assertEqual(total, len(table))
+                self.assertLessEqual(len(page), 7)
+        self.check(table)
+        self.assertGreater(table.evicted, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
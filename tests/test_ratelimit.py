@@ -0,0 +1,67 @@
+"""Per-source token buckets (ratelimit.py) and where the runtime applies them (runtime.py)."""
+import concurrent.futures
+import json
+import unittest
+
+import runtime
+from ratelimit import TokenBuckets
+from tests.test_runtime import FakeEngine, FakeTransport
+
+ADDR = ("192.0.2.7", 5005)
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_refill_at_rate(self):
+        buckets = TokenBuckets(rate=2, burst=3)
+        self.assertEqual([buckets.allow("a", 0.0) for _ in range(4)], [True, True, True, False])
+        self.assertFalse(buckets.allow("a", 0.4))  # 0.8 tokens
+        self.assertTrue(buckets.allow("a", 0.5))  # 1.0
+        self.assertFalse(buckets.allow("a", 0.5))
+        self.assertEqual(buckets.throttled, 3)
+
+    def test_never_holds_more_than_burst(self):
+        buckets = TokenBuckets(rate=100, burst=2)
+        buckets.allow("a", 0.0)
+        self.assertEqual([buckets.allow("a", 1000.0) for _ in range(3)], [True, True, False])
+
+    def test_keys_are_independent(self):
+        buckets = TokenBuckets(rate=1, burst=1)
+        self.assertTrue(buckets.allow("a", 0.0))
+        self.assertFalse(buckets.allow("a", 0.0))
+        self.assertTrue(buckets.allow("b", 0.0))
+
+    def test_least_recently_seen_key_is_forgotten(self):
+        buckets = TokenBuckets(rate=0.001, burst=1, max_keys=2)
+        buckets.allow("a", 0.0)
+        buckets.allow("b", 0.0)
+        buckets.allow("a", 0.0)  # a is now the most recent
+        buckets.allow("c", 0.0)  # pushes out b
+        self.assertEqual(list(buckets._buckets), ["a", "c"])
+        self.assertTrue(buckets.allow("b", 0.0))  # back with a full bucket
+
+
+class RuntimeLimitTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.network = runtime.NetworkRuntime(self.engine, {"ping_ip": (0.001, 3), "message_mac": (0.001, 2)})
+        self.network._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.network._worker.shutdown)
+
+    def test_pings_over_budget_are_not_answered(self):
+        transport = FakeTransport()
+        for _ in range(10):
+            self.network._handle_ping(transport, b"PING", ADDR)
+        self.network._handle_ping(transport, b"PING", ("192.0.2.8", 5005))
+        self.assertEqual(len(transport.sent), 4)
+        self.assertEqual(self.network.stats()["throttled"]["ping_ip"], 7)
+
+    def test_messages_over_the_senders_budget_are_not_acked(self):
+        for n in range(4):
+            data = json.dumps({"type": "msg", "sender_mac": "02:00:00:00:00:01", "text": "x", "id": "m-%d" % n})
+            self.network._handle_message(None, data.encode("utf-8"), ("192.0.2.%d" % n, 5007))  # one MAC, many IPs
+        self.assertEqual([a[1] for a in self.engine.acks], ["m-0", "m-1"])
+        self.assertEqual(self.network.stats()["throttled"]["message_mac"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""MAC -> IP resolution order, observation expiry and scan backoff (resolver.py)."""
+import unittest
+from unittest import mock
+
+import resolver
+
+ME = "02:00:00:00:00:aa"
+MAC = "02:00:00:00:00:01"
+
+
+class FakeNeighbors:
+    def __init__(self):
+        self.table = {}
+
+    def lookup(self, mac, max_age=None):
+        return self.table.get(mac)
+
+
+class FakeEngine:
+    def __init__(self):
+        self.neighbors = FakeNeighbors()
+        self.sweeps = []  # MAC lists swept for
+        self.found_by_sweep = {}
+
+    def get_my_mac(self):
+        return ME
+
+    def scan_for_macs(self, macs, on_found=None, hints=None, on_progress=None):
+        self.sweeps.append(list(macs))
+        for mac in macs:
+            if mac in self.found_by_sweep:
+                on_found(mac, self.found_by_sweep[mac])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class ResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.stored = {}
+        self.resolver = resolver.MacResolver(self.engine, self.stored.get)
+        self.clock = FakeClock()
+        patch = mock.patch.object(resolver, "time", self.clock)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+
+class LookupOrderTests(ResolverTestCase):
+    def test_fresh_observation_beats_saved_ip_beats_neighbour_table(self):
+        self.engine.neighbors.table[MAC] = "192.0.2.3"
+        self.assertEqual(self.resolver.lookup(MAC), ("192.0.2.3", "neighbor", 0.0))
+        self.stored[MAC] = "192.0.2.2"
+        self.assertEqual(self.resolver.lookup(MAC).source, "stored")
+        self.resolver.observe(MAC.upper(), "192.0.2.1", "beacon")
+        self.clock.now += 5
+        self.assertEqual(self.resolver.lookup(MAC), ("192.0.2.1", "beacon", 5.0))
+
+    def test_observation_expires(self):
+        self.stored[MAC] = "192.0.2.2"
+        self.resolver.observe(MAC, "192.0.2.1", "traffic")
+        self.clock.now += resolver.OBSERVATION_TTL + 1
+        self.assertEqual(self.resolver.lookup(MAC).source, "stored")
+
+    def test_this_device(self):
+        self.assertEqual(self.resolver.lookup(ME), ("127.0.0.1", "self", 0.0))
+
+    def test_resolve_sweeps_only_when_nothing_is_known(self):
+        self.engine.found_by_sweep[MAC] = "192.0.2.9"
+        self.assertEqual(self.resolver.resolve(MAC), ("192.0.2.9", "scan", 0.0))
+        self.stored[MAC] = "192.0.2.2"
+        self.assertEqual(self.resolver.resolve(MAC).source, "stored")
+        self.assertEqual(self.engine.sweeps, [[MAC]])
+
+
+class BackoffTests(ResolverTestCase):
+    # The clock stands still, so retry_in right after a sweep is the whole delay
+
+    def test_failed_sweeps_back_off_exponentially(self):
+        self.resolver.scan([MAC])
+        self.assertEqual(self.resolver.backoff(MAC).retry_in, resolver.BACKOFF_MIN)
+        self.engine.neighbors.table["02:00:00:00:00:99"] = "192.0.2.99"  # other hosts come and go
+        self.assertEqual(self.resolver.scan([MAC]), {})  # still backing off: nothing sent
+        self.clock.now += resolver.BACKOFF_MIN
+        self.resolver.scan([MAC])
+        self.assertEqual(self.resolver.backoff(MAC).retry_in, 2 * resolver.BACKOFF_MIN)
+        self.assertEqual(self.engine.sweeps, [[MAC], [MAC]])
+
+    def test_delay_is_capped(self):
+        for _ in range(20):
+            self.resolver.scan([MAC], force=True)
+        self.assertEqual(self.resolver.backoff(MAC).retry_in, resolver.BACKOFF_MAX)
+
+    def test_backoff_ends_when_the_mac_shows_up(self):
+        self.resolver.scan([MAC])
+        self.engine.neighbors.table[MAC] = "192.0.2.3"
+        self.assertIsNone(self.resolver.backoff(MAC))
+        del self.engine.neighbors.table[MAC]
+        self.resolver.observe(MAC, "192.0.2.1", "beacon")
+        self.assertIsNone(self.resolver.backoff(MAC))
+
+
+if __name__ == "__main__":
+    unittest.main()
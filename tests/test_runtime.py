@@ -0,0 +1,197 @@
+"""NetworkRuntime packet handling: acks, retransmission, duplicate suppression and the callback backlog (runtime.py).
+
+The handlers are driven directly with datagrams, without binding the app's fixed ports.
+"""
+import asyncio
+import concurrent.futures
+import json
+import threading
+import unittest
+from unittest import mock
+
+import runtime
+import wire
+from logic import ACK_PROTO, BINARY_PROTO
+
+ADDR = ("192.0.2.7", 5007)
+
+
+def message(message_id=None, text="hi", mac="02:00:00:00:00:01"):
+    return json.dumps({"type": "msg", "sender_mac": mac, "text": text, "id": message_id}).encode("utf-8")
+
+
+class FakeEngine:
+    port = 0
+
+    def __init__(self):
+        self.acks = []  # (ip, message id, binary)
+        self.sends = []  # (ip, message id, proto)
+        self.on_send = None
+        self.sendable = True  # what send_message_udp reports
+
+    def send_ack(self, ip, message_id, binary=False):
+        self.acks.append((ip, message_id, binary))
+
+    def send_message_udp(self, ip, payload, proto=1):
+        self.sends.append((ip, payload["id"], proto))
+        if self.on_send is not None:
+            self.on_send(ip, payload, len(self.sends))
+        return self.sendable
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+
+class RuntimeTestCase(unittest.TestCase):
+    rate_limits = None
+
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.network = runtime.NetworkRuntime(self.engine, self.rate_limits)
+        self.network._worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.network._sender = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.network._sender.shutdown)
+        self.received = []
+        self.network._on_message = lambda m: self.received.append(m["text"])
+
+    def drain(self):
+        """Wait for every queued callback to finish."""
+        self.network._worker.shutdown(wait=True)
+
+
+class AckTests(RuntimeTestCase):
+    def test_copies_are_all_acked_but_shown_once(self):
+        for _ in range(3):
+            self.network._handle_message(None, message("m-1"), ADDR)
+        self.network._handle_message(None, message("m-2", "second"), ADDR)
+        self.drain()
+        self.assertEqual(self.received, ["hi", "second"])
+        self.assertEqual([a[1] for a in self.engine.acks], ["m-1", "m-1", "m-1", "m-2"])
+
+    def test_binary_messages_get_binary_acks(self):
+        data = wire.encode_message({"sender_mac": "02:00:00:00:00:01", "id": "m-1", "text": "hi"})
+        self.network._handle_message(None, data, ADDR)
+        self.drain()
+        self.assertEqual(self.engine.acks, [(ADDR[0], "m-1", True)])
+        self.assertEqual(self.network.peer_proto(ADDR[0]), BINARY_PROTO)
+
+    def test_messages_without_id_are_not_acked(self):
+        self.network._handle_message(None, message(None), ADDR)
+        self.network._handle_message(None, message(None), ADDR)
+        self.drain()
+        self.assertEqual(self.received, ["hi", "hi"])
+        self.assertEqual(self.engine.acks, [])
+
+    def test_same_id_from_different_senders_is_not_a_duplicate(self):
+        self.network._handle_message(None, message("m-1", mac="02:00:00:00:00:01"), ADDR)
+        self.network._handle_message(None, message("m-1", mac="02:00:00:00:00:02"), ADDR)
+        self.drain()
+        self.assertEqual(len(self.received), 2)
+
+
+class DeliverTests(RuntimeTestCase):
+    def deliver(self, proto, acks_on_send=None):
+        """Run _deliver on a private loop; the peer acks the sends numbered in acks_on_send."""
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            self.network._window = asyncio.Semaphore(runtime.MAX_IN_FLIGHT)
+
+            def on_send(ip, payload, count):
+                if acks_on_send and count in acks_on_send:
+                    ack = json.dumps({"type": "ack", "id": payload["id"]}).encode("utf-8")
+                    loop.call_soon_threadsafe(self.network._handle_message, None, ack, (ip, 5007))
+
+            self.engine.on_send = on_send
+            return await self.network._deliver(ADDR[0], {"type": "msg", "id": "m-1", "text": "hi"}, proto)
+
+        with mock.patch.object(runtime, "ACK_TIMEOUTS", (0.05, 0.05, 0.05, 0.1)):
+            return asyncio.run(run())
+
+    def test_acked_at_once(self):
+        self.assertIs(self.deliver(ACK_PROTO, acks_on_send={1}), True)
+        self.assertEqual(len(self.engine.sends), 1)
+
+    def test_retransmitted_until_acked(self):
+        self.assertIs(self.deliver(ACK_PROTO, acks_on_send={3}), True)
+        self.assertEqual(len(self.engine.sends), 3)
+
+    def test_never_acked_is_not_delivered(self):
+        self.assertIs(self.deliver(ACK_PROTO), False)
+        self.assertEqual(len(self.engine.sends), len(runtime.ACK_TIMEOUTS))
+
+    def test_peer_that_never_acks_is_unknown(self):
+        self.assertIsNone(self.deliver(1))
+        self.assertEqual(self.engine.sends, [(ADDR[0], "m-1", 1)])
+
+    def test_unsendable_message_to_a_peer_that_never_acks_is_not_delivered(self):
+        self.engine.sendable = False
+        self.assertIs(self.deliver(1), False)
+
+    def test_ack_from_an_older_app_still_counts(self):
+        self.assertIs(self.deliver(1, acks_on_send={1}), True)
+
+
+class BacklogTests(RuntimeTestCase):
+    # Plenty of budget: these tests are about the queue, not the rate limits
+    rate_limits = {"ping_ip": (1e6, 1e6), "message_mac": (1e6, 1e6)}
+
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.network._on_ping = lambda ip: self.release.wait(5)  # the worker is stuck on a slow callback
+        patch = mock.patch.dict(runtime.CALLBACK_BACKLOG, {"pings": 3, "messages": 2})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_pings_are_answered_while_their_callbacks_are_dropped(self):
+        transport = FakeTransport()
+        for n in range(10):
+            self.network._handle_ping(transport, b"PING:%d" % n, ADDR)
+        self.assertEqual(len(transport.sent), 10)
+        self.assertEqual(self.network.stats()["dropped"], {"pings": 7})
+        self.release.set()
+        self.drain()
+        self.assertEqual(self.network.stats()["backlog"]["pings"], 0)
+
+    def test_messages_that_do_not_fit_are_not_acked(self):
+        self.network._handle_ping(FakeTransport(), b"PING", ADDR)  # block the worker
+        for n in range(5):
+            self.network._handle_message(None, message("m-%d" % n, "t%d" % n), ADDR)
+        self.assertEqual([a[1] for a in self.engine.acks], ["m-0", "m-1"])
+        self.assertEqual(self.network.stats()["dropped"]["messages"], 3)
+        self.release.set()
+        self.drain()
+        self.assertEqual(self.received, ["t0", "t1"])
+
+    def test_beacons_do_not_wait_for_callbacks(self):
+        self.network._handle_ping(FakeTransport(), b"PING", ADDR)  # block the worker
+        self.network._beaconer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.network._beaconer.shutdown)
+        self.network._beacon_info = lambda: ("me", "02:00:00:00:00:aa", "192.0.2.1", 5005, True)
+        sent = []
+        self.engine.get_broadcast_addresses = lambda: []
+        self.engine.encode_beacon = lambda *info: b"BEACON"
+        self.engine.broadcast_beacon = sent.append
+
+        async def run():
+            self.network._beacon_wake = asyncio.Event()
+            task = asyncio.ensure_future(self.network._beacon_loop())
+            for _ in range(100):
+                if sent:
+                    break
+                await asyncio.sleep(0.01)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(sent, [b"BEACON"])
+
+
+if __name__ == "__main__":
+    unittest.main()
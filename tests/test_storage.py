@@ -0,0 +1,209 @@
+"""Settings store and message history log (storage.py)."""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import storage
+
+
+class SettingsStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "settings.json")
+
+    def write(self, data):
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+
+    def test_missing_file_gives_defaults(self):
+        self.assertEqual(storage.SettingsStore(self.path).get(), storage.SETTINGS_DEFAULTS)
+
+    def test_reads_are_served_from_memory(self):
+        self.write({"display_name": "Alex"})
+        store = storage.SettingsStore(self.path)
+        first = store.get()
+        self.assertEqual(first["display_name"], "Alex")
+        self.assertEqual(first["users"], [])  # defaults filled in
+        with mock.patch("builtins.open", side_effect=AssertionError("re-read")):
+            self.assertIs(store.get(), first)
+
+    def test_outside_edits_are_picked_up(self):
+        self.write({"display_name": "Alex"})
+        store = storage.SettingsStore(self.path)
+        store.get()
+        self.write({"display_name": "Sam, edited by hand"})
+        with mock.patch.object(storage, "STAT_INTERVAL", 0):
+            store._next_stat = 0.0
+            self.assertEqual(store.get()["display_name"], "Sam, edited by hand")
+
+    def test_half_written_file_keeps_last_good_copy(self):
+        self.write({"display_name": "Alex"})
+        store = storage.SettingsStore(self.path)
+        store.get()
+        with open(self.path, "w") as f:
+            f.write('{"display_na')
+        store._next_stat = 0.0
+        self.assertEqual(store.get()["display_name"], "Alex")
+
+    def test_nested_edits_are_written_once(self):
+        store = storage.SettingsStore(self.path)
+        with mock.patch.object(storage, "FLUSH_DELAY", 60):
+            with store.edit() as outer:
+                outer["display_name"] = "Alex"
+                with store.edit() as inner:
+                    self.assertIs(inner, outer)
+                    inner["alerts_pinned"] = True
+                self.assertNotEqual(store.get()["display_name"], "Alex")  # applied when the outer block ends
+        self.assertEqual(store.get()["display_name"], "Alex")
+        self.assertTrue(store.get()["alerts_pinned"])
+        self.assertFalse(os.path.exists(self.path))  # write is debounced
+        store.flush()
+        self.assertIsNone(store._flush_timer)
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["display_name"], "Alex")
+        self.assertEqual(os.listdir(self.dir), ["settings.json"])  # temp file replaced, not left behind
+
+    def test_failed_edit_changes_nothing(self):
+        store = storage.SettingsStore(self.path)
+        with self.assertRaises(KeyError):
+            with store.edit() as s:
+                s["display_name"] = "Alex"
+                raise KeyError("oops")
+        self.assertEqual(store.get()["display_name"], "")
+        self.assertIsNone(store._flush_timer)
+
+    def test_snapshots_are_never_modified(self):
+        store = storage.SettingsStore(self.path)
+        before = store.get()
+        with store.edit() as s:
+            s["users"].append({"name": "Sam", "mac": "02:00:00:00:00:01", "ip": ""})
+        self.assertEqual(before["users"], [])
+        self.assertEqual(len(store.get()["users"]), 1)
+        store.flush()
+
+    def test_unsaved_edits_win_over_the_file(self):
+        store = storage.SettingsStore(self.path)
+        with store.edit() as s:
+            s["display_name"] = "Alex"
+        self.write({"display_name": "Someone else"})
+        store._next_stat = 0.0
+        self.assertEqual(store.get()["display_name"], "Alex")
+        store.flush()
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["display_name"], "Alex")
+
+
+PEER = "dm_02_00_00_00_00_01"
+
+
+class MessageHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.history = storage.MessageHistory(self.dir)
+
+    def path(self, ext=".jsonl"):
+        return os.path.join(self.dir, PEER + ext)
+
+    def fill(self, count, history=None):
+        for i in range(count):
+            self.assertEqual((history or self.history).append(PEER, {"text": f"m{i}"}), i)
+
+    def texts(self, entries):
+        return [e["text"] for e in entries]
+
+    def test_appends_add_one_line_each(self):
+        self.fill(3)
+        with open(self.path()) as f:
+            self.assertEqual([json.loads(line)["text"] for line in f], ["m0", "m1", "m2"])
+        self.assertEqual(self.texts(storage.MessageHistory(self.dir).read(PEER)), ["m0", "m1", "m2"])
+
+    def test_unknown_conversation_is_empty(self):
+        self.assertEqual(self.history.read("nobody"), [])
+
+    def test_torn_last_line_is_skipped_and_next_append_starts_fresh(self):
+        self.fill(3)
+        with open(self.path(), "ab") as f:
+            f.write(b'{"text": "half a mes')  # crash mid-append, index never written
+        history = storage.MessageHistory(self.dir)
+        self.assertEqual(self.texts(history.read(PEER)), ["m0", "m1", "m2"])
+        self.assertEqual(history.append(PEER, {"text": "m3"}), 3)
+        self.assertEqual(self.texts(history.read(PEER)), ["m0", "m1", "m2", "m3"])
+
+    def test_corrupt_line_in_the_middle_is_skipped(self):
+        self.fill(2)
+        with open(self.path(), "ab") as f:
+            f.write(b"not json\n")
+        os.remove(self.path(".idx"))
+        history = storage.MessageHistory(self.dir)
+        self.assertEqual(self.texts(history.read(PEER)), ["m0", "m1"])
+        self.assertEqual(history.append(PEER, {"text": "m2"}), 2)
+        self.assertEqual([e["seq"] for e in history.read(PEER)], [0, 1, 2])
+
+    def test_old_json_history_is_migrated(self):
+        with open(self.path(".json"), "w") as f:
+            json.dump([{"text": "old0"}, {"text": "old1"}], f)
+        self.assertEqual(self.history.append(PEER, {"text": "new"}), 2)
+        self.assertEqual(self.texts(self.history.read(PEER)), ["old0", "old1", "new"])
+        self.assertFalse(os.path.exists(self.path(".json")))
+
+    def test_pages_from_the_end(self):
+        self.fill(10)
+        newest = self.history.read(PEER, limit=4)
+        self.assertEqual(self.texts(newest), ["m6", "m7", "m8", "m9"])
+        self.assertEqual([e["seq"] for e in newest], [6, 7, 8, 9])
+        self.assertEqual(self.texts(self.history.read(PEER, before=6, limit=4)), ["m2", "m3", "m4", "m5"])
+        self.assertEqual(self.texts(self.history.read(PEER, before=2, limit=4)), ["m0", "m1"])
+        self.assertEqual(self.history.read(PEER, before=0, limit=4), [])
+        self.assertEqual(len(self.history.read(PEER)), 10)
+
+    def test_line_written_but_not_indexed_is_picked_up(self):
+        self.fill(3)
+        with open(self.path(), "ab") as f:
+            f.write(b'{"text": "unindexed"}\n')
+        history = storage.MessageHistory(self.dir)
+        self.assertEqual(self.texts(history.read(PEER, limit=2)), ["m2", "unindexed"])
+        self.assertEqual(history.append(PEER, {"text": "m4"}), 4)
+
+    def test_missing_or_torn_index_is_rebuilt(self):
+        self.fill(5)
+        with open(self.path(".idx"), "r+b") as idx:
+            idx.truncate(os.path.getsize(self.path(".idx")) - 3)
+        self.assertEqual(self.texts(storage.MessageHistory(self.dir).read(PEER, limit=2)), ["m3", "m4"])
+        os.remove(self.path(".idx"))
+        history = storage.MessageHistory(self.dir)
+        self.assertEqual(self.texts(history.read(PEER, before=2)), ["m0", "m1"])
+        self.assertEqual(os.path.getsize(self.path(".idx")), 5 * storage.INDEX_ENTRY.size)
+
+    def test_mark_delivered_in_place(self):
+        self.history.append(PEER, {"text": "before"})
+        seq = self.history.append(PEER, {"text": "tracked", "delivered": None})
+        self.history.append(PEER, {"text": "after"})
+        size = os.path.getsize(self.path())
+        for value in (True, False, True):
+            self.assertTrue(self.history.mark_delivered(PEER, seq, value))
+            self.assertEqual(os.path.getsize(self.path()), size)
+            self.assertEqual(self.history.read(PEER)[seq]["delivered"], value)
+        self.assertEqual(self.texts(self.history.read(PEER)), ["before", "tracked", "after"])
+        with open(self.path()) as f:
+            for line in f:
+                json.loads(line)
+
+    def test_unsettled_delivery_reads_back_as_none(self):
+        seq = self.history.append(PEER, {"text": "to an older app", "delivered": None})
+        self.assertIsNone(storage.MessageHistory(self.dir).read(PEER)[seq]["delivered"])
+
+    def test_mark_delivered_needs_a_slot(self):
+        self.history.append(PEER, {"text": "untracked"})
+        self.assertFalse(self.history.mark_delivered(PEER, 0, True))
+        self.assertFalse(self.history.mark_delivered(PEER, 5, True))
+        self.assertFalse(self.history.mark_delivered("nobody", 0, True))
+        self.assertNotIn("delivered", self.history.read(PEER)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Batched, merged calls into a window's JavaScript (ui_events.py)."""
+import json
+import re
+import threading
+import unittest
+
+import ui_events
+
+
+class FakeWindow:
+    def __init__(self):
+        self.calls = []
+        self.called = threading.Event()
+
+    def evaluate_js(self, js):
+        self.calls.append(js)
+        self.called.set()
+
+    def batches(self):
+        """Each evaluate_js call as its list of [fn, args, count]."""
+        batches = []
+        for js in self.calls:
+            match = re.fullmatch(re.escape(ui_events.UI_ENTRY) + r"\((.*)\)", js, re.S)
+            batches.append(json.loads(match.group(1)))
+        return batches
+
+
+class UIDispatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.window = FakeWindow()
+        # A long first frame so everything posted below lands in one batch
+        self.ui = ui_events.UIDispatcher(lambda: self.window, frame_min=0.2, frame_max=0.2)
+
+    def wait(self):
+        self.assertTrue(self.window.called.wait(5))
+
+    def test_events_are_sent_together_in_order(self):
+        self.ui.post("onA", 1, "x")
+        self.ui.post("onB", {"k": [1, 2]})
+        self.ui.post("onA", 2, "y")
+        self.wait()
+        self.assertEqual(self.window.batches(), [[["onA", [1, "x"], 1], ["onB", [{"k": [1, 2]}], 1], ["onA", [2, "y"], 1]]])
+        self.assertEqual((self.ui.calls, self.ui.events), (1, 3))
+
+    def test_merged_events_keep_the_latest_arguments_and_count(self):
+        for n in range(50):
+            self.ui.post("showAlert", "192.0.2.7", n, merge=("ping", "192.0.2.7"))
+        self.ui.post("showAlert", "192.0.2.8", 0, merge=("ping", "192.0.2.8"))
+        self.wait()
+        self.assertEqual(
+            self.window.batches(), [[["showAlert", ["192.0.2.7", 49], 50], ["showAlert", ["192.0.2.8", 0], 1]]]
+        )
+
+    def test_arguments_are_escaped_as_json(self):
+        self.ui.post("onIncomingMessage", "</script><b>'\"\\")
+        self.wait()
+        self.assertEqual(self.window.batches()[0][0][1], ["</script><b>'\"\\"])
+
+    def test_unserializable_arguments_raise_at_once(self):
+        with self.assertRaises(TypeError):
+            self.ui.post("onA", object())
+        self.assertEqual(self.ui.events, 0)
+
+    def test_no_window_drops_the_batch(self):
+        ui = ui_events.UIDispatcher(lambda: None, frame_min=0.0, frame_max=0.0)
+        ui.post("onA", 1)
+        ui._thread.join(0.2)
+        self.assertEqual(ui.calls, 0)
+
+    def test_calls_are_spaced_by_the_frame(self):
+        ui = ui_events.UIDispatcher(lambda: self.window, frame_min=0.0, frame_max=0.3)
+        ui.post("onA", 1)
+        self.wait()
+        self.window.called.clear()
+        ui.post("onA", 2)
+        ui.post("onA", 3)
+        self.wait()
+        self.assertEqual([len(b) for b in self.window.batches()], [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+"""Binary packets, JSON compatibility of the parsers, and fragment reassembly (wire.py / logic.py)."""
+import json
+import os
+import struct
+import unittest
+import zlib
+
+import logic
+import wire
+
+ADDR = ("192.0.2.7", 5007)
+MESSAGE = {
+    "type": "msg",
+    "sender_mac": "02:00:00:00:00:01",
+    "sender_ip": "192.0.2.7",
+    "id": "m-1",
+    "sender_name": "Zoë",
+    "room_id": "r1",
+    "room_name": "Kitchen ☕",
+    "text": "hello " * 50,
+}
+
+
+class PacketTests(unittest.TestCase):
+    def test_beacon_round_trip(self):
+        data = wire.encode_beacon("Desk", "02:00:00:00:00:01", "192.0.2.7", 5005, logic.PROTO_VERSION)
+        self.assertEqual(wire.packet_kind(data), wire.KIND_BEACON)
+        self.assertEqual(
+            wire.decode_beacon(data),
+            {"name": "Desk", "mac": "02:00:00:00:00:01", "ip": "192.0.2.7", "port": 5005, "proto": logic.PROTO_VERSION},
+        )
+
+    def test_message_round_trip(self):
+        data = wire.encode_message(MESSAGE)
+        self.assertEqual(wire.packet_kind(data), wire.KIND_MESSAGE)
+        self.assertEqual(wire.decode_message(data), MESSAGE)
+
+    def test_empty_fields_decode_as_unset(self):
+        decoded = wire.decode_message(wire.encode_message({"text": "hi"}))
+        self.assertEqual((decoded["sender_mac"], decoded["sender_ip"]), ("", ""))
+        self.assertIsNone(decoded["id"])
+        self.assertIsNone(decoded["room_id"])
+
+    def test_ack_and_ping_round_trip(self):
+        self.assertEqual(wire.decode_ack(wire.encode_ack("m-1")), "m-1")
+        pong = wire.encode_ping(0x1_0000_0005, wire.KIND_PONG)
+        self.assertEqual(wire.packet_kind(pong), wire.KIND_PONG)
+        self.assertEqual(wire.decode_ping(pong), 5)
+
+    def test_trailing_bytes_are_ignored(self):
+        data = wire.encode_beacon("Desk", "02:00:00:00:00:01", "192.0.2.7", 5005, 9) + b"field from a later version"
+        self.assertEqual(wire.decode_beacon(data)["name"], "Desk")
+
+    def test_unknown_version_is_not_binary(self):
+        data = bytearray(wire.encode_ack("m-1"))
+        data[3] = wire.PACKET_VERSION + 1
+        self.assertIsNone(wire.packet_kind(bytes(data)))
+
+    def test_string_too_long_for_prefix(self):
+        with self.assertRaises(ValueError):
+            wire.encode_message({"id": "x" * 256})
+
+    def test_every_truncation_is_rejected(self):
+        packets = [
+            wire.encode_beacon("Desk", "02:00:00:00:00:01", "192.0.2.7", 5005, 5),
+            wire.encode_message(MESSAGE),
+            wire.encode_ack("m-1"),
+            wire.encode_ping(7),
+        ]
+        decoders = {
+            wire.KIND_BEACON: wire.decode_beacon,
+            wire.KIND_MESSAGE: wire.decode_message,
+            wire.KIND_ACK: wire.decode_ack,
+            wire.KIND_PING: wire.decode_ping,
+        }
+        for data in packets:
+            decode = decoders[wire.packet_kind(data)]
+            for end in range(wire.PACKET_HEADER.size, len(data)):
+                with self.assertRaises((ValueError, struct.error), msg=f"{data[:end]!r}"):
+                    decode(data[:end])
+
+
+class ParserCompatibilityTests(unittest.TestCase):
+    """logic.py parsers read both the binary packets and the JSON older apps send, and never raise."""
+
+    def test_message_json_and_binary_agree(self):
+        from_json = logic.parse_message(json.dumps(MESSAGE).encode("utf-8"), ADDR)
+        from_binary = logic.parse_message(wire.encode_message(MESSAGE), ADDR)
+        self.assertEqual(from_json, from_binary)
+        self.assertEqual(from_json["text"], MESSAGE["text"])
+
+    def test_legacy_message_without_id(self):
+        legacy = {"type": "msg", "sender_name": "Old", "sender_mac": "02-00-00-00-00-0A", "text": "hi"}
+        parsed = logic.parse_message(json.dumps(legacy).encode("utf-8"), ADDR)
+        self.assertEqual(parsed["sender_mac"], "02:00:00:00:00:0a")
+        self.assertEqual(parsed["sender_ip"], ADDR[0])
+        self.assertIsNone(parsed["id"])
+
+    def test_beacon_json_and_binary_agree(self):
+        as_json = json.dumps(
+            {"type": "beacon", "name": "Desk", "mac": "02:00:00:00:00:01", "ip": "192.0.2.7", "port": 5005, "proto": 5}
+        ).encode("utf-8")
+        as_binary = wire.encode_beacon("Desk", "02:00:00:00:00:01", "192.0.2.7", 5005, 5)
+        self.assertEqual(logic.parse_beacon(as_json, ADDR), logic.parse_beacon(as_binary, ADDR))
+
+    def test_ack_json_and_binary_agree(self):
+        self.assertEqual(logic.parse_ack(b'{"type": "ack", "id": "m-1"}'), "m-1")
+        self.assertEqual(logic.parse_ack(wire.encode_ack("m-1")), "m-1")
+        self.assertIsNone(logic.parse_ack(wire.encode_message(MESSAGE)))
+
+    def test_wrong_kind_is_not_parsed(self):
+        self.assertIsNone(logic.parse_message(wire.encode_ack("m-1"), ADDR))
+        self.assertIsNone(logic.parse_beacon(wire.encode_message(MESSAGE), ADDR))
+
+    def test_truncated_and_garbage_packets_are_dropped(self):
+        data = wire.encode_message(MESSAGE)
+        for end in range(len(data)):
+            self.assertIsNone(logic.parse_message(data[:end], ADDR))
+        for junk in (b"", b"\xff\xfe", b"RPb", b"[1, 2]", b'{"type": "msg", "text": 5}' + b"\x00", os.urandom(64)):
+            logic.parse_message(junk, ADDR)
+            logic.parse_beacon(junk, ADDR)
+            logic.parse_ack(junk)
+
+
+class ReassemblyTests(unittest.TestCase):
+    def test_small_payload_passes_through(self):
+        self.assertEqual(wire.frame(b"hi"), [b"hi"])
+        self.assertEqual(wire.Reassembler().feed(b"hi", ADDR), b"hi")
+
+    def test_round_trip_in_any_order_with_duplicates(self):
+        payload = os.urandom(wire.FRAGMENT_SIZE * 5 + 17)  # incompressible: sent as is
+        fragments = wire.frame(payload)
+        self.assertEqual(len(fragments), 6)
+        self.assertTrue(all(len(f) <= wire.FRAGMENT_HEADER.size + wire.FRAGMENT_SIZE for f in fragments))
+        r = wire.Reassembler()
+        results = [r.feed(f, ADDR) for f in reversed(fragments + fragments[:2])]
+        self.assertEqual([x for x in results if x is not None], [payload])
+
+    def test_compressed_round_trip(self):
+        payload = json.dumps({**MESSAGE, "text": "abc" * 100000}).encode("utf-8")
+        fragments = wire.frame(payload)
+        self.assertLess(len(fragments), len(payload) // wire.FRAGMENT_SIZE)
+        r = wire.Reassembler()
+        self.assertEqual([r.feed(f, ADDR) for f in fragments][-1], payload)
+
+    def test_legacy_peers_get_whole_datagrams(self):
+        payload = b"x" * (wire.LEGACY_MAX_DATAGRAM - 1)
+        self.assertEqual(wire.frame(payload, wire.LEGACY_MAX_DATAGRAM), [payload])
+
+    def test_senders_do_not_mix(self):
+        fragments = wire.frame(os.urandom(3000))
+        r = wire.Reassembler()
+        self.assertIsNone(r.feed(fragments[0], ("192.0.2.8", 5007)))
+        for f in fragments[1:]:
+            self.assertIsNone(r.feed(f, ADDR))
+
+    def test_truncated_and_inconsistent_fragments_are_dropped(self):
+        fragments = wire.frame(os.urandom(3000))
+        r = wire.Reassembler()
+        self.assertIsNone(r.feed(fragments[0][:wire.FRAGMENT_HEADER.size - 1], ADDR))
+        _, version, frame_id, index, count, flags = wire.FRAGMENT_HEADER.unpack_from(fragments[0])
+        bad_index = wire.FRAGMENT_HEADER.pack(wire.FRAGMENT_MAGIC, version, frame_id, count, count, flags)
+        self.assertIsNone(r.feed(bad_index, ADDR))
+        r.feed(fragments[0], ADDR)
+        other_count = wire.FRAGMENT_HEADER.pack(wire.FRAGMENT_MAGIC, version, frame_id, 1, count + 1, flags)
+        self.assertIsNone(r.feed(other_count + b"x", ADDR))
+
+    def test_oversized_fragment_count_is_refused(self):
+        count = wire.MAX_PAYLOAD // wire.FRAGMENT_SIZE + 2
+        header = wire.FRAGMENT_HEADER.pack(wire.FRAGMENT_MAGIC, wire.FRAGMENT_VERSION, 1, 0, count, 0)
+        r = wire.Reassembler()
+        self.assertIsNone(r.feed(header + b"x" * wire.FRAGMENT_SIZE, ADDR))
+        self.assertEqual(r._bytes, 0)
+
+    def test_zip_bomb_is_refused(self):
+        bomb = zlib.compress(b"\0" * (wire.MAX_PAYLOAD * 4), 9)
+        count = (len(bomb) + wire.FRAGMENT_SIZE - 1) // wire.FRAGMENT_SIZE
+        r = wire.Reassembler()
+        results = [
+            r.feed(
+                wire.FRAGMENT_HEADER.pack(wire.FRAGMENT_MAGIC, wire.FRAGMENT_VERSION, 9, i, count, wire.FLAG_ZLIB)
+                + bomb[i * wire.FRAGMENT_SIZE:(i + 1) * wire.FRAGMENT_SIZE],
+                ADDR,
+            )
+            for i in range(count)
+        ]
+        self.assertEqual(results, [None] * count)
+        self.assertEqual(r.dropped, 1)
+
+    def test_corrupt_compressed_payload_is_dropped(self):
+        header = wire.FRAGMENT_HEADER.pack(wire.FRAGMENT_MAGIC, wire.FRAGMENT_VERSION, 3, 0, 1, wire.FLAG_ZLIB)
+        r = wire.Reassembler()
+        self.assertIsNone(r.feed(header + b"not zlib", ADDR))
+        self.assertEqual(r.dropped, 1)
+
+    def test_memory_cap_drops_oldest_partial(self):
+        first, second = os.urandom(5000), os.urandom(5000)
+        r = wire.Reassembler(max_bytes=6000)  # room for one of them, not both
+        first_fragments, second_fragments = wire.frame(first), wire.frame(second)
+        for f in first_fragments[:4] + second_fragments[:2]:
+            self.assertIsNone(r.feed(f, ADDR))
+        self.assertEqual(r.dropped, 1)
+        self.assertLessEqual(r._bytes, r.max_bytes)
+        self.assertIsNone(r.feed(first_fragments[4], ADDR))  # started over: the rest of it is gone
+        self.assertEqual([r.feed(f, ADDR) for f in second_fragments[2:]][-1], second)
+
+    def test_timeout_drops_partial(self):
+        r = wire.Reassembler(timeout=0.0)
+        fragments = wire.frame(os.urandom(3000))
+        r.feed(fragments[0], ADDR)
+        r.feed(fragments[1], ("192.0.2.9", 5007))  # any later fragment expires the stale ones
+        self.assertEqual(r.dropped, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
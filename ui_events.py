@@ -0,0 +1,86 @@
+"""
+Batched calls into a window's JavaScript: events posted from any thread are gathered for a few milliseconds and sent
+as one evaluate_js per batch, so a ping storm or a chatty room costs a handful of cross-process calls per second
+instead of one per packet.
+"""
+import json
+import threading
+import time
+
+# A batch goes out this long (seconds) after its first event...
+UI_FRAME_MIN = 0.016
+# ...but never sooner than this long after the previous batch, which caps both the call rate and the wait
+UI_FRAME_MAX = 0.05
+# JS function in each window that takes the batch: uiBatch([[fn, args, count], ...])
+UI_ENTRY = "uiBatch"
+
+
+class UIDispatcher:
+    """Posts window.<fn>(...args) calls to one webview window in batches, on its own daemon thread.
+
+    post() with a merge key folds the call into a pending one with the same key: the newer arguments win and its
+    count goes up (e.g. repeated pings from one sender become one showAlert(ip, count)). JS receives the count as
+    an extra last argument when it is above 1.
+    """
+
+    def __init__(self, get_window, before_flush=None, frame_min=UI_FRAME_MIN, frame_max=UI_FRAME_MAX):
+        self._get_window = get_window  # () -> window or None (the window may be replaced while running)
+        self._before_flush = before_flush  # called on the dispatcher thread before each batch, e.g. to show it
+        self.frame_min = frame_min
+        self.frame_max = frame_max
+        self._cond = threading.Condition()
+        self._pending = []  # [fn, JSON-encoded args, count]
+        self._merged = {}  # merge key -> its entry in _pending
+        self._first = None  # monotonic time the oldest pending event was posted
+        self._last_flush = 0.0
+        self._thread = None
+        self.calls = 0  # evaluate_js calls made
+        self.events = 0  # events posted (merged ones included)
+
+    def post(self, fn, *args, merge=None):
+        """Queue window.<fn>(*args). Raises TypeError / ValueError if the arguments are not JSON-serializable."""
+        encoded = json.dumps(args)
+        with self._cond:
+            self.events += 1
+            entry = self._merged.get(merge) if merge is not None else None
+            if entry is not None:
+                entry[1] = encoded
+                entry[2] += 1
+                return
+            entry = [fn, encoded, 1]
+            self._pending.append(entry)
+            if merge is not None:
+                self._merged[merge] = entry
+            if self._first is None:
+                self._first = time.monotonic()
+                self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ui-events", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._first is None:
+                    self._cond.wait()
+                due = max(self._first + self.frame_min, self._last_flush + self.frame_max)
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                batch, self._pending, self._merged, self._first = self._pending, [], {}, None
+                self._last_flush = time.monotonic()
+            self._flush(batch)
+
+    def _flush(self, batch):
+        window = self._get_window()
+        if window is None:
+            return
+        try:
+            if self._before_flush is not None:
+                self._before_flush()
+            events = ",".join(f"[{json.dumps(fn)},{args},{count}]" for fn, args, count in batch)
+            window.evaluate_js(f"{UI_ENTRY}([{events}])")
+            self.calls += 1
+        except Exception as e:
+            print(f"UI update error ({', '.join(sorted({fn for fn, _, _ in batch}))}): {e}")
@@ -0,0 +1,260 @@
+"""
+Wire formats.
+
+Binary packets: PACKET_HEADER (magic, version, kind), then the kind's fixed fields and length-prefixed UTF-8
+strings; MACs are 6 raw bytes and IPv4 addresses 4. Decoders read the fields they know and ignore any bytes after
+them, so later versions can append fields without breaking older readers. Anything without PACKET_MAGIC is
+treated as the original JSON (or bare PING/PONG) by the callers in logic.py / runtime.py.
+
+Framing for datagrams too big to send whole: a payload is (optionally) zlib-compressed and split into fragments
+that each fit in one Ethernet frame, then put back together on the receiving side.
+Fragment layout (little-endian): FRAGMENT_HEADER, then up to FRAGMENT_SIZE bytes of the (compressed) payload.
+Anything that does not start with FRAGMENT_MAGIC is an ordinary whole datagram and passes straight through.
+"""
+import collections
+import os
+import socket
+import struct
+import time
+import zlib
+
+PACKET_MAGIC = b"RPb"
+PACKET_VERSION = 1
+PACKET_HEADER = struct.Struct("<3sBB")  # magic, version, kind
+KIND_BEACON = 1
+KIND_MESSAGE = 2
+KIND_ACK = 3
+KIND_PING = 4
+KIND_PONG = 5
+_BEACON = struct.Struct("<6s4sHB")  # mac, ip, ping port, protocol version; then str16 name
+_MESSAGE = struct.Struct("<6s4s")  # sender mac, sender ip; then str8 id, str16 sender name, room id, room name, str32 text
+_NONCE = struct.Struct("<I")
+_STR8 = struct.Struct("<B")
+_STR16 = struct.Struct("<H")
+_STR32 = struct.Struct("<I")
+
+FRAGMENT_MAGIC = b"RPf"
+FRAGMENT_VERSION = 1
+# magic, version, frame id (random, per payload), fragment index, fragment count, flags
+FRAGMENT_HEADER = struct.Struct("<3sBQHHB")
+FLAG_ZLIB = 0x1
+# Payload bytes per fragment: header + this stays well under a 1500-byte MTU after IP/UDP headers
+FRAGMENT_SIZE = 1200
+# Payloads larger than this are compressed (when that makes them smaller)
+COMPRESS_THRESHOLD = 512
+# Biggest datagram apps without framing can read (they call recvfrom(4096))
+LEGACY_MAX_DATAGRAM = 4096
+# Incomplete payloads are dropped this long (seconds) after their first fragment arrived...
+REASSEMBLY_TIMEOUT = 5.0
+# ...or, oldest first, when all incomplete payloads together hold more than this many bytes
+REASSEMBLY_MAX_BYTES = 4 * 1024 * 1024
+# Largest payload accepted (after decompression); also caps how many fragments one payload may claim
+MAX_PAYLOAD = 1024 * 1024
+
+
+def _mac_bytes(mac):
+    try:
+        raw = bytes.fromhex((mac or "").replace(":", "").replace("-", ""))
+    except ValueError:
+        raw = b""
+    return raw if len(raw) == 6 else b"\0" * 6
+
+
+def _mac_text(raw):
+    return "" if raw == b"\0" * 6 else ":".join("%02x" % b for b in raw)
+
+
+def _ip_bytes(ip):
+    try:
+        return socket.inet_aton(ip or "0.0.0.0")
+    except OSError:
+        return b"\0" * 4
+
+
+def _ip_text(raw):
+    return "" if raw == b"\0" * 4 else socket.inet_ntoa(raw)
+
+
+def _pack_str(prefix, text):
+    raw = (text or "").encode("utf-8")
+    if len(raw) >= 1 << (8 * prefix.size):
+        raise ValueError("string too long for its length prefix")
+    return prefix.pack(len(raw)) + raw
+
+
+def _unpack_str(prefix, data, pos):
+    (length,) = prefix.unpack_from(data, pos)
+    pos += prefix.size
+    if pos + length > len(data):
+        raise ValueError("truncated string")
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+def packet_kind(data):
+    """The KIND_* of a binary packet, or None if data is not one (e.g. legacy JSON) or is from a newer version
+    this one cannot read."""
+    if len(data) < PACKET_HEADER.size or data[:3] != PACKET_MAGIC:
+        return None
+    _, version, kind = PACKET_HEADER.unpack_from(data)
+    return kind if version == PACKET_VERSION else None
+
+
+def encode_beacon(name, mac, ip, port, proto):
+    return (
+        PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, KIND_BEACON)
+        + _BEACON.pack(_mac_bytes(mac), _ip_bytes(ip), int(port), int(proto))
+        + _pack_str(_STR16, name)
+    )
+
+
+def decode_beacon(data):
+    """{name, mac, ip, port, proto} ("" for unset MAC / IP). Raises ValueError / struct.error if malformed."""
+    mac, ip, port, proto = _BEACON.unpack_from(data, PACKET_HEADER.size)
+    name, _ = _unpack_str(_STR16, data, PACKET_HEADER.size + _BEACON.size)
+    return {"name": name, "mac": _mac_text(mac), "ip": _ip_text(ip), "port": port, "proto": proto}
+
+
+def encode_message(payload):
+    """Binary form of a message payload dict (the keys parse_message in logic.py produces)."""
+    return (
+        PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, KIND_MESSAGE)
+        + _MESSAGE.pack(_mac_bytes(payload.get("sender_mac")), _ip_bytes(payload.get("sender_ip")))
+        + _pack_str(_STR8, payload.get("id"))
+        + _pack_str(_STR16, payload.get("sender_name"))
+        + _pack_str(_STR16, payload.get("room_id"))
+        + _pack_str(_STR16, payload.get("room_name"))
+        + _pack_str(_STR32, payload.get("text"))
+    )
+
+
+def decode_message(data):
+    """Message payload dict (id / room_id / room_name None when empty). Raises ValueError / struct.error if malformed."""
+    mac, ip = _MESSAGE.unpack_from(data, PACKET_HEADER.size)
+    pos = PACKET_HEADER.size + _MESSAGE.size
+    message_id, pos = _unpack_str(_STR8, data, pos)
+    sender_name, pos = _unpack_str(_STR16, data, pos)
+    room_id, pos = _unpack_str(_STR16, data, pos)
+    room_name, pos = _unpack_str(_STR16, data, pos)
+    text, pos = _unpack_str(_STR32, data, pos)
+    return {
+        "type": "msg",
+        "sender_mac": _mac_text(mac),
+        "sender_ip": _ip_text(ip),
+        "id": message_id or None,
+        "sender_name": sender_name,
+        "room_id": room_id or None,
+        "room_name": room_name or None,
+        "text": text,
+    }
+
+
+def encode_ack(message_id):
+    return PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, KIND_ACK) + _pack_str(_STR8, message_id)
+
+
+def decode_ack(data):
+    return _unpack_str(_STR8, data, PACKET_HEADER.size)[0]
+
+
+def encode_ping(nonce, kind=KIND_PING):
+    return PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, kind) + _NONCE.pack(nonce & 0xFFFFFFFF)
+
+
+def decode_ping(data):
+    """The nonce of a binary PING or PONG."""
+    return _NONCE.unpack_from(data, PACKET_HEADER.size)[0]
+
+
+def frame(payload, max_whole=FRAGMENT_SIZE):
+    """Datagrams to send for payload (bytes): the payload itself if it is at most max_whole bytes, else fragments.
+    Only for peers that can reassemble (FRAME_PROTO); older apps cannot read fragments at all."""
+    if len(payload) <= max_whole:
+        return [payload]
+    flags = 0
+    if len(payload) > COMPRESS_THRESHOLD:
+        packed = zlib.compress(payload, 6)
+        if len(packed) < len(payload):
+            payload, flags = packed, FLAG_ZLIB
+    count = (len(payload) + FRAGMENT_SIZE - 1) // FRAGMENT_SIZE
+    if count > 0xFFFF:
+        raise ValueError("payload too large to frame")
+    (frame_id,) = struct.unpack("<Q", os.urandom(8))
+    return [
+        FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, FRAGMENT_VERSION, frame_id, index, count, flags)
+        + payload[index * FRAGMENT_SIZE:(index + 1) * FRAGMENT_SIZE]
+        for index in range(count)
+    ]
+
+
+def is_fragment(data):
+    return data[:3] == FRAGMENT_MAGIC
+
+
+class Reassembler:
+    """Puts fragmented payloads back together. feed() every datagram received on a port; it returns each complete
+    payload once (whole datagrams straight away) and None while fragments are still missing.
+
+    Partial payloads are kept per (sender IP, frame id) and bounded by REASSEMBLY_TIMEOUT and REASSEMBLY_MAX_BYTES.
+    Not thread-safe: feed from one thread (the network loop).
+    """
+
+    def __init__(self, timeout=REASSEMBLY_TIMEOUT, max_bytes=REASSEMBLY_MAX_BYTES, max_payload=MAX_PAYLOAD):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_payload = max_payload
+        self._partial = collections.OrderedDict()  # (ip, frame id) -> [first seen, count, flags, {index: chunk}, size]
+        self._bytes = 0
+        self.dropped = 0  # partial payloads given up on (timed out, over the memory cap, or corrupt)
+
+    def feed(self, data, addr):
+        if not is_fragment(data):
+            return data
+        if len(data) < FRAGMENT_HEADER.size:
+            return None
+        _, version, frame_id, index, count, flags = FRAGMENT_HEADER.unpack_from(data)
+        if version != FRAGMENT_VERSION or index >= count or count * FRAGMENT_SIZE > self.max_payload + FRAGMENT_SIZE:
+            return None
+        now = time.monotonic()
+        self._expire(now)
+        key = (addr[0], frame_id)
+        entry = self._partial.get(key)
+        if entry is None:
+            entry = self._partial[key] = [now, count, flags, {}, 0]
+        elif entry[1] != count:
+            return None
+        chunk = data[FRAGMENT_HEADER.size:]
+        if index in entry[3]:
+            return None  # duplicate fragment
+        entry[3][index] = chunk
+        entry[4] += len(chunk)
+        self._bytes += len(chunk)
+        if len(entry[3]) < count:
+            while self._bytes > self.max_bytes and self._partial:
+                self._drop(next(iter(self._partial)))
+            return None
+        self._partial.pop(key)
+        self._bytes -= entry[4]
+        payload = b"".join(entry[3][i] for i in range(count))
+        if flags & FLAG_ZLIB:
+            inflater = zlib.decompressobj()
+            try:
+                payload = inflater.decompress(payload, self.max_payload)
+            except zlib.error:
+                self.dropped += 1
+                return None
+            if inflater.unconsumed_tail:
+                self.dropped += 1  # would decompress to more than max_payload
+                return None
+        return payload
+
+    def _expire(self, now):
+        while self._partial:
+            key, entry = next(iter(self._partial.items()))
+            if now - entry[0] < self.timeout:
+                break
+            self._drop(key)
+
+    def _drop(self, key):
+        entry = self._partial.pop(key)
+        self._bytes -= entry[4]
+        self.dropped += 1